@@ -49,6 +49,20 @@ import tkinter as tk
 from tkinter import messagebox, ttk
 import threading
 import subprocess
+import base64
+import uuid
+from array import array
+
+# Gemeinsame Bausteine (typing_core) liegen im Wurzelverzeichnis des Repositorys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from typing_core.keystrokes import KeystrokeRecorder
+from typing_core import scoring
+from typing_core.sync import SyncClient, BackgroundSync
+
+# Optionaler Upload der Ergebnisse zum Webserver (aus, solange keine URL gesetzt ist)
+SYNC_URL = os.environ.get("WRITESPEEDI_SYNC_URL")
+SYNC_USER = os.environ.get("WRITESPEEDI_SYNC_USER")
+SYNC_PASSWORD = os.environ.get("WRITESPEEDI_SYNC_PASSWORD")
 
 # Testtext Optionen
 # Dieses Dictionary enthält verschiedene Testtexte in verschiedenen Sprachen
@@ -58,6 +72,259 @@ test_texts = {
     'de': "Der schnelle braune Fuchs springt über den faulen Hund"
 }
 
+class ResultsStore:
+    # Append-only Ergebnisprotokoll im JSON-Lines-Format (ein Ergebnis pro Zeile)
+    # Ein neues Ergebnis wird mit einem einzigen Schreibvorgang angehängt, statt
+    # die komplette Historie neu zu schreiben
+    # Beim Laden wird nur ein Index der Zeilenanfänge aufgebaut, einzelne Seiten
+    # werden bei Bedarf direkt aus der Datei gelesen (read_page)
+    # Eine beim Absturz halb geschriebene Zeile wird übersprungen
+    # und bei der nächsten Verdichtung (compact) entfernt
+    # Eine alte results.json wird beim ersten Start automatisch übernommen
+    def __init__(self, path="results.jsonl", legacy_path="results.json"):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.damaged_lines = 0
+        self.offsets = array("Q")
+        self.migrate()
+        self.build_index()
+    
+    def migrate(self):
+        # Übernimmt eine vorhandene results.json in das neue Format
+        if os.path.exists(self.path) or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, "r") as f:
+                results = json.load(f)
+        except json.JSONDecodeError:
+            results = []
+        self._rewrite(results)
+        os.replace(self.legacy_path, self.legacy_path + ".bak")
+    
+    def build_index(self):
+        # Liest die Datei einmal zeilenweise und merkt sich nur die Zeilenanfänge
+        self.offsets = array("Q")
+        self.damaged_lines = 0
+        try:
+            with open(self.path, "rb") as f:
+                offset = 0
+                for line in f:
+                    if self._parse(line) is None:
+                        self.damaged_lines += 1
+                    else:
+                        self.offsets.append(offset)
+                    offset += len(line)
+        except FileNotFoundError:
+            pass
+    
+    @staticmethod
+    def _parse(line):
+        # Liefert das Ergebnis einer Zeile oder None für eine beschädigte Zeile
+        if not line.endswith(b"\n"):
+            # Unvollständige letzte Zeile
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+    
+    def __len__(self):
+        return len(self.offsets)
+    
+    def __iter__(self):
+        # Liefert alle Ergebnisse nacheinander, ohne die ganze Datei zu laden
+        for start in range(0, len(self.offsets), 500):
+            yield from self.read_page(start, 500)
+    
+    def read_page(self, start, count):
+        # Liest count Ergebnisse ab Index start direkt aus der Datei
+        offsets = self.offsets[start:start + count]
+        if not offsets:
+            return []
+        page = []
+        with open(self.path, "rb") as f:
+            f.seek(offsets[0])
+            for offset in offsets:
+                if f.tell() != offset:
+                    # Beschädigte Zeilen dazwischen überspringen
+                    f.seek(offset)
+                page.append(self._parse(f.readline()))
+        return page
+    
+    def append(self, result):
+        # Hängt ein Ergebnis atomar als eine Zeile an und liefert seinen Index
+        line = (json.dumps(result) + "\n").encode("utf-8")
+        with open(self.path, "ab+") as f:
+            # Nach einem Absturz endet die Datei evtl. ohne Zeilenumbruch
+            end = f.seek(0, os.SEEK_END)
+            if end > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = b"\n" + line
+                    end += 1
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.offsets.append(end)
+        return len(self.offsets) - 1
+    
+    def compact(self):
+        # Schreibt die Datei ohne beschädigte Zeilen neu
+        self._rewrite(list(self))
+        self.build_index()
+    
+    def clear(self):
+        # Löscht alle Ergebnisse
+        self._rewrite([])
+        self.build_index()
+    
+    def _rewrite(self, results):
+        # Schreibt zuerst in eine temporäre Datei und ersetzt dann atomar
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+class ResultsOutbox:
+    # Sicht von typing_core.sync auf den ResultsStore
+    # Die lokale ID eines Ergebnisses ist sein Index + 1; die Reihenfolge
+    # bleibt beim Verdichten erhalten, nur clear() fängt wieder bei 1 an
+    # Geräte-ID und Synchronisationsstand liegen in einer eigenen Datei
+    # (results.sync.json); nach clear() gibt reset() eine neue Geräte-ID aus,
+    # damit der Server die neuen Ergebnisse nicht für bekannte hält
+    def __init__(self, store, path="results.sync.json"):
+        self.store = store
+        self.path = path
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = None
+        if state is None:
+            self.reset()
+        else:
+            self.device = state["device"]
+            self.cursor = state["cursor"]
+    
+    def reset(self):
+        self.device = uuid.uuid4().hex
+        self.cursor = 0
+        self._save()
+    
+    def pending(self, after, limit):
+        # Läuft im Synchronisations-Thread und liest direkt aus der Datei
+        pending = []
+        for index, result in enumerate(self.store.read_page(after, limit), after + 1):
+            if result is None:
+                continue
+            date = time.mktime(time.strptime(result["date"], "%Y-%m-%d %H:%M:%S"))
+            pending.append([index, date, result["wpm"], result["accuracy"], result.get("keystrokes")])
+        return pending
+    
+    def synced(self, cursor):
+        self.cursor = cursor
+        self._save()
+    
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"device": self.device, "cursor": self.cursor}, f)
+        os.replace(tmp_path, self.path)
+
+class VirtualTable:
+    # Virtualisierte Tabelle auf Basis eines ttk.Treeview
+    # Die Tabelle enthält immer nur so viele Zeilen, wie sichtbar sind; beim
+    # Scrollen werden deren Werte ausgetauscht statt neue Zeilen anzulegen
+    # Die Daten kommen seitenweise über fetch(start, count) aus dem Speicher,
+    # ein kleiner Puffer (margin) über und unter dem sichtbaren Bereich
+    # vermeidet einen Lesezugriff bei jedem einzelnen Scrollschritt
+    def __init__(self, parent, columns, count, fetch, format_row, height=15, margin=30):
+        self.count = count
+        self.fetch = fetch
+        self.format_row = format_row
+        self.height = height
+        self.margin = margin
+        self.first = 0
+        self.cache_start = 0
+        self.cache = []
+        
+        self.frame = tk.Frame(parent, bg="#f0f0f0")
+        self.tree = ttk.Treeview(self.frame, columns=columns, show="headings", height=height)
+        for column in columns:
+            self.tree.heading(column, text=column)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        # Mausrad (Windows/macOS und X11)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_by(-1 if e.delta > 0 else 1))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_by(-1))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_by(1))
+    
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+    
+    def pack_forget(self):
+        self.frame.pack_forget()
+    
+    def on_scrollbar(self, action, value, unit=None):
+        # Wird von der Scrollbar aufgerufen ("moveto" oder "scroll")
+        if action == "moveto":
+            self.scroll_to(int(float(value) * self.count()))
+        elif action == "scroll":
+            step = self.height if unit == "pages" else 1
+            self.scroll_by(int(value) * step)
+    
+    def scroll_by(self, rows):
+        self.scroll_to(self.first + rows)
+    
+    def scroll_to(self, first):
+        self.first = max(0, min(first, self.count() - self.height))
+        self.refresh()
+    
+    def scroll_to_end(self):
+        self.scroll_to(self.count())
+    
+    def rows(self, start, count):
+        # Liefert die Zeilen aus dem Puffer und lädt ihn bei Bedarf neu
+        end = min(start + count, self.count())
+        if start < self.cache_start or end > self.cache_start + len(self.cache):
+            self.cache_start = max(0, start - self.margin)
+            self.cache = self.fetch(self.cache_start, end - self.cache_start + self.margin)
+        offset = start - self.cache_start
+        return self.cache[offset:offset + end - start]
+    
+    def refresh(self):
+        # Füllt die sichtbaren Zeilen neu und passt die Scrollbar an
+        total = self.count()
+        rows = self.rows(self.first, self.height)
+        items = self.tree.get_children()
+        for i, row in enumerate(rows):
+            values = self.format_row(row)
+            if i < len(items):
+                self.tree.item(items[i], values=values)
+            else:
+                self.tree.insert("", "end", values=values)
+        for item in items[len(rows):]:
+            self.tree.delete(item)
+        
+        if total:
+            self.scrollbar.set(self.first / total, min(1.0, (self.first + self.height) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+    
+    def on_append(self):
+        # Ein neues Ergebnis am Ende: nur nachladen, wenn es sichtbar wird
+        self.cache = []
+        self.scroll_to_end()
+    
+    def reset(self):
+        self.cache = []
+        self.scroll_to(0)
+
 class TypingSpeedGUI:
     def __init__(self):
         # Hauptfenster-Initialisierung
@@ -132,9 +399,13 @@ class TypingSpeedGUI:
         self.input_frame = tk.Frame(self.test_frame, bg="#f0f0f0")
         self.input_frame.pack(fill=tk.X)
         
+        # Jede Änderung wird über validatecommand gemeldet (Aktion, Position, Text),
+        # damit die Bewertung nur die geänderten Zeichen verrechnen muss
         self.input_entry = tk.Entry(self.input_frame,
                                   font=("Arial", 14),
-                                  width=50)
+                                  width=50,
+                                  validate="key",
+                                  validatecommand=(self.root.register(self.track_edit), "%d", "%i", "%S"))
         self.input_entry.pack(fill=tk.X, expand=True, padx=10)
         
         # Ergebnisse
@@ -192,54 +463,62 @@ class TypingSpeedGUI:
         # Tabelle für Statistiken
         # Die Tabelle zeigt alle gespeicherten Testergebnisse an
         # Sie enthält Spalten für Datum, WPM und Genauigkeit
-        self.stats_table = ttk.Treeview(self.stats_frame,
-                                      columns=("Datum", "WPM", "Genauigkeit"),
-                                      show="headings")
-        
-        self.stats_table.heading("Datum", text="Datum")
-        self.stats_table.heading("WPM", text="WPM")
-        self.stats_table.heading("Genauigkeit", text="Genauigkeit")
+        # Es werden nur die sichtbaren Zeilen angelegt, die Ergebnisse werden
+        # seitenweise aus dem Ergebnisspeicher gelesen
+        self.stats_table = VirtualTable(self.stats_frame,
+                                        columns=("Datum", "WPM", "Genauigkeit"),
+                                        count=lambda: len(self.results),
+                                        fetch=lambda start, count: self.results.read_page(start, count),
+                                        format_row=self.format_result)
         
         self.stats_table.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
         # Aktuelle Test- und Zeitvariablen
         self.current_test = None
         self.start_time = None
+        self.scorer = None
+        
+        # Zeichen und Zeitabstände jedes Tastendrucks (für Wiedergabe und Auswertung)
+        self.recorder = KeystrokeRecorder()
+        
+        # Ergebnisspeicher (results.jsonl)
+        self.results = ResultsStore()
         
-        # Ergebnisliste
-        self.results = []
+        # Upload zum Webserver im Hintergrund, die Datei bleibt die Warteschlange
+        self.sync = None
+        if SYNC_URL and SYNC_USER and SYNC_PASSWORD:
+            self.outbox = ResultsOutbox(self.results)
+            self.sync = BackgroundSync(SyncClient(SYNC_URL, SYNC_USER, SYNC_PASSWORD), self.outbox)
         
         # Lade gespeicherte Ergebnisse
         self.load_results()
         
     def load_results(self):
-        # Lädt gespeicherte Testergebnisse aus der Datei results.json
-        try:
-            with open("results.json", "r") as f:
-                self.results = json.load(f)
-            self.update_stats_table()
-        except FileNotFoundError:
-            self.results = []
-        except json.JSONDecodeError:
-            self.results = []
-            self.save_results()
-    
-    def save_results(self):
-        # Speichert die Testergebnisse in der Datei results.json
-        with open("results.json", "w") as f:
-            json.dump(self.results, f)
+        # Lädt gespeicherte Testergebnisse aus der Datei results.jsonl
+        # Beschädigte Zeilen (z.B. nach einem Absturz) werden vorher entfernt
+        if self.results.damaged_lines:
+            self.results.compact()
+        
+        self.update_stats_table()
+        
+        # Offline gespeicherte Ergebnisse hochladen
+        if self.sync:
+            self.sync.kick()
     
     def update_stats_table(self):
         # Aktualisiert die Statistik-Tabelle mit den gespeicherten Ergebnissen
-        for item in self.stats_table.get_children():
-            self.stats_table.delete(item)
-            
-        for result in self.results:
-            self.stats_table.insert("", "end", values=(
-                result["date"],
-                result["wpm"],
-                f"{result["accuracy"]}%"
-            ))
+        self.stats_table.reset()
+    
+    @staticmethod
+    def format_result(result):
+        # Wandelt ein Ergebnis in die Werte einer Tabellenzeile um
+        if result is None:
+            return ("?", "?", "?")
+        return (
+            result["date"],
+            result["wpm"],
+            f"{result['accuracy']}%"
+        )
     
     def start_test(self):
         # Startet einen neuen Test
@@ -257,6 +536,8 @@ class TypingSpeedGUI:
         # Timer starten
         self.start_time = time.time()
         self.current_test = test_text
+        self.scorer = scoring.IncrementalScorer(test_text)
+        self.recorder.reset()
         
         # Eingabefeld aktualisieren
         self.input_entry.config(state=tk.NORMAL)
@@ -275,46 +556,61 @@ class TypingSpeedGUI:
         end_time = time.time()
         time_elapsed = end_time - self.start_time
         
-        # WPM berechnen
-        words = typed_text.split()
-        wpm = len(words) / (time_elapsed / 60)
-        
-        # Genauigkeit berechnen
-        correct_chars = sum(1 for a, b in zip(typed_text, self.current_test) if a == b)
-        accuracy = (correct_chars / len(self.current_test)) * 100
-        
-        return {
-            "wpm": round(wpm, 1),
-            "accuracy": round(accuracy, 1),
-            "time": round(time_elapsed, 1)
-        }
+        # Vollständige Neuberechnung über den gesamten Text (typing_core.scoring)
+        return scoring.score(typed_text, self.current_test, time_elapsed)
+    
+    def calculate_live_results(self):
+        # Berechnet die Ergebnisse aus den fortlaufenden Zählern der Bewertung
+        if not self.current_test:
+            return None
+            
+        return self.scorer.result(time.time() - self.start_time)
+    
+    def track_edit(self, action, index, text):
+        # Wird von Tk vor jeder Änderung des Eingabefelds aufgerufen
+        # action: 1 = Einfügen, 0 = Löschen; muss True liefern, damit die Änderung erfolgt
+        if self.scorer is not None:
+            if action == "1":
+                start = int(index)
+                for offset, char in enumerate(text):
+                    position = start + offset
+                    expected = self.current_test[position] if position < len(self.current_test) else None
+                    self.recorder.record(char, char == expected)
+                self.scorer.insert(start, text)
+            elif action == "0":
+                # Ein Rückschritt je gelöschtem Zeichen, auch bei Markierungen
+                for _ in text:
+                    self.recorder.record("\b", False)
+                self.scorer.delete(int(index), len(text))
+        return True
     
     def save_result(self, result):
         # Speichert ein Testergebnis
         self.results.append({
             "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "wpm": result["wpm"],
-            "accuracy": result["accuracy"]
+            "accuracy": result["accuracy"],
+            # Komprimierte Tastendruck-Daten, base64-kodiert für JSON
+            "keystrokes": base64.b64encode(self.recorder.encode()).decode()
         })
-        self.save_results()
-        self.update_stats_table()
+        self.stats_table.on_append()
+        if self.sync:
+            self.sync.kick()
     
     def update_input(self, event):
         # Aktualisiert die Eingabe und berechnet die Ergebnisse
         if not self.current_test:
             return
             
-        typed_text = self.input_entry.get()
-        
-        # Berechne vorläufige Ergebnisse
-        results = self.calculate_results(typed_text)
+        # Berechne vorläufige Ergebnisse aus den fortlaufenden Zählern
+        results = self.calculate_live_results()
         if results:
             self.wpm_label.config(text=f"WPM: {results['wpm']}")
             self.accuracy_label.config(text=f"Genauigkeit: {results['accuracy']}%")
             self.time_label.config(text=f"Zeit: {results['time']} Sekunden")
             
         # Wenn der Text abgeschlossen ist
-        if typed_text == self.current_test:
+        if self.scorer.is_complete():
             self.end_test(results)
     
     def end_test(self, results):
@@ -328,6 +624,7 @@ class TypingSpeedGUI:
         
         self.current_test = None
         self.start_time = None
+        self.scorer = None
         self.input_entry.config(state=tk.DISABLED)
     
     def show_reset_password(self):
@@ -362,8 +659,9 @@ class TypingSpeedGUI:
     def reset_stats(self, password, window):
         # Zurücksetzen der Statistiken nach erfolgreicher Authentifizierung
         if password == "admin123":
-            self.results = []
-            self.save_results()
+            self.results.clear()
+            if self.sync:
+                self.outbox.reset()
             self.update_stats_table()
             messagebox.showinfo("Erfolgreich", "Statistiken wurden zurückgesetzt")
             window.destroy()
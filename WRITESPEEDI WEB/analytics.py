@@ -0,0 +1,219 @@
+"""Vectorized analytics over the whole score history.
+
+All scores are pulled from the database as NumPy columns (id, user id, WPM,
+accuracy, unix timestamp) kept sorted by user and time. Every statistic is
+computed with array operations; per-user figures use reduceat over the
+contiguous user groups instead of a Python loop per user.
+
+Reading millions of rows through the DB-API is the expensive part, so it is
+done once. When new scores arrive, invalidate() only drops the cached results
+and the next query fetches the rows past the highest known id and merges them
+into the sorted columns. reset() is for deletions and forces a full reload.
+"""
+import threading
+
+import numpy as np
+
+PERCENTILES = (10, 25, 50, 75, 90, 95, 99)
+SECONDS_PER_DAY = 86400
+
+
+class ScoreColumns:
+    def __init__(self, score_id, user_id, wpm, accuracy, timestamp, presorted=False):
+        if not presorted:
+            # Sort by user, then time, so each user's scores are one contiguous slice
+            order = np.lexsort((timestamp, user_id))
+            score_id, user_id, wpm, accuracy, timestamp = (
+                score_id[order], user_id[order], wpm[order], accuracy[order], timestamp[order])
+        self.score_id = score_id
+        self.user_id = user_id
+        self.wpm = wpm
+        self.accuracy = accuracy
+        self.timestamp = timestamp
+        self.max_id = int(score_id.max()) if len(score_id) else 0
+
+        # Group boundaries, the columns are already sorted by user
+        self.starts = np.concatenate(([0], np.flatnonzero(np.diff(user_id)) + 1)) if len(user_id) else np.empty(0, np.int64)
+        self.users = user_id[self.starts]
+        self.counts = np.diff(np.append(self.starts, len(user_id)))
+        self.best = np.maximum.reduceat(wpm, self.starts) if len(wpm) else np.empty(0)
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        """Build columns from chunks of (id, user_id, wpm, accuracy, unix_time) rows"""
+        parts = [np.array(chunk, dtype=np.float64).reshape(-1, 5) for chunk in chunks if chunk]
+        data = np.concatenate(parts) if parts else np.empty((0, 5))
+        return cls(data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2], data[:, 3],
+                   data[:, 4].astype(np.int64))
+
+    def sort_key(self):
+        return self.user_id << 32 | self.timestamp
+
+    def merge(self, other):
+        """Insert another (smaller) set of columns, keeping the sort order"""
+        if not len(other):
+            return self
+        positions = np.searchsorted(self.sort_key(), other.sort_key(), side='right')
+        return ScoreColumns(*(np.insert(mine, positions, theirs) for mine, theirs in (
+            (self.score_id, other.score_id), (self.user_id, other.user_id), (self.wpm, other.wpm),
+            (self.accuracy, other.accuracy), (self.timestamp, other.timestamp))), presorted=True)
+
+    def __len__(self):
+        return len(self.wpm)
+
+    def user_slice(self, user_id):
+        i = np.searchsorted(self.users, user_id)
+        if i == len(self.users) or self.users[i] != user_id:
+            return slice(0, 0)
+        return slice(self.starts[i], self.starts[i] + self.counts[i])
+
+
+def _percentiles(values):
+    if not len(values):
+        return {}
+    return {f"p{p}": round(float(v), 1) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def _slopes(x, y, starts, counts):
+    """Least-squares slope of y over x for every group at once"""
+    n = counts.astype(np.float64)
+    sum_x = np.add.reduceat(x, starts)
+    sum_y = np.add.reduceat(y, starts)
+    sum_xy = np.add.reduceat(x * y, starts)
+    sum_xx = np.add.reduceat(x * x, starts)
+    denominator = n * sum_xx - sum_x * sum_x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, (n * sum_xy - sum_x * sum_y) / denominator, 0.0)
+
+
+def moving_average(values, window):
+    if len(values) < window:
+        return []
+    cumulative = np.cumsum(np.insert(values, 0, 0.0))
+    return np.round((cumulative[window:] - cumulative[:-window]) / window, 1).tolist()
+
+
+class Analytics:
+    def __init__(self, fetch_chunks):
+        # fetch_chunks(after_id) yields row chunks for scores with a larger id
+        self.fetch_chunks = fetch_chunks
+        self._lock = threading.Lock()
+        self._columns = None
+        self._stale = False
+        self._results = {}
+        self.version = 0
+
+    def invalidate(self):
+        """New scores were added: drop cached results, merge the new rows on next use"""
+        with self._lock:
+            self._stale = True
+            self._results = {}
+            self.version += 1
+
+    def reset(self):
+        """Scores were deleted: drop everything, the next query reloads from scratch"""
+        with self._lock:
+            self._columns = None
+            self._results = {}
+            self.version += 1
+
+    def columns(self):
+        with self._lock:
+            if self._columns is None:
+                self._columns = ScoreColumns.from_chunks(self.fetch_chunks(0))
+            elif self._stale:
+                delta = ScoreColumns.from_chunks(self.fetch_chunks(self._columns.max_id))
+                self._columns = self._columns.merge(delta)
+            self._stale = False
+            return self._columns
+
+    def _cached(self, key, compute):
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+            version = self.version
+        result = compute()
+        with self._lock:
+            # Only keep it if no new scores arrived while computing
+            if version == self.version:
+                self._results[key] = result
+        return result
+
+    def global_summary(self, min_games=5, top=10):
+        return self._cached(('global', min_games, top), lambda: self._global_summary(min_games, top))
+
+    def _global_summary(self, min_games, top):
+        cols = self.columns()
+        if not len(cols):
+            return {'scores': 0, 'users': 0}
+
+        days = (cols.timestamp - cols.timestamp.min()) / SECONDS_PER_DAY
+        slopes = _slopes(days, cols.wpm, cols.starts, cols.counts)
+        eligible = np.flatnonzero(cols.counts >= min_games)
+        improvers = eligible[np.argsort(slopes[eligible])[::-1][:top]]
+
+        return {
+            'scores': len(cols),
+            'users': len(cols.users),
+            'averageWPM': round(float(cols.wpm.mean()), 1),
+            'averageAccuracy': round(float(cols.accuracy.mean()), 1),
+            'wpm': _percentiles(cols.wpm),
+            'accuracy': _percentiles(cols.accuracy),
+            'bestWPM': _percentiles(cols.best),
+            'topImprovers': [{'userId': int(cols.users[i]),
+                              'wpmPerDay': round(float(slopes[i]), 3),
+                              'games': int(cols.counts[i])} for i in improvers]
+        }
+
+    def histogram(self, bins=20, user_id=None):
+        return self._cached(('histogram', bins, user_id), lambda: self._histogram(bins, user_id))
+
+    def _histogram(self, bins, user_id):
+        cols = self.columns()
+        wpm = cols.wpm if user_id is None else cols.wpm[cols.user_slice(user_id)]
+        if not len(wpm):
+            return {'counts': [], 'edges': []}
+        counts, edges = np.histogram(wpm, bins=bins, range=(0.0, float(cols.wpm.max()) or 1.0))
+        return {'counts': counts.tolist(), 'edges': np.round(edges, 1).tolist()}
+
+    def daily_trend(self, days=30):
+        return self._cached(('trend', days), lambda: self._daily_trend(days))
+
+    def _daily_trend(self, days):
+        cols = self.columns()
+        if not len(cols):
+            return []
+        day = cols.timestamp // SECONDS_PER_DAY
+        last = int(day.max())
+        recent = day > last - days
+        index = (day[recent] - (last - days + 1)).astype(np.int64)
+        counts = np.bincount(index, minlength=days)
+        sums = np.bincount(index, weights=cols.wpm[recent], minlength=days)
+        return [{'day': int((last - days + 1 + i) * SECONDS_PER_DAY),
+                 'games': int(counts[i]),
+                 'averageWPM': round(float(sums[i] / counts[i]), 1) if counts[i] else None}
+                for i in range(days)]
+
+    def user_summary(self, user_id, window=10):
+        return self._cached(('user', user_id, window), lambda: self._user_summary(user_id, window))
+
+    def _user_summary(self, user_id, window):
+        cols = self.columns()
+        part = cols.user_slice(user_id)
+        wpm = cols.wpm[part]
+        if not len(wpm):
+            return {'games': 0}
+
+        days = (cols.timestamp[part] - cols.timestamp[part][0]) / SECONDS_PER_DAY
+        slope = _slopes(days, wpm, np.array([0]), np.array([len(wpm)]))[0]
+        user_best = float(wpm.max())
+
+        return {
+            'games': len(wpm),
+            'wpm': _percentiles(wpm),
+            'accuracy': _percentiles(cols.accuracy[part]),
+            'movingAverage': moving_average(wpm, window),
+            'wpmPerDay': round(float(slope), 3),
+            'bestWPM': round(user_best, 1),
+            'bestPercentile': round(float(np.count_nonzero(cols.best < user_best)) / len(cols.best) * 100, 1)
+        }
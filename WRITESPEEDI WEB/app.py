@@ -1,15 +1,127 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-import bcrypt
+import click
+import os
+import sys
 import random
-from datetime import datetime
+import base64
+import json
+import time
+import math
+import zlib
+from datetime import datetime, timedelta, timezone
 import requests
+from sqlalchemy.exc import IntegrityError
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from typing_core import keystrokes, scoring
+from password_pool import PasswordPool, PoolBusy
+from score_buffer import ScoreBuffer
+import database
+from corpus import Corpus
+from analytics import Analytics
+from rank_index import RankIndex
+from response_cache import ResponseCache, MemoryBackend
+from metrics import Metrics
+from purge import JobRunner, Job, ArchiveWriter
+import transfer
+import verification
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///typespeed.db'
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 10, 'max_overflow': 20}
+app.config['DEFAULT_PAGE_SIZE'] = 50
+app.config['MAX_PAGE_SIZE'] = 200
+app.config['BCRYPT_ROUNDS'] = 12
+app.config['PASSWORD_POOL_KIND'] = 'thread'
+app.config['PASSWORD_POOL_WORKERS'] = 4
+app.config['PASSWORD_POOL_MAX_QUEUE'] = 32
+app.config['PASSWORD_POOL_RETRY_AFTER'] = 1
+app.config['SCORE_BUFFERING'] = False
+app.config['SCORE_BUFFER_MAX_BATCH'] = 500
+app.config['SCORE_BUFFER_MAX_DELAY'] = 1.0
+app.config['SCORE_SPOOL_PATH'] = os.path.join(app.instance_path, 'score_spool.jsonl')
+app.config['SCORE_SPOOL_FSYNC'] = False
+app.config['CORPUS_PATH'] = os.path.join(app.root_path, 'corpus')
+app.config['PASSAGE_MAX_AGE'] = 86400
+# Keystrokes a test may hold beyond its passage, for corrections (see
+# keystroke_limit); validating and checking them is about 1 us each
+# (benchmarks/verification_latency.py)
+app.config['KEYSTROKE_ALLOWANCE'] = 500
+# Keystrokes per submission that does not say which passage it typed, and
+# per synced result
+app.config['MAX_KEYSTROKES'] = 1000
+# Recordings an import accepts, stored before MAX_KEYSTROKES was lowered
+app.config['IMPORT_MAX_KEYSTROKES'] = 20000
+# Submitted scores are recomputed from their keystrokes (typing_core.scoring)
+# and rejected when they claim more than this share above the result
+app.config['SCORE_TOLERANCE'] = 0.1
+app.config['SCORE_MAX_WPM'] = 300
+# /save_score takes a signed test token from /get_text and scores the typed
+# text itself (see verification.py); without the requirement, submissions
+# without a token fall back to the checks above
+app.config['TEST_TOKEN_REQUIRED'] = True
+app.config['TEST_TOKEN_MAX_AGE'] = 3600
+app.config['TEST_MAX_CPS'] = 25
+# Scores are flagged when more than TEST_BURST_SHARE of their keystrokes
+# follow the previous one within TEST_BURST_MS
+app.config['TEST_BURST_MS'] = 15
+app.config['TEST_BURST_SHARE'] = 0.25
+# 'memory' (per process) or 'sqlite' (shared by all workers on one machine)
+app.config['RESPONSE_CACHE_BACKEND'] = 'memory'
+app.config['RESPONSE_CACHE_PATH'] = os.path.join(app.instance_path, 'response_cache.db')
+app.config['RESPONSE_CACHE_TTL'] = 30
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = 1024
+app.config['PRINCIPAL_CACHE_SIZE'] = 10000
+# Upper bound for other workers to notice a deleted user or a changed admin flag
+app.config['PRINCIPAL_CACHE_TTL'] = 60
+# Production serving through asgi.py
+app.config['SERVER_HOST'] = '127.0.0.1'
+app.config['SERVER_PORT'] = 8000
+app.config['SERVER_WORKERS'] = 1
+# Threads per worker running the views, matches the database pool
+app.config['SERVER_THREADS'] = 30
+app.config['SERVER_BACKLOG'] = 2048
+# WebSocket race rooms (served by asgi.py only)
+app.config['RACE_TICK_RATE'] = 10
+app.config['RACE_MAX_PLAYERS'] = 8
+app.config['RACE_COUNTDOWN'] = 3
+app.config['RACE_TIMEOUT'] = 600
+# Dump sampled stacks of requests slower than this many seconds (0 = off)
+app.config['PROFILE_SLOW_REQUESTS'] = 0
+app.config['PROFILE_INTERVAL'] = 0.005
+app.config['PROFILE_DIR'] = os.path.join(app.instance_path, 'profiles')
+# Background purges delete this many rows per transaction, pausing in between
+app.config['PURGE_CHUNK_SIZE'] = 5000
+app.config['PURGE_PAUSE'] = 0.05
+# A queued or running job that has not reported for this many seconds counts
+# as failed (its process stopped) and no longer holds up new ones
+app.config['JOB_STALE_AFTER'] = 300
+app.config['ARCHIVE_DIR'] = os.path.join(app.instance_path, 'archives')
+# Largest batch accepted by /sync/scores, in results and in decompressed bytes
+app.config['SYNC_MAX_BATCH'] = 5000
+app.config['SYNC_MAX_BYTES'] = 16 * 1024 * 1024
+# Rows per database round trip for /admin/export and per transaction for /admin/import
+app.config['TRANSFER_CHUNK_SIZE'] = 5000
+# Any of the above can be overridden with FLASK_* environment variables
+app.config.from_prefixed_env()
 db = SQLAlchemy(app)
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        # WAL, relaxed sync and friends on every pooled connection
+        event.listen(db.engine, 'connect', lambda connection, record: database.apply_pragmas(connection))
+password_pool = PasswordPool(workers=app.config['PASSWORD_POOL_WORKERS'],
+                             max_queue=app.config['PASSWORD_POOL_MAX_QUEUE'],
+                             rounds=app.config['BCRYPT_ROUNDS'],
+                             kind=app.config['PASSWORD_POOL_KIND'])
+metrics = Metrics()
+with app.app_context():
+    metrics.init_app(app, db.engine)
+password_pool.observer = metrics.observe_password
+response_cache = ResponseCache.from_config(app.config)
+principal_cache = MemoryBackend(max_entries=app.config['PRINCIPAL_CACHE_SIZE'])
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -20,25 +132,668 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     password = db.Column(db.String(120), nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
-    scores = db.relationship('Score', backref='user', lazy=True)
+    scores = db.relationship('Score', backref='user', lazy=True, cascade='all, delete-orphan')
 
 class Score(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     wpm = db.Column(db.Float, nullable=False)
     accuracy = db.Column(db.Float, nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    # Delta-encoded keystroke events (see typing_core.keystrokes), only loaded for replays
+    keystrokes = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    # Failed the keystroke checks of verification.py: kept, but left out of
+    # UserStats, the rank and analytics
+    flagged = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    # Backs the keyset pagination of /user_history
+    __table_args__ = (db.Index('ix_score_user_timestamp_id', 'user_id', 'timestamp', 'id'),)
+
+class UserStats(db.Model):
+    # Per-user aggregate kept up to date by save_score so the leaderboard
+    # never has to scan the Score table
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    total_games = db.Column(db.Integer, nullable=False, default=0)
+    sum_wpm = db.Column(db.Float, nullable=False, default=0.0)
+    best_wpm = db.Column(db.Float, nullable=False, default=0.0)
+    sum_accuracy = db.Column(db.Float, nullable=False, default=0.0)
+    user = db.relationship('User', backref=db.backref('stats', uselist=False, cascade='all, delete-orphan'))
+
+    # Backs the ordering and keyset pagination of /leaderboard
+    __table_args__ = (db.Index('ix_user_stats_best_wpm_user', 'best_wpm', 'user_id'),)
+
+class SyncDevice(db.Model):
+    # Delta cursor of a desktop or console app pushing results through
+    # /sync/scores: the highest local id stored so far, and the answer to the
+    # last batch so a repeated request gets it again
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    device = db.Column(db.String(64), primary_key=True)
+    cursor = db.Column(db.Integer, nullable=False, default=0)
+    last_key = db.Column(db.String(160), nullable=True)
+    last_answer = db.Column(db.Text, nullable=True)
+
+# Local ids are the apps' SQLite rowids, and the cursor column holds no more
+MAX_LOCAL_ID = 2 ** 63 - 1
+
+class TestClaim(db.Model):
+    # Start time of the last test each user submitted with a test token;
+    # tokens that are not newer have been used already
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    started = db.Column(db.Float, nullable=False)
+
+class JobRecord(db.Model):
+    # Background purges (purge.py), shared by all server processes
+    __tablename__ = 'job'
+    id = db.Column(db.String(12), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    state = db.Column(db.String(10), nullable=False)
+    total = db.Column(db.Integer, nullable=True)
+    done = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    created = db.Column(db.Float, nullable=False)
+    started = db.Column(db.Float, nullable=True)
+    finished = db.Column(db.Float, nullable=True)
+    # Last time the job's process wrote its state
+    updated = db.Column(db.Float, nullable=False)
+
+class Principal(UserMixin):
+    """The parts of a User that requests need, cached between requests"""
+    def __init__(self, id, username, is_admin):
+        self.id = id
+        self.username = username
+        self.is_admin = is_admin
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        row = db.session.query(User.id, User.username, User.is_admin).filter_by(id=int(user_id)).first()
+        if row is None:
+            return None
+        principal = Principal(row.id, row.username, bool(row.is_admin))
+        principal_cache.set(user_id, principal, app.config['PRINCIPAL_CACHE_TTL'])
+    return principal
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def forget_principal(mapper, connection, user):
+    # Covers changes made through the ORM, e.g. toggling is_admin in a shell;
+    # the bulk deletes of the admin routes clear the whole cache instead
+    principal_cache.delete(str(user.id))
 
-def get_typing_text():
-    return """The future of technology lies in artificial intelligence and machine learning. As computers become more powerful, they can process vast amounts of data and solve complex problems. Scientists and engineers work together to create smart systems that can understand human language, recognize patterns, and make decisions. These advances are changing the way we live and work, making our daily tasks easier and more efficient."""
+DEFAULT_TEXT = """The future of technology lies in artificial intelligence and machine learning. As computers become more powerful, they can process vast amounts of data and solve complex problems. Scientists and engineers work together to create smart systems that can understand human language, recognize patterns, and make decisions. These advances are changing the way we live and work, making our daily tasks easier and more efficient."""
+
+corpus = Corpus.from_path(app.config['CORPUS_PATH'])
+test_tokens = verification.TestTokens(app.config['SECRET_KEY'], max_age=app.config['TEST_TOKEN_MAX_AGE'])
+
+def get_typing_text(lang=None, words=None, difficulty=None):
+    passage = corpus.sample(lang=lang, words=words, difficulty=difficulty)
+    return passage['text'] if passage else DEFAULT_TEXT
 
 def is_admin():
     return current_user.is_authenticated and current_user.is_admin
 
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor, types):
+    """Turn an opaque cursor back into its key values, None for the first page
+
+    types gives the expected type (or tuple of types) of each value.
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(types) or not all(
+            isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(values, types)):
+        raise ValueError('Invalid cursor')
+    return values
+
+def page_args(*types):
+    """Read the limit/cursor query parameters of a paginated endpoint"""
+    limit = request.args.get('limit', app.config['DEFAULT_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+    return limit, decode_cursor(request.args.get('cursor'), types)
+
+def paginated(items, next_cursor):
+    # The body stays a plain JSON array, the next page is announced in a header
+    response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+def record_user_stats(user_id, games, sum_wpm, best_wpm, sum_accuracy):
+    """Fold new scores into the user's aggregate row (caller commits)"""
+    updated = UserStats.query.filter_by(user_id=user_id).update({
+        UserStats.total_games: UserStats.total_games + games,
+        UserStats.sum_wpm: UserStats.sum_wpm + sum_wpm,
+        UserStats.best_wpm: db.case((UserStats.best_wpm < best_wpm, best_wpm), else_=UserStats.best_wpm),
+        UserStats.sum_accuracy: UserStats.sum_accuracy + sum_accuracy
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(UserStats(user_id=user_id, total_games=games, sum_wpm=sum_wpm,
+                                 best_wpm=best_wpm, sum_accuracy=sum_accuracy))
+
+def persist_scores(rows):
+    """Insert a batch of score rows and fold them into UserStats in one transaction
+
+    Returns the number of rows stored.
+    """
+    try:
+        db.session.execute(db.insert(Score), rows)
+    except IntegrityError:
+        # Some of the users were deleted since they played, drop their scores
+        # instead of failing the whole batch
+        db.session.rollback()
+        user_ids = {row['user_id'] for row in rows}
+        existing = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(user_ids))}
+        rows = [row for row in rows if row['user_id'] in existing]
+        if not rows:
+            return 0
+        db.session.execute(db.insert(Score), rows)
+    
+    per_user = {}
+    for row in rows:
+        if row.get('flagged'):
+            continue
+        games, sum_wpm, best_wpm, sum_accuracy = per_user.get(row['user_id'], (0, 0.0, 0.0, 0.0))
+        per_user[row['user_id']] = (games + 1, sum_wpm + row['wpm'],
+                                    max(best_wpm, row['wpm']), sum_accuracy + row['accuracy'])
+    for user_id, (games, sum_wpm, best_wpm, sum_accuracy) in per_user.items():
+        record_user_stats(user_id, games, sum_wpm, best_wpm, sum_accuracy)
+    db.session.commit()
+    analytics.invalidate()
+    response_cache.bump('scores')
+    if rank_index.built:
+        for user_id, (_, _, best_wpm, _) in per_user.items():
+            rank_index.update(user_id, best_wpm)
+    return len(rows)
+
+def flush_buffered_scores(rows):
+    # Runs on the buffer's flusher thread, outside of any request
+    with app.app_context():
+        try:
+            persist_scores(rows)
+        except Exception:
+            db.session.rollback()
+            raise
+
+def stream_rows(sql, params=(), chunk_size=100000):
+    """Yield the rows of a query in chunks, straight off the DB-API cursor
+
+    SQLite steps through the query as rows are fetched, so only one chunk
+    is in memory at a time.
+    """
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        connection.close()
+
+def fetch_score_chunks(after_id=0, chunk_size=100000):
+    """Stream (id, user_id, wpm, accuracy, unix_time) tuples"""
+    return stream_rows("""SELECT score.id, score.user_id, score.wpm, score.accuracy,
+                                 CAST(strftime('%s', score.timestamp) AS INTEGER)
+                          FROM score JOIN "user" ON "user".id = score.user_id
+                          WHERE score.id > ? AND NOT score.flagged""", (after_id,), chunk_size)
+
+analytics = Analytics(fetch_score_chunks)
+rank_index = RankIndex()
+# Highest Score id the rank index has taken in, see catch_up_rank_index
+rank_index_score_id = 0
+
+def get_rank_index():
+    """Return the rank index, loading every player's best score on first use"""
+    global rank_index_score_id
+    if not rank_index.built:
+        # Read first: scores stored while loading are taken in by the next catch-up
+        rank_index_score_id = db.session.query(db.func.max(Score.id)).scalar() or 0
+        rank_index.build(db.session.query(UserStats.user_id, UserStats.best_wpm).filter(
+            UserStats.total_games > 0
+        ).all())
+    return rank_index
+
+def catch_up_rank_index():
+    """Move the players who scored in other processes since the index last looked
+
+    Score ids only grow between resets, so the players with newer scores are
+    the only ones whose best may have changed.
+    """
+    global rank_index_score_id
+    latest = db.session.query(db.func.max(Score.id)).scalar() or 0
+    if latest <= rank_index_score_id:
+        return
+    players = db.session.query(Score.user_id).filter(Score.id > rank_index_score_id,
+                                                     Score.id <= latest).distinct()
+    for user_id, best_wpm in db.session.query(UserStats.user_id, UserStats.best_wpm).filter(
+            UserStats.user_id.in_(players), UserStats.total_games > 0):
+        rank_index.update(user_id, best_wpm)
+    rank_index_score_id = latest
+
+def follow_other_workers():
+    # With several server processes, the scores and resets written by the
+    # others only reach this process through the shared cache versions
+    reset = response_cache.changed('resets')
+    scores_changed = response_cache.changed('scores')
+    if reset:
+        analytics.reset()
+        principal_cache.clear()
+        rank_index.clear()
+    elif scores_changed:
+        analytics.invalidate()
+        if rank_index.built:
+            catch_up_rank_index()
+
+if response_cache.shared:
+    app.before_request(follow_other_workers)
+
+score_buffer = None
+if app.config['SCORE_BUFFERING']:
+    score_buffer = ScoreBuffer(flush_buffered_scores,
+                               app.config['SCORE_SPOOL_PATH'],
+                               max_batch=app.config['SCORE_BUFFER_MAX_BATCH'],
+                               max_delay=app.config['SCORE_BUFFER_MAX_DELAY'],
+                               fsync=app.config['SCORE_SPOOL_FSYNC'],
+                               logger=app.logger)
+    score_buffer.start()
+
+def compute_user_stats(user_ids=None):
+    """Aggregate the Score table per user, the slow way"""
+    query = db.session.query(
+        Score.user_id,
+        db.func.count(Score.id).label('total_games'),
+        db.func.sum(Score.wpm).label('sum_wpm'),
+        db.func.max(Score.wpm).label('best_wpm'),
+        db.func.sum(Score.accuracy).label('sum_accuracy')
+    ).join(User).filter(Score.flagged == db.false())
+    if user_ids is not None:
+        query = query.filter(Score.user_id.in_(user_ids))
+    return query.group_by(Score.user_id).all()
+
+def rebuild_user_stats():
+    """Recompute the UserStats table from scratch out of Score"""
+    UserStats.query.delete()
+    rows = compute_user_stats()
+    db.session.add_all([UserStats(user_id=row.user_id,
+                                  total_games=row.total_games,
+                                  sum_wpm=row.sum_wpm,
+                                  best_wpm=row.best_wpm,
+                                  sum_accuracy=row.sum_accuracy) for row in rows])
+    db.session.commit()
+    return len(rows)
+
+def refresh_user_stats(user_ids, chunk_size=500):
+    """Recompute UserStats for the given users only, a transaction per chunk"""
+    user_ids = sorted(user_ids)
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        UserStats.query.filter(UserStats.user_id.in_(chunk)).delete(synchronize_session=False)
+        db.session.add_all([UserStats(user_id=row.user_id,
+                                      total_games=row.total_games,
+                                      sum_wpm=row.sum_wpm,
+                                      best_wpm=row.best_wpm,
+                                      sum_accuracy=row.sum_accuracy) for row in compute_user_stats(chunk)])
+        db.session.commit()
+
+def check_user_stats(tolerance=1e-6):
+    """Compare UserStats against a fresh aggregate, return the mismatching user ids"""
+    expected = {row.user_id: row for row in compute_user_stats()}
+    actual = {stats.user_id: stats for stats in UserStats.query.all()}
+    mismatches = []
+    for user_id in sorted(set(expected) | set(actual)):
+        want, have = expected.get(user_id), actual.get(user_id)
+        if want is None or have is None:
+            mismatches.append(user_id)
+        elif (want.total_games != have.total_games
+              or abs(want.sum_wpm - have.sum_wpm) > tolerance
+              or abs(want.best_wpm - have.best_wpm) > tolerance
+              or abs(want.sum_accuracy - have.sum_accuracy) > tolerance):
+            mismatches.append(user_id)
+    return mismatches
+
+def upgrade_database():
+    """Create missing tables and bring the score table of older databases up to date
+
+    create_all only creates tables that do not exist yet; the score columns
+    and index added since, and the aggregate of scores stored before
+    UserStats existed, are filled in here. Safe to run on every start.
+    """
+    had_stats = db.inspect(db.engine).has_table(UserStats.__tablename__)
+    db.create_all()
+    columns = {column['name'] for column in db.inspect(db.engine).get_columns(Score.__tablename__)}
+    with db.engine.begin() as connection:
+        if 'keystrokes' not in columns:
+            connection.execute(db.text("ALTER TABLE score ADD COLUMN keystrokes BLOB"))
+        if 'flagged' not in columns:
+            connection.execute(db.text("ALTER TABLE score ADD COLUMN flagged BOOLEAN NOT NULL DEFAULT 0"))
+    for index in Score.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    if not had_stats:
+        rebuild_user_stats()
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create missing tables and add the columns and indexes of newer versions"""
+    upgrade_database()
+    print("Database is up to date")
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Rebuild the leaderboard aggregate table from the Score table"""
+    print(f"Rebuilt stats for {rebuild_user_stats()} users")
+
+@app.cli.command('check-stats')
+def check_stats_command():
+    """Verify the leaderboard aggregate table against the Score table"""
+    mismatches = check_user_stats()
+    if mismatches:
+        print(f"Stats out of sync for user ids: {mismatches}")
+        raise SystemExit(1)
+    print("Stats are consistent")
+
+def delete_in_chunks(job, model, key, condition):
+    """Delete the rows matching condition, one chunk per transaction"""
+    chunk_size = app.config['PURGE_CHUNK_SIZE']
+    while True:
+        chunk = db.select(key).where(condition).limit(chunk_size)
+        deleted = db.session.execute(db.delete(model).where(key.in_(chunk))).rowcount
+        db.session.commit()
+        job.advance(deleted)
+        if deleted < chunk_size:
+            return
+        # Let queued writers in before taking the lock again
+        time.sleep(app.config['PURGE_PAUSE'])
+
+def delete_users_in_chunks(job, condition):
+    # Each chunk takes the users' last scores and stats along in the same
+    # transaction, so nothing saved during the purge is left behind
+    chunk_size = app.config['PURGE_CHUNK_SIZE']
+    while True:
+        user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(condition).limit(chunk_size)]
+        if not user_ids:
+            return
+        Score.query.filter(Score.user_id.in_(user_ids)).delete(synchronize_session=False)
+        UserStats.query.filter(UserStats.user_id.in_(user_ids)).delete(synchronize_session=False)
+        SyncDevice.query.filter(SyncDevice.user_id.in_(user_ids)).delete(synchronize_session=False)
+        User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        job.advance(len(user_ids))
+        time.sleep(app.config['PURGE_PAUSE'])
+
+def scores_removed(users_removed=False):
+    """Drop everything derived from scores after rows were deleted"""
+    analytics.reset()
+    rank_index.clear()
+    response_cache.bump('scores', 'users', 'resets')
+    if users_removed:
+        principal_cache.clear()
+
+def purge(job, scores=False, users=False):
+    """Delete all scores and/or all non-admin users in the background"""
+    # Queued scores were submitted before the purge, let it remove them too
+    if score_buffer:
+        score_buffer.flush()
+    # Rows added after the purge started are kept, unless their user goes
+    last_score_id = db.session.query(db.func.max(Score.id)).scalar() or 0
+    last_user_id = db.session.query(db.func.max(User.id)).scalar() or 0
+    doomed_users = db.and_(User.id <= last_user_id, db.not_(User.is_admin.is_(True)))
+    doomed_scores = []
+    if scores:
+        doomed_scores.append(Score.id <= last_score_id)
+    if users:
+        doomed_scores.append(Score.user_id.in_(db.select(User.id).where(doomed_users)))
+        # Scores left behind by users deleted without them
+        doomed_scores.append(Score.user_id.not_in(db.select(User.id)))
+    condition = db.or_(*doomed_scores)
+    job.total = Score.query.filter(condition).count()
+    if users:
+        job.total += User.query.filter(doomed_users).count()
+
+    try:
+        delete_in_chunks(job, Score, Score.id, condition)
+        if users:
+            delete_users_in_chunks(job, doomed_users)
+        if scores:
+            rebuild_user_stats()
+    finally:
+        scores_removed(users_removed=users)
+    return {'done': job.done}
+
+def archive_scores(job, days):
+    """Move scores older than days into a compressed archive, then delete them"""
+    if score_buffer:
+        score_buffer.flush()
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    old = Score.timestamp < cutoff
+    job.total = Score.query.filter(old).count()
+    if not job.total:
+        return {'archive': None, 'rows': 0}
+
+    os.makedirs(app.config['ARCHIVE_DIR'], exist_ok=True)
+    path = os.path.join(app.config['ARCHIVE_DIR'], f"scores-before-{cutoff:%Y%m%d}-{job.id}.npz")
+    writer = ArchiveWriter(path)
+    affected = set()
+    last_id = 0
+    try:
+        while True:
+            rows = db.session.query(Score.id, Score.user_id, Score.wpm, Score.accuracy, Score.timestamp,
+                                    Score.flagged).filter(
+                old, Score.id > last_id
+            ).order_by(Score.id).limit(app.config['PURGE_CHUNK_SIZE']).all()
+            if not rows:
+                break
+            # Written (and synced) before the delete commits, never the other way round
+            writer.write([(row.id, row.user_id, row.wpm, row.accuracy,
+                           int(row.timestamp.replace(tzinfo=timezone.utc).timestamp()), bool(row.flagged))
+                          for row in rows])
+            Score.query.filter(Score.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+            db.session.commit()
+            affected.update(row.user_id for row in rows)
+            last_id = rows[-1].id
+            job.advance(len(rows))
+            time.sleep(app.config['PURGE_PAUSE'])
+        refresh_user_stats(affected)
+    finally:
+        scores_removed()
+    return {'archive': path, 'rows': writer.rows}
+
+class JobTable:
+    """JobRunner store in the job table, so every server process sees the same jobs
+
+    Writes go through their own connection, outside of the session the job
+    itself works in.
+    """
+    def __init__(self, engine, stale_after, keep=50):
+        self.engine = engine
+        self.stale_after = stale_after
+        self.keep = keep
+
+    def add(self, job):
+        now = time.time()
+        with self.engine.begin() as connection:
+            # One statement, so two processes cannot both see no active job
+            added = connection.execute(db.text(
+                "INSERT INTO job (id, kind, state, done, created, updated) "
+                "SELECT :id, :kind, 'queued', 0, :now, :now WHERE NOT EXISTS ("
+                "SELECT 1 FROM job WHERE state IN ('queued', 'running') AND updated > :stale)"),
+                {'id': job.id, 'kind': job.kind, 'now': now, 'stale': now - self.stale_after}).rowcount
+            connection.execute(db.text(
+                "DELETE FROM job WHERE id NOT IN (SELECT id FROM job ORDER BY created DESC LIMIT :keep)"),
+                {'keep': self.keep})
+        return bool(added)
+
+    def save(self, job):
+        with self.engine.begin() as connection:
+            connection.execute(db.update(JobRecord).where(JobRecord.id == job.id).values(
+                state=job.state, total=job.total, done=job.done, error=job.error,
+                result=json.dumps(job.result) if job.result is not None else None,
+                started=job.started, finished=job.finished, updated=time.time()))
+
+    def status(self, row, now):
+        state, error = row.state, row.error
+        if state in ('queued', 'running') and row.updated <= now - self.stale_after:
+            state, error = 'failed', 'The server process running the job stopped'
+        return {
+            'id': row.id,
+            'kind': row.kind,
+            'state': state,
+            'total': row.total,
+            'done': row.done,
+            'error': error,
+            'result': json.loads(row.result) if row.result else None,
+            'seconds': round((row.finished or now) - row.started, 3) if row.started else None
+        }
+
+    def get(self, job_id):
+        with self.engine.connect() as connection:
+            row = connection.execute(db.select(JobRecord.__table__).where(JobRecord.id == job_id)).first()
+        return self.status(row, time.time()) if row else None
+
+    def jobs(self):
+        with self.engine.connect() as connection:
+            rows = connection.execute(db.select(JobRecord.__table__).order_by(JobRecord.created)).all()
+        now = time.time()
+        return [self.status(row, now) for row in rows]
+
+with app.app_context():
+    jobs = JobRunner(app.app_context, JobTable(db.engine, app.config['JOB_STALE_AFTER']))
+
+def export_rows(table, with_keystrokes=False):
+    """Row chunks for /admin/export, in transfer.USER_FIELDS or SCORE_FIELDS order"""
+    chunk_size = app.config['TRANSFER_CHUNK_SIZE']
+    if table == 'users':
+        for chunk in stream_rows('SELECT username, password, is_admin FROM "user" ORDER BY id',
+                                 chunk_size=chunk_size):
+            yield [(username, password.decode() if isinstance(password, bytes) else password, bool(is_admin))
+                   for username, password, is_admin in chunk]
+        return
+    keystrokes_column = 'score.keystrokes' if with_keystrokes else 'NULL'
+    for chunk in stream_rows(f"""SELECT "user".username, score.wpm, score.accuracy,
+                                        strftime('%Y-%m-%dT%H:%M:%fZ', score.timestamp), {keystrokes_column},
+                                        score.flagged
+                                 FROM score JOIN "user" ON "user".id = score.user_id
+                                 ORDER BY score.id""", chunk_size=chunk_size):
+        yield [(username, wpm, accuracy, timestamp, base64.b64encode(blob).decode() if blob else None, bool(flagged))
+               for username, wpm, accuracy, timestamp, blob, flagged in chunk]
+
+def user_row(record):
+    password = record['password']
+    if not record['username'] or not isinstance(password, str) or not password.startswith('$2'):
+        raise ValueError('needs a username and a bcrypt password hash')
+    return (str(record['username']), password.encode(), transfer.parse_flag(record.get('is_admin')))
+
+def score_row(record):
+    # (username, wpm, accuracy, timestamp, keystrokes, flagged); the username is swapped
+    # for the user id per batch
+    wpm, accuracy = float(record['wpm']), float(record['accuracy'])
+    if not (0 <= wpm <= app.config['SCORE_MAX_WPM'] and 0 <= accuracy <= 100):
+        raise ValueError('wpm or accuracy out of range')
+    timestamp = transfer.parse_timestamp(record['timestamp'])
+    blob = base64.b64decode(record['keystrokes'], validate=True) if record.get('keystrokes') else None
+    # Stored recordings have to replay, a damaged one fails the line. Recordings
+    # from before the current MAX_KEYSTROKES may be longer and are kept
+    if blob is not None:
+        keystrokes.decode(blob, max_events=app.config['IMPORT_MAX_KEYSTROKES'])
+    # The format SQLAlchemy stores DateTime columns in on SQLite
+    return (str(record['username']), wpm, accuracy, timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'), blob,
+            transfer.parse_flag(record.get('flagged')))
+
+def import_records(table, records):
+    """Insert parsed records with executemany, one transaction per chunk
+
+    Returns counts of imported, skipped (existing users, scores of unknown
+    users) and rejected records, plus the first few errors.
+    """
+    chunk_size = app.config['TRANSFER_CHUNK_SIZE']
+    parse = user_row if table == 'users' else score_row
+    summary = {'imported': 0, 'skipped': 0, 'rejected': 0, 'errors': []}
+    affected = set()
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for batch in transfer.batched(records, chunk_size):
+            rows = []
+            for number, record in batch:
+                try:
+                    if record is None:
+                        raise ValueError('not a JSON object')
+                    rows.append(parse(record))
+                except (TypeError, ValueError, KeyError) as e:
+                    summary['rejected'] += 1
+                    if len(summary['errors']) < 20:
+                        summary['errors'].append(f"Line {number}: {e}")
+            valid = len(rows)
+            if table == 'users':
+                cursor.executemany('INSERT OR IGNORE INTO "user" (username, password, is_admin) VALUES (?, ?, ?)',
+                                   rows)
+                imported = max(cursor.rowcount, 0)
+            else:
+                names = sorted({row[0] for row in rows})
+                user_ids = {}
+                # Stays under SQLite's limit on bound parameters
+                for start in range(0, len(names), 500):
+                    part = names[start:start + 500]
+                    cursor.execute(f'SELECT username, id FROM "user" WHERE username IN ({",".join("?" * len(part))})',
+                                   part)
+                    user_ids.update(cursor.fetchall())
+                rows = [(user_ids[row[0]],) + row[1:] for row in rows if row[0] in user_ids]
+                cursor.executemany('INSERT INTO score (user_id, wpm, accuracy, timestamp, keystrokes, flagged) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)', rows)
+                imported = len(rows)
+                affected.update(row[0] for row in rows)
+            connection.commit()
+            summary['imported'] += imported
+            summary['skipped'] += valid - imported
+    finally:
+        connection.close()
+        # Also when the upload breaks off, for the chunks committed before
+        if table == 'users':
+            response_cache.bump('users')
+        elif affected:
+            refresh_user_stats(affected)
+            analytics.invalidate()
+            rank_index.clear()
+            response_cache.bump('scores', 'users')
+    return summary
+
+@app.cli.command('archive-scores')
+@click.option('--days', type=int, required=True, help='Archive scores older than this many days')
+def archive_scores_command(days):
+    """Move old scores into a compressed archive file"""
+    result = archive_scores(Job('archive', None), days)
+    print(f"Archived {result['rows']} scores" + (f" to {result['archive']}" if result['archive'] else ''))
+
+def job_started(job, message):
+    response = jsonify({'message': message, 'job': job.status()})
+    response.status_code = 202
+    response.headers['Location'] = url_for('admin_job', job_id=job.id)
+    return response
+
+def submit_job(kind, work, message):
+    """Start a background job and answer 202, or 409 while another one is active"""
+    job = jobs.submit(kind, work)
+    if job is None:
+        return jsonify({'error': 'Another purge or archive job is still running'}), 409
+    return job_started(job, message)
+
+@app.errorhandler(PoolBusy)
+def password_pool_busy(e):
+    # Shed load quickly instead of letting password work pile up
+    response = jsonify({'error': 'Server busy, please try again'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(app.config['PASSWORD_POOL_RETRY_AFTER'])
+    return response
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -52,10 +807,11 @@ def register():
     if User.query.filter_by(username=username).first():
         return jsonify({'error': 'Username already exists'}), 400
     
-    hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    hashed = password_pool.hash(password)
     new_user = User(username=username, password=hashed)
     db.session.add(new_user)
     db.session.commit()
+    response_cache.bump('users')
     
     return jsonify({'message': 'Registration successful'})
 
@@ -64,7 +820,7 @@ def login():
     data = request.json
     user = User.query.filter_by(username=data.get('username')).first()
     
-    if user and bcrypt.checkpw(data.get('password').encode(), user.password):
+    if user and password_pool.check(data.get('password'), user.password):
         login_user(user)
         return jsonify({'message': 'Login successful'})
     
@@ -78,7 +834,7 @@ def admin_login():
     
     user = User.query.filter_by(username=username).first()
     
-    if user and bcrypt.checkpw(password.encode(), user.password) and user.is_admin:
+    if user and user.is_admin and password_pool.check(password, user.password):
         login_user(user)
         return jsonify({'message': 'Admin login successful'})
     
@@ -96,14 +852,8 @@ def admin_reset_scores():
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
     
-    try:
-        # Delete all scores
-        Score.query.delete()
-        db.session.commit()
-        return jsonify({'message': 'All scores have been deleted'})
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+    # Deleting runs in chunks in the background, the service stays up meanwhile
+    return submit_job('reset-scores', lambda job: purge(job, scores=True), 'Deleting all scores')
 
 @app.route('/admin/reset/users', methods=['POST'])
 @login_required
@@ -111,14 +861,8 @@ def admin_reset_users():
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
     
-    try:
-        # Delete all non-admin users
-        User.query.filter_by(is_admin=False).delete()
-        db.session.commit()
-        return jsonify({'message': 'All users have been deleted'})
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+    # Takes the users' scores along, and any scores whose user is already gone
+    return submit_job('reset-users', lambda job: purge(job, users=True), 'Deleting all non-admin users')
 
 @app.route('/admin/reset', methods=['POST'])
 @login_required
@@ -126,15 +870,74 @@ def admin_reset():
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
     
+    return submit_job('reset', lambda job: purge(job, scores=True, users=True),
+                      'Deleting all scores and non-admin users')
+
+@app.route('/admin/archive', methods=['POST'])
+@login_required
+def admin_archive():
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    days = (request.json or {}).get('days')
+    if not isinstance(days, int) or days < 0:
+        return jsonify({'error': 'days must be a non-negative integer'}), 400
+    return submit_job('archive', lambda job: archive_scores(job, days),
+                      f"Archiving scores older than {days} days")
+
+@app.route('/admin/jobs')
+@login_required
+def admin_jobs():
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(jobs.jobs())
+
+@app.route('/admin/jobs/<job_id>')
+@login_required
+def admin_job(job_id):
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    status = jobs.get(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(status)
+
+@app.route('/admin/export')
+@login_required
+def admin_export():
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    table = request.args.get('table', 'scores')
+    fmt = request.args.get('format', 'ndjson')
+    if table not in ('scores', 'users') or fmt not in transfer.FORMATS:
+        return jsonify({'error': 'table must be scores or users, format ndjson or csv'}), 400
+    fields = transfer.USER_FIELDS if table == 'users' else transfer.SCORE_FIELDS
+    rows = export_rows(table, with_keystrokes=request.args.get('keystrokes') == '1')
+    # Streamed chunk by chunk while the query runs
+    response = app.response_class(stream_with_context(transfer.export_chunks(rows, fields, fmt)),
+                                  mimetype=transfer.FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{table}.{fmt}"'
+    return response
+
+@app.route('/admin/import', methods=['POST'])
+@login_required
+def admin_import():
+    if not is_admin():
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    table = request.args.get('table', 'scores')
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if table not in ('scores', 'users') or fmt not in transfer.FORMATS:
+        return jsonify({'error': 'table must be scores or users, format ndjson or csv'}), 400
     try:
-        # Delete all scores and non-admin users
-        Score.query.delete()
-        User.query.filter_by(is_admin=False).delete()
-        db.session.commit()
-        return jsonify({'message': 'All scores and non-admin users have been deleted'})
+        summary = import_records(table, transfer.read_records(request.stream, fmt))
+    except UnicodeDecodeError as e:
+        return jsonify({'error': f"Upload is not UTF-8: {e}"}), 400
     except Exception as e:
-        db.session.rollback()
+        app.logger.exception("Error importing %s", table)
         return jsonify({'error': str(e)}), 500
+    return jsonify(summary)
 
 @app.route('/admin/status')
 @login_required
@@ -142,66 +945,485 @@ def admin_status():
     if not is_admin():
         return jsonify({'error': 'Unauthorized'}), 403
     
-    user_count = User.query.filter_by(is_admin=False).count()
-    score_count = Score.query.count()
+    # The counts only change on writes, the pool and buffer figures are live
+    counts = response_cache.memoize(('scores', 'users'), 'admin_counts', lambda: {
+        'users': User.query.filter_by(is_admin=False).count(),
+        'scores': Score.query.count()
+    })
     
     return jsonify({
-        'users': user_count,
-        'scores': score_count
+        **counts,
+        'password_pool': password_pool.status(),
+        'score_buffer': score_buffer.status() if score_buffer else None,
+        'response_cache': response_cache.status()
     })
 
+metrics.add_reading('writespeedi_password_pool_in_flight', 'Password jobs running or queued',
+                    lambda: password_pool.status()['in_flight'])
+metrics.add_reading('writespeedi_password_pool_rejected_total', 'Password jobs turned away',
+                    lambda: password_pool.status()['rejected'], kind='counter')
+metrics.add_reading('writespeedi_response_cache_hits_total', 'Response cache hits',
+                    lambda: response_cache.hits, kind='counter')
+metrics.add_reading('writespeedi_response_cache_misses_total', 'Response cache misses',
+                    lambda: response_cache.misses, kind='counter')
+if score_buffer:
+    metrics.add_reading('writespeedi_score_buffer_pending', 'Scores waiting to be flushed',
+                        lambda: score_buffer.status()['pending'])
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/get_text')
 def get_text():
-    return jsonify({
-        'text': get_typing_text()
-    })
+    passage = corpus.sample(lang=request.args.get('lang'),
+                            words=request.args.get('words', type=int),
+                            difficulty=request.args.get('difficulty'))
+    if passage is None:
+        if request.args:
+            return jsonify({'error': 'No passage matches these filters'}), 404
+        passage = {'id': None, 'text': DEFAULT_TEXT}
+    
+    response = jsonify(passage)
+    if passage['id'] is not None:
+        # A random pick, so clients have to revalidate, but can reuse the body on a 304
+        response.set_etag(corpus.etag(passage['id']))
+        response.headers['Cache-Control'] = 'no-cache'
+    if current_user.is_authenticated:
+        # A header rather than part of the body, so that a 304 still carries a fresh one
+        response.headers['X-Test-Token'] = test_tokens.issue(passage['id'], current_user.id)
+    return response.make_conditional(request)
+
+@app.route('/get_text/<int:passage_id>')
+@response_cache.cached(ttl=app.config['PASSAGE_MAX_AGE'])
+def get_passage(passage_id):
+    passage = corpus.get(passage_id)
+    if passage is None:
+        return jsonify({'error': 'Passage not found'}), 404
+    
+    # A passage never changes for a given corpus version
+    response = jsonify(passage)
+    response.set_etag(corpus.etag(passage_id))
+    response.headers['Cache-Control'] = f"public, max-age={app.config['PASSAGE_MAX_AGE']}"
+    return response.make_conditional(request)
+
+def keystroke_limit(text):
+    """Keystrokes, and typed characters, a test of text may hold"""
+    return len(text) + app.config['KEYSTROKE_ALLOWANCE']
+
+def check_score(wpm, accuracy, events, passage, limit):
+    """Validate a submitted score, returns an error response or None
+
+    With keystrokes the typed text and the typing time are replayed and the
+    score is recomputed, against the passage if the client says which one it
+    typed. A score may come out lower than the recomputed one (the browser
+    counts errors that were corrected later, and its clock runs until the test
+    is ended), but not higher.
+    """
+    if not (math.isfinite(wpm) and 0 <= wpm <= app.config['SCORE_MAX_WPM'] and 0 <= accuracy <= 100):
+        return jsonify({'error': 'Score out of range'}), 400
+    # A recording cut off at the limit does not hold the whole text
+    if not events or len(events) >= limit:
+        return None
+    typed, seconds = scoring.replay(events)
+    if passage is not None:
+        expected = scoring.score(typed, passage['text'], seconds)
+    else:
+        expected = scoring.result(scoring.count_words(typed), 0, 0, seconds)
+        expected['accuracy'] = None
+    tolerance = app.config['SCORE_TOLERANCE']
+    if not scoring.within(wpm, expected['wpm'], tolerance) or (
+            expected['accuracy'] is not None and not scoring.within(accuracy, expected['accuracy'], tolerance)):
+        return jsonify({'error': 'Score does not match the keystrokes', 'expected': expected}), 422
+    return None
+
+def verification_limits():
+    return {'max_cps': app.config['TEST_MAX_CPS'],
+            'burst_ms': app.config['TEST_BURST_MS'],
+            'burst_share': app.config['TEST_BURST_SHARE']}
+
+def claim_test(user_id, started):
+    """Record the test started at started as submitted, False if it was used already
+
+    Only moves forward from a start time older than this one, so of two
+    concurrent submissions with the same token only one gets through. The
+    claim is left in the session's transaction, to be committed with the
+    score it was made for.
+    """
+    try:
+        if not TestClaim.query.filter(TestClaim.user_id == user_id, TestClaim.started < started).update(
+                {'started': started}, synchronize_session=False):
+            if db.session.get(TestClaim, user_id) is not None:
+                db.session.rollback()
+                return False
+            db.session.add(TestClaim(user_id=user_id, started=started))
+            db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+def verify_passage(typed, text, seconds, events):
+    """Score typed text of a timed test against text, returns (result, flagged)"""
+    if not isinstance(typed, str) or len(typed) > keystroke_limit(text):
+        raise verification.Rejected('Invalid typed text')
+    result, flagged = verification.verify(typed, text, seconds, events, **verification_limits())
+    if result['wpm'] > app.config['SCORE_MAX_WPM']:
+        raise verification.Rejected('Score out of range')
+    return result, flagged
+
+def verify_test(data):
+    """Score a submission with a test token on the server's terms, returns (result, flagged, events)
+
+    Raises ValueError for a malformed keystroke list, before the token is used.
+    """
+    passage_id, started, seconds = test_tokens.open(data.get('token'), current_user.id)
+    if data.get('passage_id') is not None and data['passage_id'] != passage_id:
+        raise verification.Rejected('Not the passage this test was issued for')
+    passage = corpus.get(passage_id) if passage_id is not None else {'text': DEFAULT_TEXT}
+    if passage is None:
+        raise verification.Rejected('Unknown passage')
+    events = None
+    if data.get('keystrokes'):
+        events = keystrokes.parse_events(data['keystrokes'], limit=keystroke_limit(passage['text']))
+    # Used up by this submission whatever its outcome, a rejected test is not retried
+    if not claim_test(current_user.id, started):
+        raise verification.Rejected('Test token was already used')
+    try:
+        return (*verify_passage(data.get('typed'), passage['text'], seconds, events), events)
+    except verification.Rejected:
+        db.session.commit()
+        raise
+
+def score_race_finish(text, typed, seconds, recording):
+    """Score a race finisher like a test (race.py), returns (result, flagged, keystroke blob)"""
+    events = keystrokes.parse_events(recording, limit=keystroke_limit(text)) if recording else None
+    result, flagged = verify_passage(typed, text, seconds, events)
+    return result, flagged, keystrokes.encode(events) if events else None
 
 @app.route('/save_score', methods=['POST'])
 @login_required
 def save_score():
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Invalid score'}), 400
+    if app.config['TEST_TOKEN_REQUIRED'] or data.get('token') is not None:
+        try:
+            result, flagged, events = verify_test(data)
+        except verification.Rejected as e:
+            return jsonify({'error': str(e)}), 422
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        wpm, accuracy = result['wpm'], result['accuracy']
+    else:
+        passage_id = data.get('passage_id')
+        passage = corpus.get(passage_id) if isinstance(passage_id, int) else None
+        limit = keystroke_limit(passage['text']) if passage is not None else app.config['MAX_KEYSTROKES']
+        try:
+            events = keystrokes.parse_events(data['keystrokes'], limit=limit) if data.get('keystrokes') else None
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            wpm, accuracy = float(data.get('wpm')), float(data.get('accuracy'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid score'}), 400
+        rejected = check_score(wpm, accuracy, events, passage, limit)
+        if rejected:
+            return rejected
+        typed, seconds = scoring.replay(events or [])
+        try:
+            # Unverified without keystrokes, or with a recording cut off at the limit
+            flagged = (verification.check_keystrokes(typed, seconds, events, **verification_limits())
+                       or len(events) >= limit)
+        except verification.Rejected as e:
+            return jsonify({'error': str(e)}), 422
     try:
-        new_score = Score(
-            wpm=float(data.get('wpm')),
-            accuracy=float(data.get('accuracy')),
-            user_id=current_user.id
-        )
-        db.session.add(new_score)
-        db.session.commit()
-        return jsonify({'message': 'Score saved'})
+        row = {
+            'wpm': wpm,
+            'accuracy': accuracy,
+            'flagged': flagged,
+            'user_id': current_user.id,
+            'timestamp': datetime.utcnow(),
+            'keystrokes': keystrokes.encode(events) if events else None
+        }
+        # Scored by the server, the client shows what was stored
+        saved = {'wpm': wpm, 'accuracy': accuracy, 'flagged': flagged}
+        if score_buffer:
+            # The test claim, if any, cannot wait for the buffer's batch
+            db.session.commit()
+            score_buffer.put(row)
+            # Ranked as if the queued score were already saved
+            rank = get_rank_index().rank(current_user.id, None if flagged else row['wpm'])
+            return jsonify({'message': 'Score queued', **saved, **(rank or {})}), 202
+        get_rank_index()
+        if not persist_scores([row]):
+            return jsonify({'error': 'User no longer exists'}), 401
+        message = 'Score flagged for review' if flagged else 'Score saved'
+        return jsonify({'message': message, **saved, **(rank_index.rank(current_user.id) or {})})
+    except Exception as e:
+        app.logger.exception("Error saving score")
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+def read_sync_batch():
+    """Parse a (possibly gzip compressed) /sync/scores body"""
+    body = request.get_data()
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = inflater.decompress(body, app.config['SYNC_MAX_BYTES'])
+        if inflater.unconsumed_tail:
+            raise ValueError('Batch too large')
+    data = json.loads(body)
+    device = data['device']
+    results = data['results']
+    if not isinstance(device, str) or not 0 < len(device) <= 64:
+        raise ValueError('Invalid device')
+    if not isinstance(results, list):
+        raise ValueError('Invalid result list')
+    return device, results
+
+def sync_rows(results, cursor):
+    """Turn synced results above cursor into score rows, returns (rows, new cursor)
+
+    The bounds of check_score apply to every result, and with a complete
+    keystroke recording the wpm is recomputed from it. Nothing timed the
+    test on the server, so unlike a /save_score result with its test token
+    a synced result cannot be verified: every one is stored flagged, off the
+    leaderboard and the user's stats.
+    """
+    rows = []
+    now = time.time()
+    max_wpm = app.config['SCORE_MAX_WPM']
+    for local_id, unix_time, wpm, accuracy, blob in results:
+        local_id = int(local_id)
+        # Already stored, out of order, or not an id a client can have
+        if not cursor < local_id <= MAX_LOCAL_ID:
+            continue
+        wpm, accuracy, unix_time = float(wpm), float(accuracy), float(unix_time)
+        if not (math.isfinite(unix_time) and 0 < unix_time
+                and 0 <= wpm <= max_wpm and 0 <= accuracy <= 100):
+            raise ValueError(f"Invalid result {local_id}")
+        recording = None
+        if blob:
+            # A damaged recording is dropped, the score itself is still kept
+            try:
+                recording = base64.b64decode(blob)
+                events = keystrokes.decode(recording, max_events=app.config['MAX_KEYSTROKES'])
+            except (TypeError, ValueError, IndexError, zlib.error):
+                recording = None
+        # A recording cut off at the limit does not hold the whole text
+        if recording is not None and len(events) < app.config['MAX_KEYSTROKES']:
+            typed, seconds = scoring.replay(events)
+            replayed = scoring.result(scoring.count_words(typed), 0, 0, seconds)['wpm']
+            if replayed <= max_wpm:
+                wpm = replayed
+        rows.append({
+            'wpm': wpm,
+            'accuracy': accuracy,
+            'user_id': current_user.id,
+            'timestamp': datetime.utcfromtimestamp(min(unix_time, now)),
+            'keystrokes': recording,
+            'flagged': True
+        })
+        cursor = local_id
+    return rows, cursor
+
+@app.route('/sync/scores', methods=['GET', 'POST'])
+def sync_scores():
+    # Answers 401 instead of redirecting to the login page, the sync clients
+    # are the desktop and console apps (see typing_core/sync.py)
+    if not current_user.is_authenticated:
+        return jsonify({'error': 'Login required'}), 401
+    if request.method == 'GET':
+        device = db.session.get(SyncDevice, (current_user.id, request.args.get('device', '')))
+        return jsonify({'cursor': device.cursor if device else 0,
+                        'maxBatch': app.config['SYNC_MAX_BATCH']})
+
+    try:
+        device_id, results = read_sync_batch()
+    except (TypeError, ValueError, KeyError, zlib.error) as e:
+        return jsonify({'error': str(e) or 'Invalid batch'}), 400
+    if len(results) > app.config['SYNC_MAX_BATCH']:
+        return jsonify({'error': f"At most {app.config['SYNC_MAX_BATCH']} results per batch"}), 413
+    key = request.headers.get('Idempotency-Key')
+    device = db.session.get(SyncDevice, (current_user.id, device_id))
+    if device is not None and key and device.last_key == key:
+        return jsonify({**json.loads(device.last_answer), 'replayed': True})
+
+    cursor = device.cursor if device is not None else 0
+    try:
+        rows, new_cursor = sync_rows(results, cursor)
+    except (TypeError, ValueError, OverflowError) as e:
+        return jsonify({'error': str(e) or 'Invalid result'}), 400
+    answer = {'stored': len(rows), 'skipped': len(results) - len(rows), 'cursor': new_cursor}
+    progress = {'cursor': new_cursor, 'last_key': key, 'last_answer': json.dumps(answer)}
+
+    try:
+        # The cursor moves in the same transaction as the scores are stored,
+        # and only from the value read above: a concurrent push of the same
+        # device gets a 409 and retries against the new cursor
+        if device is None:
+            db.session.add(SyncDevice(user_id=current_user.id, device=device_id, **progress))
+            db.session.flush()
+        elif not SyncDevice.query.filter_by(user_id=current_user.id, device=device_id,
+                                            cursor=cursor).update(progress, synchronize_session=False):
+            db.session.rollback()
+            return jsonify({'error': 'Batch conflicts with a concurrent sync'}), 409
+        if not rows:
+            db.session.commit()
+        else:
+            get_rank_index()
+            if not persist_scores(rows):
+                return jsonify({'error': 'User no longer exists'}), 401
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'Batch conflicts with a concurrent sync'}), 409
     except Exception as e:
-        print(f"Error saving score: {str(e)}")  # Add debug logging
+        app.logger.exception("Error syncing scores")
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
+    return jsonify(answer)
 
 @app.route('/leaderboard')
+@response_cache.cached('scores')
 def leaderboard():
-    # Get user statistics including total games, average WPM, and best WPM
-    stats = db.session.query(
-        User.username,
-        db.func.count(Score.id).label('total_games'),
-        db.func.avg(Score.wpm).label('avg_wpm'),
-        db.func.max(Score.wpm).label('max_wpm'),
-        db.func.avg(Score.accuracy).label('avg_accuracy')
-    ).join(Score).group_by(User.id).order_by(db.desc('max_wpm')).all()
-    
-    return jsonify([{
-        'username': stat.username,
-        'totalGames': int(stat.total_games),
-        'averageWPM': round(float(stat.avg_wpm), 1),
-        'bestWPM': round(float(stat.max_wpm), 1),
-        'averageAccuracy': round(float(stat.avg_accuracy), 1)
-    } for stat in stats])
+    try:
+        # (best WPM, user id)
+        limit, cursor = page_args((int, float), int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Read the precomputed per-user statistics, walking the (best_wpm, user_id) index
+    query = db.session.query(User.username, UserStats).join(UserStats).filter(
+        UserStats.total_games > 0
+    )
+    if cursor:
+        try:
+            best_wpm, user_id = float(cursor[0]), int(cursor[1])
+        except (TypeError, ValueError, IndexError):
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter(db.or_(
+            UserStats.best_wpm < best_wpm,
+            db.and_(UserStats.best_wpm == best_wpm, UserStats.user_id < user_id)
+        ))
+    stats = query.order_by(UserStats.best_wpm.desc(), UserStats.user_id.desc()).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(stats) > limit:
+        stats = stats[:limit]
+        last = stats[-1][1]
+        next_cursor = encode_cursor(last.best_wpm, last.user_id)
+    
+    return paginated([{
+        'username': username,
+        'totalGames': stat.total_games,
+        'averageWPM': round(stat.sum_wpm / stat.total_games, 1),
+        'bestWPM': round(stat.best_wpm, 1),
+        'averageAccuracy': round(stat.sum_accuracy / stat.total_games, 1)
+    } for username, stat in stats], next_cursor)
+
+@app.route('/user_stats')
+@login_required
+def user_stats():
+    # Served from the per-user aggregate row, no scan over the user's scores
+    stats = db.session.get(UserStats, current_user.id)
+    if not stats or not stats.total_games:
+        return jsonify({'totalGames': 0, 'bestWPM': 0, 'averageWPM': 0, 'averageAccuracy': 0})
+    
+    return jsonify({
+        'totalGames': stats.total_games,
+        'bestWPM': round(stats.best_wpm, 1),
+        'averageWPM': round(stats.sum_wpm / stats.total_games, 1),
+        'averageAccuracy': round(stats.sum_accuracy / stats.total_games, 1)
+    })
+
+@app.route('/rank')
+@login_required
+def rank():
+    result = get_rank_index().rank(current_user.id)
+    if result is None:
+        return jsonify({'error': 'No scores yet'}), 404
+    return jsonify(result)
 
 @app.route('/user_history')
 @login_required
 def user_history():
-    scores = Score.query.filter_by(user_id=current_user.id).order_by(Score.timestamp.desc()).all()
-    return jsonify([{
+    try:
+        # (ISO timestamp, score id)
+        limit, cursor = page_args(str, int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Walk the (user_id, timestamp, id) index newest first
+    query = Score.query.filter_by(user_id=current_user.id)
+    if cursor:
+        try:
+            timestamp, score_id = datetime.fromisoformat(cursor[0]), cursor[1]
+        except (TypeError, ValueError, IndexError):
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter(db.or_(
+            Score.timestamp < timestamp,
+            db.and_(Score.timestamp == timestamp, Score.id < score_id)
+        ))
+    scores = query.order_by(Score.timestamp.desc(), Score.id.desc()).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(scores) > limit:
+        scores = scores[:limit]
+        next_cursor = encode_cursor(scores[-1].timestamp.isoformat(), scores[-1].id)
+    
+    return paginated([{
+        'id': score.id,
         'wpm': score.wpm,
         'accuracy': score.accuracy,
+        'flagged': score.flagged,
         'timestamp': score.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-    } for score in scores])
+    } for score in scores], next_cursor)
+
+@app.route('/analytics/global')
+def analytics_global():
+    return jsonify(analytics.global_summary())
+
+@app.route('/analytics/histogram')
+def analytics_histogram():
+    bins = max(1, min(request.args.get('bins', 20, type=int), 200))
+    user_id = current_user.id if request.args.get('scope') == 'user' and current_user.is_authenticated else None
+    return jsonify(analytics.histogram(bins=bins, user_id=user_id))
+
+@app.route('/analytics/trend')
+def analytics_trend():
+    days = max(1, min(request.args.get('days', 30, type=int), 365))
+    return jsonify(analytics.daily_trend(days=days))
+
+@app.route('/analytics/user')
+@login_required
+def analytics_user():
+    window = max(1, min(request.args.get('window', 10, type=int), 100))
+    return jsonify(analytics.user_summary(current_user.id, window=window))
+
+@app.route('/replay/<int:score_id>')
+@login_required
+def replay(score_id):
+    score = db.session.get(Score, score_id)
+    if score is None or (score.user_id != current_user.id and not is_admin()):
+        return jsonify({'error': 'Score not found'}), 404
+    if score.keystrokes is None:
+        return jsonify({'error': 'No keystrokes recorded for this score'}), 404
+    
+    try:
+        events = keystrokes.decode(score.keystrokes)
+    except ValueError:
+        # Only imported or pre-validation recordings can be damaged
+        return jsonify({'error': 'Keystroke recording is damaged'}), 422
+    
+    def generate():
+        # One JSON object per line, t is the time since the first keystroke
+        elapsed = 0
+        for char, dt_ms, correct in events:
+            elapsed += dt_ms
+            yield json.dumps({'char': char, 'dt': dt_ms, 't': elapsed, 'correct': correct}) + '\n'
+    
+    return app.response_class(generate(), mimetype='application/x-ndjson')
 
 if __name__ == '__main__':
     with app.app_context():
@@ -210,9 +1432,11 @@ if __name__ == '__main__':
         db.create_all()
         
         # Create admin user
-        hashed = bcrypt.hashpw('admin123'.encode(), bcrypt.gensalt())
+        hashed = password_pool.hash('admin123')
         admin = User(username='admin', password=hashed, is_admin=True)
         db.session.add(admin)
         db.session.commit()
+        # A shared cache file may still hold pages of the dropped tables
+        response_cache.bump('scores', 'users', 'resets')
         
     app.run(debug=True)
@@ -0,0 +1,202 @@
+"""Production entry point: the Flask app behind an ASGI server.
+
+    python asgi.py
+    FLASK_SERVER_WORKERS=4 FLASK_SERVER_PORT=8000 python asgi.py
+
+Start several workers through main() as above rather than with uvicorn's own
+--workers: main() refuses score buffering with more than one worker and
+switches the response cache to the shared SQLite backend, without which the
+workers would serve stale caches and rank indexes.
+
+The event loop accepts and holds the client connections, so thousands of
+them can stay open while waiting on the server. The views themselves run on
+a bounded thread pool per worker (FLASK_SERVER_THREADS, sized to match the
+SQLAlchemy connection pool), and bcrypt work is passed on to password_pool.
+Request bodies are streamed to the views as they read them, so uploads such
+as /admin/import are never held in memory whole.
+WebSocket connections to /race/<room> go to the race rooms in race.py, which
+run on the event loop itself.
+"""
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_login import current_user
+
+from app import app, corpus, DEFAULT_TEXT, flush_buffered_scores, score_race_finish, upgrade_database
+from race import RaceHub
+
+
+def build_environ(scope, body):
+    """Translate an ASGI HTTP scope and request body into a WSGI environ"""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin1'),
+        'PATH_INFO': scope['path'].encode().decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'SERVER_NAME': scope['server'][0] if scope.get('server') else 'localhost',
+        'SERVER_PORT': str(scope['server'][1]) if scope.get('server') else '80',
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        # The body stream ends where the request does, whatever Content-Length says
+        'wsgi.input_terminated': True
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f"HTTP_{name}"
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+class RequestBody(io.RawIOBase):
+    """wsgi.input pulling the ASGI request body off the event loop as it is read"""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._chunk = b''
+        self._offset = 0
+        self._more = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._offset >= len(self._chunk) and self._more:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                raise OSError('Client disconnected')
+            self._chunk = message.get('body', b'')
+            self._offset = 0
+            self._more = message.get('more_body', False)
+        size = min(len(buffer), len(self._chunk) - self._offset)
+        buffer[:size] = self._chunk[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+
+class WSGIBridge:
+    """Serve a WSGI app over ASGI, running it on a fixed pool of threads"""
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='view')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope {scope['type']}")
+
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, io.BufferedReader(RequestBody(receive, loop), 1 << 16))
+        await loop.run_in_executor(self.executor, self.run, environ, send, loop)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def run(self, environ, send, loop):
+        # Runs on a pool thread, every message is handed back to the event loop
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [{
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin1'), value.encode('latin1'))
+                            for name, value in headers]
+            }]
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            emit(started[0])
+            for chunk in result:
+                if chunk:
+                    emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            emit({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+def websocket_user(scope):
+    """(id, username) of the user logged in on a WebSocket handshake, or None"""
+    scope = {**scope, 'method': 'GET', 'scheme': 'https' if scope.get('scheme') == 'wss' else 'http'}
+    with app.request_context(build_environ(scope, io.BytesIO())):
+        if current_user.is_authenticated:
+            return current_user.id, current_user.username
+    return None
+
+
+def race_passage():
+    return corpus.sample() or {'id': None, 'text': DEFAULT_TEXT}
+
+
+bridge = WSGIBridge(app, threads=app.config['SERVER_THREADS'])
+# All scores of a finished race go in as one batch
+races = RaceHub(race_passage, websocket_user, flush_buffered_scores, score_race_finish,
+                tick_rate=app.config['RACE_TICK_RATE'],
+                max_players=app.config['RACE_MAX_PLAYERS'],
+                countdown=app.config['RACE_COUNTDOWN'],
+                timeout=app.config['RACE_TIMEOUT'])
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'].startswith('/race/') and len(scope['path']) > len('/race/'):
+            await races(scope, receive, send)
+        else:
+            await send({'type': 'websocket.close'})
+        return
+    await bridge(scope, receive, send)
+
+
+def main():
+    import uvicorn
+
+    workers = app.config['SERVER_WORKERS']
+    if workers > 1:
+        if app.config['SCORE_BUFFERING']:
+            raise SystemExit("Score buffering uses one spool file per process, "
+                             "run a single worker or disable FLASK_SCORE_BUFFERING")
+        # Workers have to see each other's invalidations; they are spawned
+        # fresh and read this before importing the app
+        os.environ.setdefault('FLASK_RESPONSE_CACHE_BACKEND', 'sqlite')
+
+    with app.app_context():
+        upgrade_database()
+
+    uvicorn.run('asgi:application',
+                app_dir=os.path.dirname(os.path.abspath(__file__)),
+                host=app.config['SERVER_HOST'],
+                port=app.config['SERVER_PORT'],
+                workers=workers,
+                backlog=app.config['SERVER_BACKLOG'],
+                lifespan='on')
+
+
+if __name__ == '__main__':
+    main()
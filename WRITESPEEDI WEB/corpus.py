@@ -0,0 +1,131 @@
+"""Typing-text corpus with an in-memory index.
+
+Passages live in tab separated files, one passage per line:
+
+    lang<TAB>difficulty<TAB>text
+
+Loading a corpus does not keep the passages as Python strings. Each file is
+memory-mapped and only the byte offset and length of every line are recorded
+in compact arrays, grouped by (language, length bucket, difficulty). Every
+combination with wildcards is indexed too, so sampling with any subset of
+filters is a single random pick from one array.
+"""
+import glob
+import hashlib
+import mmap
+import os
+import random
+from array import array
+
+# Passages are grouped by word count into the smallest bucket that fits
+LENGTH_BUCKETS = (25, 50, 100, 200, 400)
+
+
+def length_bucket(words):
+    for bucket in LENGTH_BUCKETS:
+        if words <= bucket:
+            return bucket
+    return LENGTH_BUCKETS[-1]
+
+
+class Corpus:
+    def __init__(self, paths):
+        self.paths = sorted(paths)
+        self._maps = []
+        self._files = array('H')
+        self._offsets = array('Q')
+        self._lengths = array('I')
+        self._meta = []
+        self._meta_ids = {}
+        self._meta_of = array('H')
+        self._index = {}
+        fingerprint = hashlib.sha1()
+        for path in self.paths:
+            stat = os.stat(path)
+            fingerprint.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+            self._load(path)
+        self.version = fingerprint.hexdigest()[:12]
+        self._build_index()
+
+    @classmethod
+    def from_path(cls, path):
+        """Load a single corpus file or every *.tsv file in a directory"""
+        if os.path.isdir(path):
+            return cls(glob.glob(os.path.join(path, '*.tsv')))
+        return cls([path] if os.path.exists(path) else [])
+
+    def _load(self, path):
+        if not os.path.getsize(path):
+            return
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        file_id = len(self._maps)
+        self._maps.append(data)
+
+        start, size = 0, len(data)
+        while start < size:
+            end = data.find(b'\n', start)
+            if end == -1:
+                end = size
+            line = data[start:end].rstrip(b'\r')
+            first = line.find(b'\t')
+            second = line.find(b'\t', first + 1) if first != -1 else -1
+            text_start = second + 1
+            if second != -1 and text_start < len(line):
+                lang = line[:first].decode()
+                difficulty = line[first + 1:second].decode()
+                words = line.count(b' ', text_start) + 1
+                self._add(file_id, start + text_start, len(line) - text_start,
+                          (lang, length_bucket(words), difficulty))
+            start = end + 1
+
+    def _add(self, file_id, offset, length, meta):
+        self._files.append(file_id)
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        meta_id = self._meta_ids.get(meta)
+        if meta_id is None:
+            meta_id = self._meta_ids[meta] = len(self._meta)
+            self._meta.append(meta)
+        self._meta_of.append(meta_id)
+
+    def _build_index(self):
+        # Group passage ids by their exact metadata first, then fan each
+        # group out to the seven wildcard keys it also belongs to
+        groups = [array('I') for _ in self._meta]
+        for passage_id, meta_id in enumerate(self._meta_of):
+            groups[meta_id].append(passage_id)
+        for (lang, bucket, difficulty), ids in zip(self._meta, groups):
+            for key in ((lang, bucket, difficulty), (lang, bucket, None), (lang, None, difficulty),
+                        (None, bucket, difficulty), (lang, None, None), (None, bucket, None),
+                        (None, None, difficulty), (None, None, None)):
+                self._index.setdefault(key, array('I')).extend(ids)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def get(self, passage_id):
+        """Return the passage with the given id as a dict, or None"""
+        if not 0 <= passage_id < len(self._offsets):
+            return None
+        offset = self._offsets[passage_id]
+        data = self._maps[self._files[passage_id]]
+        lang, bucket, difficulty = self._meta[self._meta_of[passage_id]]
+        return {
+            'id': passage_id,
+            'text': data[offset:offset + self._lengths[passage_id]].decode(),
+            'lang': lang,
+            'length_bucket': bucket,
+            'difficulty': difficulty
+        }
+
+    def sample(self, lang=None, words=None, difficulty=None):
+        """Pick a random passage matching the given filters, or None"""
+        bucket = length_bucket(words) if words else None
+        ids = self._index.get((lang, bucket, difficulty))
+        if not ids:
+            return None
+        return self.get(ids[random.randrange(len(ids))])
+
+    def etag(self, passage_id):
+        return f"{self.version}-{passage_id}"
@@ -0,0 +1,54 @@
+"""Shared SQLite setup for the web server and the desktop app.
+
+Both front-ends talk to SQLite files. Opened with the defaults, every
+connection uses the rollback journal, so readers wait behind the writer and
+each commit pays a full fsync. The pragmas below switch to WAL and trade a
+little durability on power loss for much cheaper commits. Connections are
+long-lived instead of being reopened for every query.
+"""
+import sqlite3
+import threading
+
+SQLITE_PRAGMAS = (
+    # Readers no longer block behind the writer
+    ('journal_mode', 'WAL'),
+    # Sync at checkpoints instead of every commit, safe in WAL mode
+    ('synchronous', 'NORMAL'),
+    # Wait for a lock instead of failing with "database is locked" (ms)
+    ('busy_timeout', 5000),
+    # Read the database through a 256 MiB memory map
+    ('mmap_size', 268435456),
+    # 64 MiB page cache per connection (negative means KiB)
+    ('cache_size', -65536),
+    ('temp_store', 'MEMORY'),
+    # Enforce foreign keys, SQLite ignores them by default
+    ('foreign_keys', 'ON'),
+)
+
+_local = threading.local()
+
+
+def apply_pragmas(connection):
+    """Apply SQLITE_PRAGMAS to a fresh DB-API connection"""
+    cursor = connection.cursor()
+    for name, value in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def connect(path):
+    """Return this thread's long-lived connection to path, opening it once"""
+    connections = _local.__dict__.setdefault('connections', {})
+    connection = connections.get(path)
+    if connection is None:
+        connection = sqlite3.connect(path)
+        apply_pragmas(connection)
+        connections[path] = connection
+    return connection
+
+
+def close_all():
+    """Close the connections opened by the current thread"""
+    connections = _local.__dict__.pop('connections', {})
+    for connection in connections.values():
+        connection.close()
@@ -1,10 +1,229 @@
 import customtkinter as ctk
-import sqlite3
+from tkinter import ttk
 import bcrypt
+import os
+import sys
 import random
 import time
+import uuid
+import queue
+import threading
 from typing import Optional
 from datetime import datetime
+import database
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from typing_core.keystrokes import KeystrokeRecorder
+from typing_core.scoring import IncrementalScorer, score
+from typing_core.sync import SyncClient, BackgroundSync, encode_keystrokes
+
+DB_PATH = 'typespeed.db'
+# Web server to upload scores to, e.g. http://localhost:5000 (off when unset)
+SYNC_URL = os.environ.get('WRITESPEEDI_SYNC_URL')
+
+SAMPLE_TEXTS = (
+    "The quick brown fox jumps over the lazy dog.",
+    "Programming is the art of telling another human what one wants the computer to do.",
+    "Success is not final, failure is not fatal: it is the courage to continue that counts.",
+)
+
+class BackgroundWorker:
+    """Runs blocking work (SQLite, bcrypt) off the Tk main loop.
+
+    submit(work, on_done) queues work() for the worker thread. Its result, or
+    the exception it raised, is handed to on_done(result, error) back on the
+    main loop, which polls the result queue with root.after while anything
+    is outstanding. Work runs in submission order on a single thread, so it
+    always sees the effects of earlier work.
+    """
+
+    def __init__(self, root, poll_ms=15):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._outstanding = 0
+        self._thread = threading.Thread(target=self._run, name="db-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, work, on_done=None):
+        self._jobs.put((work, on_done))
+        self._outstanding += 1
+        if self._outstanding == 1:
+            self.root.after(self.poll_ms, self._poll)
+
+    def stop(self, timeout=5):
+        """Let queued work finish, e.g. a score being saved, before the app exits"""
+        self._jobs.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            work, on_done = job
+            try:
+                result, error = work(), None
+            except Exception as e:
+                result, error = None, e
+            self._results.put((on_done, result, error))
+
+    def _poll(self):
+        while True:
+            try:
+                on_done, result, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._outstanding -= 1
+            if on_done:
+                on_done(result, error)
+            elif error:
+                raise error
+        if self._outstanding:
+            self.root.after(self.poll_ms, self._poll)
+
+class HistoryView:
+    """Windowed score history that only materializes the visible rows.
+
+    The Treeview holds exactly `height` rows whose values are swapped while
+    scrolling. Scores are read from SQLite a page at a time on the worker
+    thread, with `margin` extra rows above and below the visible window kept
+    in memory; rows are drawn once their page has arrived.
+    """
+
+    def __init__(self, parent, username, worker, height=10, margin=30, on_empty=None):
+        self.username = username
+        self.worker = worker
+        self.height = height
+        self.margin = margin
+        self.on_empty = on_empty
+        self.first = 0
+        self.cache_start = 0
+        self.cache = []
+        self.total = 0
+        self.loading = False
+
+        self.tree = ttk.Treeview(parent, columns=("wpm", "accuracy", "timestamp"),
+                                 show="headings", height=height)
+        self.tree.heading("wpm", text="WPM")
+        self.tree.heading("accuracy", text="Accuracy")
+        self.tree.heading("timestamp", text="Date")
+        self.scrollbar = ctk.CTkScrollbar(parent, command=self.on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y", pady=10)
+        self.tree.pack(side="left", fill="both", expand=True, padx=10, pady=10)
+
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_to(self.first + (-1 if e.delta > 0 else 1)))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_to(self.first - 1))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_to(self.first + 1))
+        self.worker.submit(self.count, self.on_count)
+
+    def count(self):
+        c = database.connect(DB_PATH).cursor()
+        c.execute("SELECT COUNT(*) FROM scores WHERE username=?", (self.username,))
+        return c.fetchone()[0]
+
+    def fetch(self, start, count):
+        """Read one page of scores, newest first"""
+        c = database.connect(DB_PATH).cursor()
+        c.execute("""SELECT wpm, accuracy, timestamp
+                    FROM scores
+                    WHERE username=?
+                    ORDER BY timestamp DESC
+                    LIMIT ? OFFSET ?""",
+                 (self.username, count, start))
+        return c.fetchall()
+
+    def on_count(self, total, error):
+        if error:
+            raise error
+        if not self.tree.winfo_exists():
+            return
+        self.total = total
+        if not total and self.on_empty:
+            self.on_empty()
+        self.scroll_to(0)
+
+    def on_page(self, page, error):
+        self.loading = False
+        if error:
+            raise error
+        if not self.tree.winfo_exists():
+            return
+        self.cache_start, self.cache = page
+        self.scroll_to(self.first)
+
+    def rows(self, start, count):
+        """The cached rows from start, or None while their page is being read"""
+        end = min(start + count, self.total)
+        if start < self.cache_start or end > self.cache_start + len(self.cache):
+            if not self.loading:
+                # Whatever is visible when the page arrives is checked again then
+                self.loading = True
+                cache_start = max(0, start - self.margin)
+                limit = end - cache_start + self.margin
+                self.worker.submit(lambda: (cache_start, self.fetch(cache_start, limit)), self.on_page)
+            return None
+        offset = start - self.cache_start
+        return self.cache[offset:offset + end - start]
+
+    def on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(value) * self.total))
+        elif action == "scroll":
+            step = self.height if unit == "pages" else 1
+            self.scroll_to(self.first + int(value) * step)
+
+    def scroll_to(self, first):
+        self.first = max(0, min(first, self.total - self.height))
+        rows = self.rows(self.first, self.height)
+        if rows is None:
+            return
+        items = self.tree.get_children()
+        for i, (wpm, accuracy, timestamp) in enumerate(rows):
+            values = (int(wpm), f"{int(accuracy)}%", timestamp)
+            if i < len(items):
+                self.tree.item(items[i], values=values)
+            else:
+                self.tree.insert("", "end", values=values)
+        for item in items[len(rows):]:
+            self.tree.delete(item)
+
+        if self.total:
+            self.scrollbar.set(self.first / self.total, min(1.0, (self.first + self.height) / self.total))
+
+class ScoreOutbox:
+    """One user's local scores as the outbox of typing_core.sync.
+
+    Local ids are the rowids of the scores table, which only grow since
+    scores are never deleted. Each user gets its own device id, so the
+    server keeps a separate cursor per local account.
+    """
+
+    def __init__(self, username):
+        self.username = username
+        conn = database.connect(DB_PATH)
+        row = conn.execute("SELECT device FROM sync_state WHERE username=?", (username,)).fetchone()
+        if row is None:
+            row = (uuid.uuid4().hex,)
+            conn.execute("INSERT INTO sync_state VALUES (?, ?, 0)", (username, row[0]))
+            conn.commit()
+        self.device = row[0]
+
+    def pending(self, after, limit):
+        # Runs on the sync thread, which has its own connection
+        c = database.connect(DB_PATH).cursor()
+        c.execute('''SELECT rowid, timestamp, wpm, accuracy, keystrokes FROM scores
+                    WHERE username=? AND rowid>? ORDER BY rowid LIMIT ?''',
+                  (self.username, after, limit))
+        return [[rowid, time.mktime(time.strptime(timestamp, "%Y-%m-%d %H:%M:%S")),
+                 wpm, accuracy, encode_keystrokes(blob)]
+                for rowid, timestamp, wpm, accuracy, blob in c.fetchall()]
+
+    def synced(self, cursor):
+        conn = database.connect(DB_PATH)
+        conn.execute("UPDATE sync_state SET cursor=? WHERE username=?", (cursor, self.username))
+        conn.commit()
 
 class TypeSpeedTester:
     def __init__(self):
@@ -17,22 +236,27 @@ class TypeSpeedTester:
         ctk.set_appearance_mode("dark")
         ctk.set_default_color_theme("dark-blue")
         
-        # Database initialization
-        self.init_database()
+        # All SQLite and bcrypt work happens on the worker, starting with the schema
+        self.worker = BackgroundWorker(self.root)
+        self.worker.submit(self.init_database)
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
         
         # Variables
         self.current_user: Optional[str] = None
         self.test_started = False
         self.start_time = 0
-        self.words_typed = 0
-        self.correct_words = 0
+        # Live word and character counts, kept up to date from key events
+        self.scorer: Optional[IncrementalScorer] = None
+        self.rescore = False
+        self.recorder = KeystrokeRecorder()
+        self.sync: Optional[BackgroundSync] = None
         
         # Create and show login frame
         self.show_login_frame()
         
     def init_database(self):
         """Initialize SQLite database with required tables"""
-        conn = sqlite3.connect('typespeed.db')
+        conn = database.connect(DB_PATH)
         c = conn.cursor()
         
         # Create users table
@@ -42,10 +266,23 @@ class TypeSpeedTester:
         # Create scores table
         c.execute('''CREATE TABLE IF NOT EXISTS scores
                     (username TEXT, wpm REAL, accuracy REAL, timestamp TEXT,
+                    keystrokes BLOB,
                     FOREIGN KEY(username) REFERENCES users(username))''')
         
+        # Databases created before keystrokes were recorded lack the column
+        c.execute("PRAGMA table_info(scores)")
+        if 'keystrokes' not in [column[1] for column in c.fetchall()]:
+            c.execute("ALTER TABLE scores ADD COLUMN keystrokes BLOB")
+        
+        # Serves the paged history queries
+        c.execute('''CREATE INDEX IF NOT EXISTS ix_scores_username_timestamp
+                    ON scores (username, timestamp)''')
+        
+        # Upload progress per user, see ScoreOutbox
+        c.execute('''CREATE TABLE IF NOT EXISTS sync_state
+                    (username TEXT PRIMARY KEY, device TEXT, cursor INTEGER)''')
+        
         conn.commit()
-        conn.close()
 
     def show_login_frame(self):
         """Display login interface"""
@@ -67,35 +304,56 @@ class TypeSpeedTester:
         self.password_entry.pack(pady=10)
         
         # Login button
-        login_btn = ctk.CTkButton(self.login_frame, text="Login", 
-                                 command=self.login)
-        login_btn.pack(pady=10)
+        self.login_btn = ctk.CTkButton(self.login_frame, text="Login", 
+                                      command=self.login)
+        self.login_btn.pack(pady=10)
         
         # Register button
-        register_btn = ctk.CTkButton(self.login_frame, text="Register", 
-                                    command=self.register)
-        register_btn.pack(pady=10)
+        self.register_btn = ctk.CTkButton(self.login_frame, text="Register", 
+                                         command=self.register)
+        self.register_btn.pack(pady=10)
+
+    def set_login_busy(self, busy):
+        """Disable the login buttons while the worker checks or stores a password"""
+        state = "disabled" if busy else "normal"
+        self.login_btn.configure(state=state)
+        self.register_btn.configure(state=state)
+
+    def show_login_message(self, text, color="red"):
+        message = ctk.CTkLabel(self.login_frame, text=text, text_color=color)
+        message.pack(pady=10)
 
     def login(self):
         """Handle user login"""
         username = self.username_entry.get()
         password = self.password_entry.get()
         
-        conn = sqlite3.connect('typespeed.db')
-        c = conn.cursor()
-        c.execute("SELECT password FROM users WHERE username=?", (username,))
-        result = c.fetchone()
-        
-        if result and bcrypt.checkpw(password.encode(), result[0]):
-            self.current_user = username
-            self.login_frame.destroy()
-            self.show_main_interface()
-        else:
-            error = ctk.CTkLabel(self.login_frame, text="Invalid credentials", 
-                                text_color="red")
-            error.pack(pady=10)
-        
-        conn.close()
+        def check():
+            # bcrypt takes a noticeable fraction of a second, keep it off the UI
+            c = database.connect(DB_PATH).cursor()
+            c.execute("SELECT password FROM users WHERE username=?", (username,))
+            result = c.fetchone()
+            if not (result and bcrypt.checkpw(password.encode(), result[0])):
+                return None
+            return ScoreOutbox(username) if SYNC_URL else True
+        
+        def done(outbox, error):
+            self.set_login_busy(False)
+            if error:
+                self.show_login_message(f"Login failed: {error}")
+            elif outbox is None:
+                self.show_login_message("Invalid credentials")
+            else:
+                self.current_user = username
+                if SYNC_URL:
+                    # Scores saved while offline are uploaded now, later ones as they come
+                    self.sync = BackgroundSync(SyncClient(SYNC_URL, username, password), outbox)
+                    self.sync.kick()
+                self.login_frame.destroy()
+                self.show_main_interface()
+        
+        self.set_login_busy(True)
+        self.worker.submit(check, done)
 
     def register(self):
         """Handle user registration"""
@@ -103,31 +361,35 @@ class TypeSpeedTester:
         password = self.password_entry.get()
         
         if not username or not password:
-            error = ctk.CTkLabel(self.login_frame, text="Please fill all fields", 
-                                text_color="red")
-            error.pack(pady=10)
-            return
-        
-        conn = sqlite3.connect('typespeed.db')
-        c = conn.cursor()
-        
-        # Check if username exists
-        c.execute("SELECT username FROM users WHERE username=?", (username,))
-        if c.fetchone():
-            error = ctk.CTkLabel(self.login_frame, text="Username already exists", 
-                                text_color="red")
-            error.pack(pady=10)
+            self.show_login_message("Please fill all fields")
             return
         
-        # Hash password and store user
-        hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-        c.execute("INSERT INTO users VALUES (?, ?)", (username, hashed))
-        conn.commit()
-        conn.close()
-        
-        success = ctk.CTkLabel(self.login_frame, text="Registration successful!", 
-                              text_color="green")
-        success.pack(pady=10)
+        def store():
+            conn = database.connect(DB_PATH)
+            c = conn.cursor()
+            
+            # Check if username exists
+            c.execute("SELECT username FROM users WHERE username=?", (username,))
+            if c.fetchone():
+                return False
+            
+            # Hash password and store user
+            hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+            c.execute("INSERT INTO users VALUES (?, ?)", (username, hashed))
+            conn.commit()
+            return True
+        
+        def done(created, error):
+            self.set_login_busy(False)
+            if error:
+                self.show_login_message(f"Registration failed: {error}")
+            elif not created:
+                self.show_login_message("Username already exists")
+            else:
+                self.show_login_message("Registration successful!", color="green")
+        
+        self.set_login_busy(True)
+        self.worker.submit(store, done)
 
     def show_main_interface(self):
         """Display main typing test interface"""
@@ -152,6 +414,11 @@ class TypeSpeedTester:
                                         font=("Arial", 14))
         self.input_area.pack(pady=10, padx=10, fill="x")
         self.input_area.configure(state="disabled")
+        self.input_area.bind("<Key>", self.record_keystroke)
+        self.input_area.bind("<KeyRelease>", self.check_finished)
+        # Edits that do not come from plain key presses
+        for sequence in ("<<Paste>>", "<<Cut>>", "<<Undo>>", "<<Redo>>", "<<Clear>>", "<ButtonRelease-2>"):
+            self.input_area.bind(sequence, self.request_recount)
         
         # Stats frame
         stats_frame = ctk.CTkFrame(self.main_frame)
@@ -184,16 +451,10 @@ class TypeSpeedTester:
 
     def start_test(self):
         """Start a new typing test"""
-        sample_texts = [
-            "The quick brown fox jumps over the lazy dog.",
-            "Programming is the art of telling another human what one wants the computer to do.",
-            "Success is not final, failure is not fatal: it is the courage to continue that counts.",
-        ]
-        
         self.test_started = True
         self.start_time = time.time()
-        self.words_typed = 0
-        self.correct_words = 0
+        self.rescore = False
+        self.recorder.reset()
         
         # Reset and enable input area
         self.input_area.configure(state="normal")
@@ -202,9 +463,10 @@ class TypeSpeedTester:
         # Set new test text
         self.text_display.configure(state="normal")
         self.text_display.delete("1.0", "end")
-        self.current_text = random.choice(sample_texts)
+        self.current_text = random.choice(SAMPLE_TEXTS)
         self.text_display.insert("1.0", self.current_text)
         self.text_display.configure(state="disabled")
+        self.scorer = IncrementalScorer(self.current_text)
         
         # Start timer update
         self.update_timer()
@@ -215,46 +477,121 @@ class TypeSpeedTester:
             elapsed = int(time.time() - self.start_time)
             self.time_label.configure(text=f"Time: {elapsed}s")
             
-            # Calculate WPM
+            # From the tracked counts, the text is only read again after
+            # edits that were not tracked
             if elapsed > 0:
-                words = len(self.input_area.get("1.0", "end-1c").split())
-                wpm = (words / elapsed) * 60
-                self.wpm_label.configure(text=f"WPM: {int(wpm)}")
+                live = self.current_scorer().result(elapsed)
+                self.wpm_label.configure(text=f"WPM: {int(live['wpm'])}")
+                self.accuracy_label.configure(text=f"Accuracy: {int(live['accuracy'])}%")
             
             self.root.after(1000, self.update_timer)
 
+    def request_recount(self, event=None):
+        self.rescore = True
+
+    def current_scorer(self):
+        """The live scorer, rebuilt from the input box after untracked edits"""
+        if self.rescore:
+            self.scorer.reset(self.input_area.get("1.0", "end-1c"))
+            self.rescore = False
+        return self.scorer
+
+    def cursor_offset(self):
+        line, column = map(int, self.input_area.index("insert").split("."))
+        return column if line == 1 else len(self.input_area.get("1.0", "insert"))
+
+    def track_edit(self, event):
+        """Apply a key press to the scorer, before Tk applies it to the text"""
+        if event.state & 0x4 or (self.input_area.tag_ranges("sel") and (event.char or event.keysym == "Delete")):
+            # Control shortcuts and replaced selections can change any amount of text
+            if event.char or event.keysym in ("BackSpace", "Delete"):
+                self.rescore = True
+        elif event.keysym == "BackSpace":
+            position = self.cursor_offset()
+            if position:
+                self.scorer.delete(position - 1, 1)
+        elif event.keysym == "Delete":
+            position = self.cursor_offset()
+            if position < len(self.scorer.typed):
+                self.scorer.delete(position, 1)
+        elif event.char and (event.char.isprintable() or event.char in " \r\t"):
+            self.scorer.insert(self.cursor_offset(), "\n" if event.char == "\r" else event.char)
+
+    def record_keystroke(self, event):
+        """Record the character and timing of a keystroke in the input area"""
+        if not self.test_started:
+            return
+        typed = len(event.char) == 1 and (event.char.isprintable() or event.char == " ")
+        # A selection goes entirely, one '\b' per character of it
+        selected = (len(self.input_area.get("sel.first", "sel.last"))
+                    if self.input_area.tag_ranges("sel") and (typed or event.keysym == "BackSpace") else 0)
+        position = len(self.input_area.get("1.0", "sel.first")) if selected else self.cursor_offset()
+        self.track_edit(event)
+        if event.keysym == "BackSpace":
+            for _ in range(selected or (1 if position else 0)):
+                self.recorder.record("\b", False)
+        elif typed:
+            for _ in range(selected):
+                self.recorder.record("\b", False)
+            expected = self.current_text[position] if 0 <= position < len(self.current_text) else None
+            self.recorder.record(event.char, event.char == expected)
+
+    def check_finished(self, event=None):
+        """End the test once the whole text has been typed correctly"""
+        if self.test_started and self.current_scorer().is_complete():
+            self.finish_test()
+
+    def finish_test(self):
+        """Stop the test and store the score with its keystrokes"""
+        self.test_started = False
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        final = score(self.input_area.get("1.0", "end-1c"), self.current_text, elapsed)
+        wpm, accuracy = final['wpm'], final['accuracy']
+        
+        self.input_area.configure(state="disabled")
+        self.wpm_label.configure(text=f"WPM: {int(wpm)}")
+        self.accuracy_label.configure(text=f"Accuracy: {int(accuracy)}%")
+        
+        row = (self.current_user, wpm, accuracy,
+               datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+               self.recorder.encode())
+        sync = self.sync
+        
+        def store():
+            conn = database.connect(DB_PATH)
+            conn.execute("INSERT INTO scores VALUES (?, ?, ?, ?, ?)", row)
+            conn.commit()
+        
+        def done(result, error):
+            if error and self.accuracy_label.winfo_exists():
+                self.accuracy_label.configure(text=f"Score not saved: {error}")
+            elif sync:
+                sync.kick()
+        
+        self.worker.submit(store, done)
+
     def show_history(self):
         """Display user's typing test history"""
         history_window = ctk.CTkToplevel(self.root)
         history_window.title("Test History")
         history_window.geometry("400x300")
         
-        conn = sqlite3.connect('typespeed.db')
-        c = conn.cursor()
-        c.execute("""SELECT wpm, accuracy, timestamp 
-                    FROM scores 
-                    WHERE username=? 
-                    ORDER BY timestamp DESC""", 
-                 (self.current_user,))
-        scores = c.fetchall()
-        conn.close()
-        
-        if scores:
-            for wpm, accuracy, timestamp in scores:
-                score_frame = ctk.CTkFrame(history_window)
-                score_frame.pack(pady=5, padx=10, fill="x")
-                
-                ctk.CTkLabel(score_frame, 
-                            text=f"WPM: {int(wpm)} | Accuracy: {int(accuracy)}% | {timestamp}").pack()
-        else:
-            ctk.CTkLabel(history_window, text="No history available").pack(pady=20)
+        self.history_view = HistoryView(
+            history_window, self.current_user, self.worker,
+            on_empty=lambda: ctk.CTkLabel(history_window, text="No history available").pack(pady=20))
 
     def logout(self):
         """Handle user logout"""
         self.current_user = None
+        self.sync = None
         self.main_frame.destroy()
         self.show_login_frame()
 
+    def close(self):
+        """Finish pending database work, then close the window"""
+        self.worker.stop()
+        self.root.destroy()
+
     def run(self):
         """Start the application"""
         self.root.mainloop()
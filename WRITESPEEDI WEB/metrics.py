@@ -0,0 +1,242 @@
+"""Request metrics in the Prometheus text format.
+
+Every request is timed per route, together with the number of SQL queries
+it ran and the time spent in them (counted through SQLAlchemy cursor
+events). Password hashing and checking times come from password_pool.
+/metrics renders everything in the text exposition format; figures are per
+process.
+
+Slow requests can optionally be profiled: a sampling thread records the
+stack of every thread serving a request at a fixed interval, and requests
+slower than the threshold have their samples written as collapsed stacks
+("frame;frame;frame count" per line), which flamegraph.pl, speedscope and
+similar tools read directly.
+"""
+import bisect
+import collections
+import os
+import re
+import sys
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SQL_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+PASSWORD_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._lock = threading.Lock()
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labels, label_values, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, label_values)} {values[-1]}"
+            yield f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}"
+
+
+class Reading:
+    # A value owned by another component, read() is called at scrape time
+
+    def __init__(self, name, help, read, kind='gauge'):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def samples(self):
+        yield f"{self.name} {self.read()}"
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold, interval, directory):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory
+        self._active = {}
+        self._thread = threading.Thread(target=self._run, name='slow-request-profiler', daemon=True)
+        self._thread.start()
+
+    def begin(self):
+        self._active[threading.get_ident()] = collections.Counter()
+
+    def end(self, duration, label):
+        stacks = self._active.pop(threading.get_ident(), None)
+        if not stacks or duration < self.threshold:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_') or 'request'
+        path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(duration * 1000)}ms-{name}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    @staticmethod
+    def collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for ident, stacks in list(self._active.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    stacks[self.collapse(frame)] += 1
+
+
+class Metrics:
+    def __init__(self):
+        self._local = threading.local()
+        self.request_seconds = Histogram('writespeedi_request_duration_seconds',
+                                         'Request latency by route', LATENCY_BUCKETS, ('route', 'method'))
+        self.requests = Counter('writespeedi_requests_total', 'Finished requests by route and status',
+                                ('route', 'method', 'status'))
+        self.request_queries = Histogram('writespeedi_request_sql_queries', 'SQL queries per request',
+                                         QUERY_COUNT_BUCKETS, ('route',))
+        self.request_sql_seconds = Histogram('writespeedi_request_sql_seconds', 'Time in SQL per request',
+                                             SQL_TIME_BUCKETS, ('route',))
+        self.queries = Counter('writespeedi_sql_queries_total', 'SQL queries, including background work')
+        self.password_seconds = Histogram('writespeedi_password_seconds',
+                                          'bcrypt hash and check time, including the pool queue',
+                                          PASSWORD_BUCKETS, ('operation',))
+        self.collectors = [self.request_seconds, self.requests, self.request_queries,
+                           self.request_sql_seconds, self.queries, self.password_seconds]
+        self.profiler = None
+        self.logger = None
+
+    def init_app(self, app, engine):
+        self.logger = app.logger
+        if app.config['PROFILE_SLOW_REQUESTS']:
+            self.profiler = SlowRequestProfiler(app.config['PROFILE_SLOW_REQUESTS'],
+                                                app.config['PROFILE_INTERVAL'],
+                                                app.config['PROFILE_DIR'])
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def add_reading(self, name, help, read, kind='gauge'):
+        self.collectors.append(Reading(name, help, read, kind))
+
+    def _before_request(self):
+        self._local.queries = 0
+        self._local.sql_seconds = 0.0
+        g.metrics_started = time.perf_counter()
+        if self.profiler:
+            self.profiler.begin()
+
+    def _after_request(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        status = g.pop('metrics_status', 500)
+        self.request_seconds.observe(duration, route, request.method)
+        self.requests.inc(route, request.method, str(status))
+        self.request_queries.observe(self._local.queries, route)
+        self.request_sql_seconds.observe(self._local.sql_seconds, route)
+        self._local.queries = None
+        if self.profiler:
+            path = self.profiler.end(duration, f"{request.method} {route}")
+            if path:
+                self.logger.warning("Slow request %s %s took %.3fs, stacks in %s",
+                                    request.method, request.path, duration, path)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Kept on the execution context, which goes away with the query even
+        # when it fails and never reaches after_cursor_execute
+        if context is not None:
+            context.metrics_query_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, 'metrics_query_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        self.queries.inc()
+        # Only queries run while serving a request on this thread
+        if getattr(self._local, 'queries', None) is not None:
+            self._local.queries += 1
+            self._local.sql_seconds += elapsed
+
+    def observe_password(self, operation, seconds):
+        self.password_seconds.observe(seconds, operation)
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            lines.append(f"# HELP {collector.name} {collector.help}")
+            lines.append(f"# TYPE {collector.name} {collector.kind}")
+            lines.extend(collector.samples())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,105 @@
+"""Bounded worker pool for bcrypt password hashing.
+
+bcrypt is deliberately slow, so hashing and checking passwords inside the
+request handler ties up a server thread for the whole work factor. The pool
+runs that work on a fixed number of workers and admits only a limited number
+of waiting jobs; when it is full, callers get PoolBusy right away instead of
+queueing behind everyone else.
+"""
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt
+
+
+class PoolBusy(Exception):
+    """Raised when the password pool cannot take any more work"""
+
+
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check_password(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+class PasswordPool:
+    def __init__(self, workers=4, max_queue=32, rounds=12, kind='thread', timeout=30):
+        # bcrypt releases the GIL, so threads scale fine; processes are there
+        # for deployments that want the work fully isolated from the server
+        executor_cls = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+        self.executor = executor_cls(max_workers=workers)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rounds = rounds
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        # Called with ('hash' or 'check', seconds including the wait in the queue)
+        self.observer = None
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def run(self, fn, *args):
+        """Run fn on the pool and wait for its result, or raise PoolBusy
+
+        A job that does not finish within timeout seconds counts as rejected
+        too: the caller gets PoolBusy and the job is cancelled if it has not
+        started yet.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PoolBusy()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            with self._lock:
+                self._rejected += 1
+            raise PoolBusy()
+
+    def _timed(self, operation, fn, *args):
+        started = time.perf_counter()
+        result = self.run(fn, *args)
+        if self.observer:
+            self.observer(operation, time.perf_counter() - started)
+        return result
+
+    def hash(self, password):
+        return self._timed('hash', _hash_password, password.encode(), self.rounds)
+
+    def check(self, password, hashed):
+        if isinstance(hashed, str):
+            hashed = hashed.encode()
+        return self._timed('check', _check_password, password.encode(), hashed)
+
+    def status(self):
+        with self._lock:
+            in_flight = self._in_flight
+            rejected = self._rejected
+        return {
+            'workers': self.workers,
+            'in_flight': in_flight,
+            'queued': max(0, in_flight - self.workers),
+            'max_queue': self.max_queue,
+            'rejected': rejected
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
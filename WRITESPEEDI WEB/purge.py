@@ -0,0 +1,186 @@
+"""Background jobs for large deletions, and the score archive format.
+
+Deleting every score in one statement holds SQLite's write lock for the
+whole delete, so saves and logins stall behind it. Purges instead run on a
+background thread, one at a time, deleting a chunk of rows per transaction
+and pausing briefly between chunks so other writers get their turn. Each job
+reports how many rows it has handled so far.
+
+Job state goes to a store, so that with several server processes any of
+them can answer for a job and only one purge runs at a time. MemoryJobStore
+keeps it in the process for a single one.
+
+Archived scores are written to a .npz file (a zip of NumPy arrays), one
+member per column and chunk, e.g. "wpm.00003.npy". np.load() opens it
+directly and read_archive() joins the chunks back into whole columns.
+"""
+import collections
+import io
+import os
+import queue
+import threading
+import time
+import uuid
+import zipfile
+
+import numpy as np
+
+ARCHIVE_COLUMNS = ('id', 'user_id', 'wpm', 'accuracy', 'timestamp', 'flagged')
+ARCHIVE_DTYPES = (np.int64, np.int64, np.float64, np.float64, np.int64, np.bool_)
+
+
+class Job:
+    def __init__(self, kind, work):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.work = work
+        self.state = 'queued'
+        self.total = None
+        self.done = 0
+        self.error = None
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # Called with the job as it makes progress, at most every report_every seconds
+        self.report = None
+        self.report_every = 1.0
+        self._reported = 0.0
+
+    def advance(self, rows):
+        self.done += rows
+        if self.report and time.time() - self._reported >= self.report_every:
+            self._reported = time.time()
+            self.report(self)
+
+    def status(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'total': self.total,
+            'done': self.done,
+            'error': self.error,
+            'result': self.result,
+            'seconds': round((self.finished or time.time()) - self.started, 3) if self.started else None
+        }
+
+
+class MemoryJobStore:
+    """Job state of this process only, the newest keep jobs"""
+
+    def __init__(self, keep=50):
+        self._jobs = collections.OrderedDict()
+        self._keep = keep
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        """Record a new job, False while another one is queued or running"""
+        with self._lock:
+            if any(other.finished is None for other in self._jobs.values()):
+                return False
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._keep:
+                self._jobs.popitem(last=False)
+        return True
+
+    def save(self, job):
+        pass
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.status() if job else None
+
+    def jobs(self):
+        with self._lock:
+            return [job.status() for job in self._jobs.values()]
+
+
+class JobRunner:
+    def __init__(self, context, store=None):
+        # context() is entered around every job, e.g. an app context
+        self.context = context
+        self.store = store or MemoryJobStore()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, kind, work):
+        """Queue work(job) to run in the background and return the job
+
+        Returns None instead while another job is queued or running.
+        """
+        job = Job(kind, work)
+        if not self.store.add(job):
+            return None
+        job.report = self.store.save
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='purge-jobs', daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        """Status of a job, or None"""
+        return self.store.get(job_id)
+
+    def jobs(self):
+        return self.store.jobs()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.state = 'running'
+            job.started = time.time()
+            self.store.save(job)
+            try:
+                with self.context():
+                    job.result = job.work(job)
+                job.state = 'done'
+            except Exception as e:
+                job.state = 'failed'
+                job.error = str(e)
+            job.finished = time.time()
+            # Saved after the context is gone, with whatever it held rolled back
+            self.store.save(job)
+
+
+class ArchiveWriter:
+    """Append score columns chunk by chunk to a compressed .npz archive"""
+
+    def __init__(self, path):
+        self.path = path
+        self._chunks = 0
+        self.rows = 0
+
+    def write(self, rows):
+        """rows are (id, user_id, wpm, accuracy, unix_time, flagged) tuples"""
+        if not rows:
+            return
+        # Reopened per chunk, so the zip directory is complete on disk after
+        # every chunk and an interrupted job leaves a readable archive
+        with zipfile.ZipFile(self.path, 'a', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, dtype, values in zip(ARCHIVE_COLUMNS, ARCHIVE_DTYPES, zip(*rows)):
+                buffer = io.BytesIO()
+                np.save(buffer, np.array(values, dtype=dtype))
+                archive.writestr(f"{name}.{self._chunks:05d}.npy", buffer.getvalue())
+        with open(self.path, 'rb') as f:
+            os.fsync(f.fileno())
+        self._chunks += 1
+        self.rows += len(rows)
+
+
+def read_archive(path):
+    """Load an archive back into a dict of whole columns
+
+    Archives written before the flagged column existed read back as unflagged.
+    """
+    with np.load(path) as archive:
+        columns = {name: np.concatenate([archive[key] for key in sorted(archive.files)
+                                         if key.split('.')[0] == name] or [np.empty(0, dtype)])
+                   for name, dtype in zip(ARCHIVE_COLUMNS, ARCHIVE_DTYPES)}
+    if len(columns['flagged']) != len(columns['id']):
+        columns['flagged'] = np.zeros(len(columns['id']), np.bool_)
+    return columns
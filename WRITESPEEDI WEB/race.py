@@ -0,0 +1,234 @@
+"""Multiplayer race rooms over WebSockets.
+
+Players connect to /race/<room> and all get the same passage. While typing,
+clients send their position as often as they like; the server only keeps the
+latest one and broadcasts every room's positions once per tick, so the
+broadcast cost depends on the tick rate and not on how chatty the clients are.
+One asyncio task ticks every room of the process.
+
+Messages are JSON objects with a "type":
+
+    client -> server   start, progress {position}, finish {typed, keystrokes}
+    server -> client   joined {room, passage, players}, start {startsAt},
+                       tick {players}, results {players}, error {error}
+
+Finishers are scored on the server: their typed text against the room's
+passage, timed from the start of the race to the moment the finish arrives,
+with the same checks of the keystrokes as a single test (verification.py).
+When every player still connected has finished (or the
+race times out), the results are broadcast and all scores are written in a
+single batch.
+"""
+import asyncio
+import json
+import time
+from datetime import datetime
+
+# Close codes for refused connections
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_ROOM_UNAVAILABLE = 4409
+
+
+class Player:
+    def __init__(self, user_id, username, send):
+        self.user_id = user_id
+        self.username = username
+        self.send = send
+        self.position = 0
+        self.result = None
+        self.connected = True
+
+    def state(self):
+        return {'username': self.username, 'position': self.position,
+                'finished': self.result is not None}
+
+
+class Room:
+    def __init__(self, room_id, passage):
+        self.id = room_id
+        self.passage = passage
+        self.players = {}
+        self.state = 'waiting'
+        self.starts_at = None
+        self.dirty = False
+
+    def active_players(self):
+        return [player for player in self.players.values() if player.connected]
+
+    def snapshot(self):
+        return {'type': 'tick', 'players': [player.state() for player in self.players.values()]}
+
+    def all_finished(self):
+        active = self.active_players()
+        return not active or all(player.result is not None for player in active)
+
+
+class RaceHub:
+    def __init__(self, pick_passage, authenticate, save_scores, score_finish, tick_rate=10,
+                 max_players=8, countdown=3, timeout=600):
+        # authenticate(scope) and save_scores(rows) block, they run on the executor;
+        # score_finish(text, typed, seconds, keystrokes) returns (result, flagged,
+        # keystroke blob) or raises ValueError, in well under a millisecond
+        self.pick_passage = pick_passage
+        self.authenticate = authenticate
+        self.save_scores = save_scores
+        self.score_finish = score_finish
+        self.tick_rate = tick_rate
+        self.max_players = max_players
+        self.countdown = countdown
+        self.timeout = timeout
+        self.rooms = {}
+        self._ticker = None
+        # Fire-and-forget tasks, referenced until they are done
+        self._background = set()
+
+    async def __call__(self, scope, receive, send):
+        room_id = scope['path'].rstrip('/').rsplit('/', 1)[-1]
+        if (await receive())['type'] != 'websocket.connect':
+            return
+        loop = asyncio.get_running_loop()
+        user = await loop.run_in_executor(None, self.authenticate, scope)
+        if user is None:
+            await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+            return
+
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = Room(room_id, self.pick_passage())
+        user_id, username = user
+        if room.state != 'waiting' or (user_id not in room.players and len(room.players) >= self.max_players):
+            await send({'type': 'websocket.close', 'code': CLOSE_ROOM_UNAVAILABLE})
+            return
+
+        await send({'type': 'websocket.accept'})
+        # Joining again from another tab replaces the old connection
+        player = room.players[user_id] = Player(user_id, username, send)
+        room.dirty = True
+        await self._send(player, {'type': 'joined', 'room': room.id, 'passage': room.passage,
+                                  'players': [p.username for p in room.players.values()]})
+        if len(room.players) == self.max_players:
+            self._start(room)
+        self._ensure_ticker()
+
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                try:
+                    data = json.loads(message.get('text') or message.get('bytes') or b'')
+                    self._handle(room, player, data)
+                except (TypeError, ValueError, KeyError) as e:
+                    await self._send(player, {'type': 'error', 'error': str(e) or 'Invalid message'})
+        finally:
+            if room.players.get(user_id) is player:
+                player.connected = False
+                room.dirty = True
+                if room.state == 'waiting' and not room.active_players():
+                    self.rooms.pop(room.id, None)
+                elif room.state == 'running' and room.all_finished():
+                    self._finish(room)
+
+    def _handle(self, room, player, data):
+        kind = data['type']
+        if kind == 'start':
+            if room.state == 'waiting':
+                self._start(room)
+        elif kind == 'progress':
+            if room.state != 'running' or time.time() < room.starts_at:
+                return
+            position = int(data['position'])
+            # Coalesced: only the latest position survives until the next tick
+            player.position = max(0, min(position, len(room.passage['text'])))
+            room.dirty = True
+        elif kind == 'finish':
+            if room.state != 'running' or player.result is not None:
+                return
+            finished_at = time.time()
+            if finished_at < room.starts_at:
+                raise ValueError('The race has not started yet')
+            typed = data['typed']
+            text = room.passage['text']
+            if not isinstance(typed, str) or len(typed) > len(text):
+                raise ValueError('Invalid typed text')
+            result, flagged, recording = self.score_finish(text, typed, finished_at - room.starts_at,
+                                                           data.get('keystrokes'))
+            player.result = {'wpm': result['wpm'], 'accuracy': result['accuracy'], 'flagged': flagged,
+                             'keystrokes': recording, 'finished_at': finished_at}
+            player.position = len(room.passage['text'])
+            room.dirty = True
+            if room.all_finished():
+                self._finish(room)
+        else:
+            raise ValueError(f"Unknown message type {kind}")
+
+    def _start(self, room):
+        room.state = 'running'
+        room.starts_at = time.time() + self.countdown
+        self._broadcast(room, {'type': 'start', 'startsAt': int(room.starts_at * 1000)})
+
+    def _finish(self, room):
+        room.state = 'finished'
+        self.rooms.pop(room.id, None)
+        finishers = sorted((p for p in room.players.values() if p.result is not None),
+                           key=lambda p: p.result['finished_at'])
+        self._broadcast(room, {'type': 'results', 'players': [
+            {'username': p.username, 'place': place, 'wpm': p.result['wpm'],
+             'accuracy': p.result['accuracy'], 'flagged': p.result['flagged']}
+            for place, p in enumerate(finishers, 1)]})
+        if finishers:
+            rows = [{'wpm': p.result['wpm'], 'accuracy': p.result['accuracy'], 'user_id': p.user_id,
+                     'timestamp': datetime.utcfromtimestamp(p.result['finished_at']),
+                     'keystrokes': p.result['keystrokes'], 'flagged': p.result['flagged']}
+                    for p in finishers]
+            self._keep(asyncio.get_running_loop().run_in_executor(None, self.save_scores, rows))
+
+    def _broadcast(self, room, message):
+        payload = json.dumps(message)
+        for player in room.active_players():
+            self._keep(asyncio.ensure_future(self._send_text(player, payload)))
+
+    def _keep(self, future):
+        self._background.add(future)
+        future.add_done_callback(self._background.discard)
+
+    async def _send(self, player, message):
+        await self._send_text(player, json.dumps(message))
+
+    async def _send_text(self, player, payload):
+        try:
+            await player.send({'type': 'websocket.send', 'text': payload})
+        except Exception:
+            # The client went away, its receive loop cleans up
+            player.connected = False
+
+    def _ensure_ticker(self):
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.ensure_future(self._tick())
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.tick_rate
+        while self.rooms:
+            started = loop.time()
+            sends = []
+            for room in list(self.rooms.values()):
+                if room.state == 'running' and time.time() - room.starts_at > self.timeout:
+                    self._finish(room)
+                    continue
+                if not room.dirty:
+                    continue
+                # Serialized once per room, whatever the number of players
+                payload = json.dumps(room.snapshot())
+                room.dirty = False
+                sends.extend(self._send_text(player, payload) for player in room.active_players())
+            if sends:
+                # A slow client may hold up its own updates, but not the next tick
+                await asyncio.wait([asyncio.ensure_future(send) for send in sends], timeout=interval)
+            await asyncio.sleep(max(0.0, interval - (loop.time() - started)))
+
+    def status(self):
+        return {
+            'rooms': len(self.rooms),
+            'players': sum(len(room.active_players()) for room in self.rooms.values())
+        }
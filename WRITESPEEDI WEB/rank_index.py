@@ -0,0 +1,107 @@
+"""In-memory rank index over every player's best WPM.
+
+Best scores are bucketed to 0.1 WPM and counted in a Fenwick tree, so "how
+many players have a better best score" is a prefix sum in O(log n) instead of
+a COUNT(*) scan. Players whose best score ends up in the same bucket share a
+rank.
+"""
+import threading
+
+BUCKETS_PER_WPM = 10
+MAX_WPM = 500
+
+
+class RankIndex:
+    def __init__(self, max_wpm=MAX_WPM, buckets_per_wpm=BUCKETS_PER_WPM):
+        self.max_wpm = max_wpm
+        self.buckets_per_wpm = buckets_per_wpm
+        self.size = max_wpm * buckets_per_wpm + 1
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        # Also marks the index as not built, so the next query reloads it
+        with self._lock:
+            self._tree = [0] * (self.size + 1)
+            self._best = {}
+            self.built = False
+
+    def _bucket(self, wpm):
+        # Clamped before int(), which overflows on inf and huge values; NaN
+        # fails every comparison and lands in the bottom bucket
+        if not wpm > 0:
+            return 0
+        return int(min(wpm, self.max_wpm) * self.buckets_per_wpm)
+
+    def _add(self, bucket, delta):
+        i = bucket + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _count_upto(self, bucket):
+        """Number of players in buckets 0..bucket"""
+        total = 0
+        i = bucket + 1
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def build(self, bests):
+        """Load (user_id, best_wpm) pairs, replacing the current contents"""
+        tree = [0] * (self.size + 1)
+        best = {}
+        for user_id, wpm in bests:
+            best[user_id] = wpm
+            tree[self._bucket(wpm) + 1] += 1
+        # Turn the bucket counts into a Fenwick tree in O(n)
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        with self._lock:
+            self._tree = tree
+            self._best = best
+            self.built = True
+
+    def update(self, user_id, wpm):
+        """Record a new score; only an improved best moves the player"""
+        with self._lock:
+            old = self._best.get(user_id)
+            if old is not None and wpm <= old:
+                return
+            if old is not None:
+                self._add(self._bucket(old), -1)
+            self._add(self._bucket(wpm), 1)
+            self._best[user_id] = wpm
+
+    def remove(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                old = self._best.pop(user_id, None)
+                if old is not None:
+                    self._add(self._bucket(old), -1)
+
+    def rank(self, user_id, wpm=None):
+        """Rank of the player, counting wpm as a score they have not saved yet
+
+        Returns None for a player without any score.
+        """
+        with self._lock:
+            old = self._best.get(user_id)
+            best = old if wpm is None else max(wpm, old if old is not None else wpm)
+            if best is None:
+                return None
+            players = len(self._best) + (0 if old is not None else 1)
+            bucket = self._bucket(best)
+            below = self._count_upto(bucket - 1) if bucket else 0
+            above = len(self._best) - self._count_upto(bucket)
+            if old is not None and self._bucket(old) < bucket:
+                # The player's own, older best is still counted below
+                below -= 1
+        return {
+            'rank': above + 1,
+            'players': players,
+            'percentile': round(below / players * 100, 1)
+        }
@@ -0,0 +1,234 @@
+"""Response cache for read-heavy routes.
+
+Cached entries are keyed by the request path plus the current version of
+every namespace the route depends on ("scores", "users", ...). Write routes
+call bump() on the namespaces they change instead of hunting down individual
+keys: entries stored under an old version are simply never looked up again
+and age out through the TTL or the LRU limit.
+
+The default backend is a per-process TTL+LRU dictionary. With several server
+processes the "sqlite" backend keeps entries and namespace versions in a
+local SQLite file instead, so a bump in one worker is seen by all of them.
+"""
+import functools
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+
+import database
+
+# Headers worth replaying from a cached response
+KEPT_HEADERS = ('Cache-Control', 'X-Next-Cursor')
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def version(self, namespace):
+        with self._lock:
+            return self._versions.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            version = self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            return version
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    # Expired and surplus rows are trimmed every this many writes
+    TRIM_EVERY = 64
+
+    def __init__(self, path, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self._writes = 0
+        self.evictions = 0
+        connection = database.connect(path)
+        connection.execute("CREATE TABLE IF NOT EXISTS cache_entry "
+                           "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS cache_version "
+                           "(namespace TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        connection.commit()
+
+    def get(self, key):
+        row = database.connect(self.path).execute(
+            "SELECT value FROM cache_entry WHERE key=? AND expires>=?", (key, time.time())).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        connection = database.connect(self.path)
+        connection.execute("INSERT OR REPLACE INTO cache_entry VALUES (?, ?, ?)",
+                           (key, pickle.dumps(value), time.time() + ttl))
+        self._writes += 1
+        if self._writes % self.TRIM_EVERY == 0:
+            connection.execute("DELETE FROM cache_entry WHERE expires<?", (time.time(),))
+            removed = connection.execute(
+                "DELETE FROM cache_entry WHERE key IN (SELECT key FROM cache_entry "
+                "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+            self.evictions += max(removed, 0)
+        connection.commit()
+
+    def version(self, namespace):
+        row = database.connect(self.path).execute(
+            "SELECT version FROM cache_version WHERE namespace=?", (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, namespace):
+        connection = database.connect(self.path)
+        connection.execute("INSERT INTO cache_version VALUES (?, 1) ON CONFLICT(namespace) "
+                           "DO UPDATE SET version=version+1", (namespace,))
+        # Still inside the write transaction, so this is the version we set
+        version = connection.execute("SELECT version FROM cache_version WHERE namespace=?",
+                                     (namespace,)).fetchone()[0]
+        connection.commit()
+        return version
+
+    def __len__(self):
+        return database.connect(self.path).execute("SELECT COUNT(*) FROM cache_entry").fetchone()[0]
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._seen = {}
+
+    @classmethod
+    def from_config(cls, config):
+        max_entries = config['RESPONSE_CACHE_MAX_ENTRIES']
+        if config['RESPONSE_CACHE_BACKEND'] == 'sqlite':
+            os.makedirs(os.path.dirname(config['RESPONSE_CACHE_PATH']) or '.', exist_ok=True)
+            backend = SQLiteBackend(config['RESPONSE_CACHE_PATH'], max_entries)
+        else:
+            backend = MemoryBackend(max_entries)
+        return cls(backend, ttl=config['RESPONSE_CACHE_TTL'])
+
+    @property
+    def shared(self):
+        return isinstance(self.backend, SQLiteBackend)
+
+    def bump(self, *namespaces):
+        """Invalidate everything cached under the given namespaces"""
+        for namespace in namespaces:
+            version = self.backend.bump(namespace)
+            with self._lock:
+                # Our own bump is not a change made elsewhere, unless another
+                # process bumped in between
+                if self._seen.get(namespace) == version - 1:
+                    self._seen[namespace] = version
+
+    def changed(self, namespace):
+        """Whether another process bumped namespace since the last call"""
+        version = self.backend.version(namespace)
+        with self._lock:
+            previous = self._seen.get(namespace)
+            self._seen[namespace] = version
+        return previous is not None and previous != version
+
+    def _key(self, namespaces, key):
+        versions = ','.join(f"{namespace}={self.backend.version(namespace)}" for namespace in namespaces)
+        return f"{versions}|{key}"
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def memoize(self, namespaces, key, compute, ttl=None):
+        """Return the cached value for key, calling compute() on a miss"""
+        # The versions are read before computing, so a bump that lands while
+        # computing leaves the result under a key nobody will ask for again
+        full_key = self._key(namespaces, key)
+        value = self.backend.get(full_key)
+        self._count(value is not None)
+        if value is None:
+            value = compute()
+            self.backend.set(full_key, value, self.ttl if ttl is None else ttl)
+        return value
+
+    def cached(self, *namespaces, ttl=None):
+        """Cache successful responses of a view by full request path
+
+        Replies 304 when the client already has the cached body.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                full_key = self._key(namespaces, request.full_path)
+                entry = self.backend.get(full_key)
+                self._count(entry is not None)
+                if entry is None:
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    body = response.get_data()
+                    etag = response.get_etag()[0] or hashlib.sha1(body).hexdigest()
+                    headers = {name: response.headers[name] for name in KEPT_HEADERS
+                               if name in response.headers}
+                    entry = (body, response.mimetype, etag, headers)
+                    self.backend.set(full_key, entry, self.ttl if ttl is None else ttl)
+
+                body, mimetype, etag, headers = entry
+                response = current_app.response_class(body, mimetype=mimetype, headers=headers)
+                response.set_etag(etag)
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+    def status(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+            'evictions': self.backend.evictions
+        }
@@ -0,0 +1,235 @@
+"""Write-behind buffer for finished scores.
+
+Instead of committing one transaction per /save_score request, scores are
+appended to an on-disk spool file and queued in memory. A background thread
+hands them to the database in bulk once enough have piled up or the oldest
+one has waited long enough. The spool is replayed on startup, so scores that
+were queued but never flushed survive a crash. Delivery is at-least-once: a
+crash between a committed flush and the removal of its spool segment replays
+that segment.
+
+A failed flush puts the rows back and the next attempt waits, doubling the
+pause up to max_backoff seconds. After max_attempts failures in a row the
+rows are retried one at a time, and those that keep failing while others
+go through are moved to the quarantine file (spool path + '.rejected', in
+the spool format) so that a single bad row cannot hold up the queue.
+"""
+import atexit
+import base64
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+
+class ScoreBuffer:
+    def __init__(self, flush_fn, spool_path, max_batch=500, max_delay=1.0, fsync=False,
+                 max_attempts=5, max_backoff=60.0, logger=None):
+        self.flush_fn = flush_fn
+        self.spool_path = spool_path
+        self.quarantine_path = spool_path + '.rejected'
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.logger = logger or logging.getLogger(__name__)
+        self._attempts = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = []
+        self._segments = []
+        self._segment_counter = 0
+        self._spool = None
+        self._thread = None
+        self._stopped = False
+        self.metrics = {
+            'batches': 0,
+            'rows': 0,
+            'failures': 0,
+            'quarantined': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.spool_path) or '.', exist_ok=True)
+        self._replay()
+        self._spool = open(self.spool_path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(target=self._run, name='score-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _replay(self):
+        # Leftover segments and the live spool belong to a previous process
+        paths = sorted(glob.glob(self.spool_path + '.*.flushing'))
+        if os.path.exists(self.spool_path):
+            paths.append(self.spool_path)
+        for path in paths:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self._pending.append(self._decode(line))
+                    except (ValueError, KeyError):
+                        # A torn last line from a crash mid-write
+                        continue
+            if path == self.spool_path:
+                path = self._rotate_path()
+                os.replace(self.spool_path, path)
+            self._segments.append(path)
+
+    def _rotate_path(self):
+        self._segment_counter += 1
+        return f"{self.spool_path}.{int(time.time() * 1000)}-{self._segment_counter}.flushing"
+
+    @staticmethod
+    def _encode(row):
+        blob = row.get('keystrokes')
+        return json.dumps(dict(row, timestamp=row['timestamp'].isoformat(),
+                               keystrokes=base64.b64encode(blob).decode() if blob else None)) + '\n'
+
+    @staticmethod
+    def _decode(line):
+        row = json.loads(line)
+        row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+        row['keystrokes'] = base64.b64decode(row['keystrokes']) if row.get('keystrokes') else None
+        return row
+
+    def put(self, row):
+        """Queue one score row (wpm, accuracy, user_id, timestamp)"""
+        with self._lock:
+            self._spool.write(self._encode(row))
+            self._spool.flush()
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+            self._pending.append(row)
+            if len(self._pending) >= self.max_batch:
+                self._wakeup.notify()
+
+    def _take(self):
+        # Caller holds the lock; the spool lines for the taken rows move to
+        # a segment file that is removed once they are committed
+        rows, self._pending = self._pending, []
+        if self._spool is not None and self._spool.tell():
+            self._spool.close()
+            path = self._rotate_path()
+            os.replace(self.spool_path, path)
+            self._segments.append(path)
+            self._spool = open(self.spool_path, 'a', encoding='utf-8')
+        segments, self._segments = self._segments, []
+        return rows, segments
+
+    def flush(self):
+        """Write everything queued so far to the database"""
+        with self._flush_lock:
+            with self._lock:
+                rows, segments = self._take()
+            if not rows:
+                for path in segments:
+                    os.remove(path)
+                return 0
+
+            started = time.perf_counter()
+            try:
+                self.flush_fn(rows)
+            except Exception:
+                self.logger.exception("Error flushing %d buffered scores", len(rows))
+                with self._lock:
+                    self.metrics['failures'] += 1
+                    self._attempts += 1
+                    attempts = self._attempts
+                stored = self._isolate(rows) if attempts >= self.max_attempts else None
+                if stored is None:
+                    with self._lock:
+                        self._pending[:0] = rows
+                        self._segments[:0] = segments
+                        # Back off instead of hammering a database that is failing
+                        self._retry_at = time.monotonic() + min(self.max_backoff, self.max_delay * 2 ** attempts)
+                    return 0
+                rows = stored
+            with self._lock:
+                self._attempts = 0
+                self._retry_at = 0.0
+            elapsed = (time.perf_counter() - started) * 1000
+
+            for path in segments:
+                os.remove(path)
+            with self._lock:
+                metrics = self.metrics
+                metrics['batches'] += 1
+                metrics['rows'] += len(rows)
+                metrics['last_batch_size'] = len(rows)
+                metrics['max_batch_size'] = max(metrics['max_batch_size'], len(rows))
+                metrics['last_flush_ms'] = round(elapsed, 3)
+                metrics['max_flush_ms'] = round(max(metrics['max_flush_ms'], elapsed), 3)
+                metrics['total_flush_ms'] += elapsed
+            return len(rows)
+
+    def _isolate(self, rows):
+        """Flush rows one by one, quarantining those that fail on their own
+
+        Returns the rows stored, or None when every row failed, which points
+        at the database rather than the rows (unless there is only one).
+        """
+        stored = []
+        failed = []
+        for row in rows:
+            try:
+                self.flush_fn([row])
+            except Exception:
+                failed.append(row)
+            else:
+                stored.append(row)
+        if not stored and len(rows) > 1:
+            return None
+        if failed:
+            with open(self.quarantine_path, 'a', encoding='utf-8') as f:
+                f.writelines(self._encode(row) for row in failed)
+            self.logger.error("Quarantined %d buffered scores that kept failing in %s",
+                              len(failed), self.quarantine_path)
+            with self._lock:
+                self.metrics['quarantined'] += len(failed)
+        return stored
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._stopped and len(self._pending) < self.max_batch:
+                    self._wakeup.wait(self.max_delay)
+                # After a failed flush, wait out the backoff even with a full queue
+                while not self._stopped and time.monotonic() < self._retry_at:
+                    self._wakeup.wait(self._retry_at - time.monotonic())
+                if self._stopped:
+                    return
+            self.flush()
+
+    def close(self):
+        """Stop the flusher and write out whatever is still queued"""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._lock:
+            if self._spool is not None:
+                self._spool.close()
+                self._spool = None
+
+    def status(self):
+        with self._lock:
+            status = dict(self.metrics, pending=len(self._pending))
+        total_ms = status.pop('total_flush_ms')
+        status['avg_flush_ms'] = round(total_ms / status['batches'], 3) if status['batches'] else 0.0
+        status['avg_batch_size'] = round(status['rows'] / status['batches'], 1) if status['batches'] else 0.0
+        return status
@@ -0,0 +1,94 @@
+"""Streaming export and import of users and scores as NDJSON or CSV.
+
+Both directions work a chunk at a time, so memory stays flat whatever the
+size of the data: exports turn each chunk fetched off the database cursor
+into one piece of the response body, imports read the request body line by
+line and hand records on in batches for executemany.
+
+Records carry usernames instead of ids, so a dump of one server can be
+loaded into another:
+
+    users    username, password (the bcrypt hash), is_admin
+    scores   username, wpm, accuracy, timestamp (ISO 8601, UTC), keystrokes, flagged
+
+keystrokes is the base64 typing_core.keystrokes blob, empty unless asked for.
+flagged marks scores held back by verification.py, it may be left out.
+CSV files start with a header line naming the columns.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+USER_FIELDS = ('username', 'password', 'is_admin')
+SCORE_FIELDS = ('username', 'wpm', 'accuracy', 'timestamp', 'keystrokes', 'flagged')
+
+
+def export_chunks(chunks, fields, fmt):
+    """Yield text for chunks of row tuples (in fields order), one piece per chunk"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(fields)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Header only, for an empty table
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for chunk in chunks:
+            yield ''.join(json.dumps(dict(zip(fields, row)), separators=(',', ':')) + '\n'
+                          for row in chunk)
+
+
+def read_records(stream, fmt):
+    """Yield (line number, record dict) from a binary stream
+
+    A line that is not valid JSON yields None as its record.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield number, record if isinstance(record, dict) else None
+
+
+def batched(records, size):
+    batch = []
+    for item in records:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 time into a naive UTC datetime"""
+    if isinstance(value, str) and value.endswith('Z'):
+        # fromisoformat() only accepts the Z suffix from Python 3.11
+        value = value[:-1] + '+00:00'
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.utcoffset() is not None:
+        timestamp = (timestamp - timestamp.utcoffset()).replace(tzinfo=None)
+    return timestamp
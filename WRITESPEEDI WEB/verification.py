@@ -0,0 +1,108 @@
+"""Server-side verification of submitted typing tests.
+
+/get_text hands out a signed test token naming the passage, the player and
+the time the test started. /save_score opens it again to learn from its own
+clock how long the test took, scores the submitted typed text against the
+passage itself (typing_core.scoring) and looks at the keystroke timings:
+
+    rejected   a bad, foreign, expired or already used token, more
+               characters per second than anyone types, fewer keystrokes
+               than typed characters, or keystroke timings adding up to
+               more time than the test took
+    flagged    stored for review but kept off the leaderboard: no keystrokes
+               to check, keystrokes that do not replay to the typed text
+               (cut off at the limit, edits away from the end, or made up),
+               or too many keystrokes following the previous one faster
+               than a human can press keys (pastes, scripted input)
+
+A token is good for one submission: the server remembers the start time of
+the last test each player submitted and refuses tokens that are not newer.
+Race finishes and synced offline results go through check_keystrokes too.
+
+Each check is one pass over the submission. The scoring rules compare the
+typed text with the passage position by position, so there is no edit
+distance to compute and a passage of a few thousand characters verifies in
+well under a millisecond.
+"""
+import time
+
+from itsdangerous import BadData, URLSafeSerializer
+
+from typing_core import scoring
+
+
+class Rejected(ValueError):
+    """A submission that cannot come from a genuine test"""
+
+
+class TestTokens:
+    """Signs and opens the tokens /get_text issues for a test"""
+
+    def __init__(self, secret, max_age=3600):
+        self._serializer = URLSafeSerializer(secret, salt='writespeedi-test-token')
+        self.max_age = max_age
+
+    def issue(self, passage_id, user_id, now=None):
+        started = time.time() if now is None else now
+        return self._serializer.dumps([passage_id, user_id, round(started, 3)])
+
+    def open(self, token, user_id, now=None):
+        """Return (passage id, start time, seconds since the start) for a token of user_id"""
+        if not token:
+            raise Rejected('Missing test token')
+        try:
+            passage_id, owner, started = self._serializer.loads(token)
+            elapsed = (time.time() if now is None else now) - float(started)
+        except (BadData, TypeError, ValueError):
+            raise Rejected('Invalid test token')
+        if owner != user_id:
+            raise Rejected('Test token was issued to another player')
+        if not 0 < elapsed <= self.max_age:
+            raise Rejected('Test token expired')
+        return passage_id, float(started), elapsed
+
+
+def keystroke_timing(events, burst_ms):
+    """(total milliseconds, keystrokes less than burst_ms after the previous one)"""
+    total_ms = 0.0
+    bursts = 0
+    for _, dt_ms, _ in events:
+        total_ms += dt_ms
+        if dt_ms < burst_ms:
+            bursts += 1
+    return total_ms, bursts
+
+
+def check_keystrokes(typed, seconds, events, max_cps=25, burst_ms=15, burst_share=0.25,
+                     min_events=20, slack=1.0):
+    """Whether a submission of typed in seconds has to be flagged
+
+    seconds is the time the server measured, which may include the round
+    trips of the client, so slack seconds are allowed on top of it for the
+    keystroke timings. The timings only vouch for typed if the keystrokes
+    replay to it (typing_core.scoring.replay); a submission without
+    keystrokes, or whose keystrokes replay to another text, is flagged.
+    Raises Rejected for impossible submissions.
+    """
+    if len(typed) > seconds * max_cps:
+        raise Rejected('Typed faster than humanly possible')
+    if not events:
+        return True
+    if len(events) < len(typed):
+        raise Rejected('Fewer keystrokes than typed characters')
+    total_ms, bursts = keystroke_timing(events, burst_ms)
+    if total_ms > (seconds + slack) * 1000:
+        raise Rejected('Keystroke timings exceed the test time')
+    if scoring.replay(events)[0] != typed:
+        return True
+    return len(events) >= min_events and bursts > len(events) * burst_share
+
+
+def verify(typed, reference, seconds, events=None, **limits):
+    """Score a submission on the server's terms, returns (result, flagged)
+
+    limits are passed on to check_keystrokes. Raises Rejected for impossible
+    submissions.
+    """
+    flagged = check_keystrokes(typed, seconds, events, **limits)
+    return scoring.score(typed, reference, seconds), flagged
@@ -0,0 +1,202 @@
+"""Latency and throughput of the web endpoints under concurrent clients.
+
+Seeds a fresh SQLite database with users and scores, serves the app on a
+local threaded server and drives each endpoint in turn from concurrent
+clients, each with its own logged-in session. Prints p50/p95/p99 latency and
+throughput per endpoint as JSON, so runs can be compared to spot regressions.
+
+    python benchmarks/load_test.py --users 1000 --scores-per-user 100 --clients 16
+    python benchmarks/load_test.py --no-response-cache --output results.json
+
+bcrypt runs with --bcrypt-rounds (4 by default), keeping /register and /login
+about the server and not the work factor. /save_score submissions carry a
+test token issued a minute earlier, so they pass verification.py's checks.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import requests
+
+WEB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'WRITESPEEDI WEB')
+PASSWORD = 'benchmark'
+ENDPOINTS = ('register', 'login', 'save_score', 'leaderboard', 'user_history', 'get_text')
+
+
+def load_app(db_path, args):
+    # The app reads its settings at import time
+    os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = json.dumps(f"sqlite:///{db_path}")
+    os.environ['FLASK_BCRYPT_ROUNDS'] = str(args.bcrypt_rounds)
+    if args.no_response_cache:
+        os.environ['FLASK_RESPONSE_CACHE_TTL'] = '0'
+    sys.path.insert(0, WEB_DIR)
+    import app as web
+    return web
+
+
+def seed(web, users, scores_per_user):
+    with web.app.app_context():
+        web.db.create_all()
+        hashed = web.password_pool.hash(PASSWORD)
+        web.db.session.execute(web.db.insert(web.User), [
+            {'username': f"seed{i}", 'password': hashed, 'is_admin': False} for i in range(users)])
+        start = datetime.utcnow() - timedelta(days=365)
+        batch = []
+        for user_id in range(1, users + 1):
+            for _ in range(scores_per_user):
+                batch.append({'user_id': user_id, 'wpm': random.uniform(20, 120),
+                              'accuracy': random.uniform(80, 100),
+                              'timestamp': start + timedelta(seconds=random.randrange(365 * 86400))})
+            if len(batch) >= 50000:
+                web.db.session.execute(web.db.insert(web.Score), batch)
+                batch = []
+        if batch:
+            web.db.session.execute(web.db.insert(web.Score), batch)
+        web.db.session.commit()
+        web.rebuild_user_stats()
+
+
+def serve(web):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, web.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def login(base, username):
+    session = requests.Session()
+    response = session.post(f"{base}/login", json={'username': username, 'password': PASSWORD})
+    response.raise_for_status()
+    return session
+
+
+def submission(web, username):
+    """A /save_score body for a test of the default passage started a minute ago"""
+    typed = web.DEFAULT_TEXT[:random.randrange(100, 300)]
+    # Seeded users are numbered in id order
+    token = web.test_tokens.issue(None, int(username[len('seed'):]) + 1, now=time.time() - 60)
+    return {'token': token, 'typed': typed,
+            'keystrokes': [[char, random.randint(80, 150), True] for char in typed]}
+
+
+def make_request(endpoint, base, session, username, web):
+    if endpoint == 'register':
+        return requests.post(f"{base}/register",
+                             json={'username': f"bench-{uuid.uuid4().hex}", 'password': PASSWORD})
+    if endpoint == 'login':
+        return requests.post(f"{base}/login", json={'username': username, 'password': PASSWORD})
+    if endpoint == 'save_score':
+        return session.post(f"{base}/save_score", json=submission(web, username))
+    if endpoint == 'leaderboard':
+        return session.get(f"{base}/leaderboard", params={'limit': 50})
+    if endpoint == 'user_history':
+        return session.get(f"{base}/user_history", params={'limit': 50})
+    return session.get(f"{base}/get_text")
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def run_endpoint(endpoint, base, sessions, total, web):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [total]
+
+    def client(session, username):
+        mine = []
+        failed = 0
+        while True:
+            with lock:
+                if not remaining[0]:
+                    break
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                ok = make_request(endpoint, base, session, username, web).status_code < 400
+            except requests.RequestException:
+                ok = False
+            mine.append(time.perf_counter() - started)
+            failed += not ok
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client, args=pair) for pair in sessions]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'throughput_rps': round(len(latencies) / elapsed, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--scores-per-user', type=int, default=50)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500, help='requests per endpoint')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument('--bcrypt-rounds', type=int, default=4)
+    parser.add_argument('--no-response-cache', action='store_true',
+                        help='expire cached responses immediately to measure the queries')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        web = load_app(os.path.join(tmp, 'bench.db'), args)
+        started = time.perf_counter()
+        seed(web, args.users, args.scores_per_user)
+        seed_seconds = time.perf_counter() - started
+
+        server, base = serve(web)
+        # One client per user: test tokens are single use and must be submitted in order
+        usernames = [f"seed{i}" for i in random.sample(range(args.users), min(args.clients, args.users))]
+        sessions = [(login(base, username), username) for username in usernames]
+        results = {endpoint: run_endpoint(endpoint, base, sessions, args.requests, web)
+                   for endpoint in args.endpoints}
+        server.shutdown()
+
+    report = {
+        'config': {
+            'users': args.users,
+            'scores': args.users * args.scores_per_user,
+            'clients': args.clients,
+            'requests_per_endpoint': args.requests,
+            'bcrypt_rounds': args.bcrypt_rounds,
+            'response_cache': not args.no_response_cache,
+            'seed_seconds': round(seed_seconds, 2)
+        },
+        'endpoints': results
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Throughput of the shared scoring core (typing_core.scoring).
+
+Builds passages of --sizes characters from random words, simulates typing
+each one with --error-rate typos that are corrected right away and times
+the scoring paths every front-end and the server use:
+
+    score        scoring a finished test from the full typed text
+    replay       rebuilding typed text and time from the keystroke events
+    incremental  IncrementalScorer fed one keystroke at a time, as the apps do
+    validate     what save_score does: parse_events() + replay() + score()
+
+Prints the best of --repeat runs per path and size as JSON, in characters
+per second and microseconds per call (per keystroke for incremental).
+
+    python benchmarks/scoring_throughput.py
+    python benchmarks/scoring_throughput.py --sizes 50 50000 --repeat 10
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from typing_core import keystrokes, scoring
+
+WORDS = ('the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog', 'typing', 'speed',
+         'keyboard', 'practice', 'accuracy', 'minute', 'passage', 'letter', 'random', 'words')
+
+
+def passage(size):
+    words = []
+    length = -1
+    while length < size:
+        word = random.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)[:size]
+
+
+def keystroke_events(text, error_rate):
+    """(char, dt_ms, correct) events typing text, with corrected typos"""
+    events = []
+    for char in text:
+        if random.random() < error_rate:
+            events.append(('x', random.uniform(80, 250), False))
+            events.append(('\b', random.uniform(80, 250), False))
+        events.append((char, random.uniform(80, 250), True))
+    return events
+
+
+def best_of(repeat, work):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        work()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def type_incrementally(text, events):
+    scorer = scoring.IncrementalScorer(text)
+    for char, _, _ in events:
+        if char == '\b':
+            scorer.delete(len(scorer.typed) - 1, 1)
+        else:
+            scorer.insert(len(scorer.typed), char)
+    return scorer.result(60)
+
+
+def validate(text, raw):
+    typed, seconds = scoring.replay(keystrokes.parse_events(raw, limit=len(raw)))
+    return scoring.score(typed, text, seconds)
+
+
+def measure(size, repeat, error_rate):
+    text = passage(size)
+    events = keystroke_events(text, error_rate)
+    raw = [list(event) for event in events]
+    assert type_incrementally(text, events) == scoring.score(text, text, 60)
+
+    def rates(seconds, calls):
+        return {'chars_per_second': round(size / seconds), 'us_per_call': round(seconds / calls * 1e6, 3)}
+
+    return {
+        'chars': size,
+        'keystrokes': len(events),
+        'score': rates(best_of(repeat, lambda: scoring.score(text, text, 60)), 1),
+        'replay': rates(best_of(repeat, lambda: scoring.replay(events)), 1),
+        'incremental': rates(best_of(repeat, lambda: type_incrementally(text, events)), len(events)),
+        'validate': rates(best_of(repeat, lambda: validate(text, raw)), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000, 50000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    report = {
+        'config': {'repeat': args.repeat, 'error_rate': args.error_rate, 'python': sys.version.split()[0]},
+        'passages': [measure(size, args.repeat, args.error_rate) for size in args.sizes]
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
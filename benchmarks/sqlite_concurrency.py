@@ -0,0 +1,113 @@
+"""Concurrent read/write throughput of SQLite, before and after tuning.
+
+"default" mirrors the old code: a fresh sqlite3 connection with the default
+rollback journal for every operation. "tuned" uses the long-lived per-thread
+connections and pragmas from database.py.
+
+    python benchmarks/sqlite_concurrency.py --readers 4 --writers 2 --seconds 5
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'WRITESPEEDI WEB'))
+import database  # noqa: E402
+
+
+def seed(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE scores (username TEXT, wpm REAL, accuracy REAL, timestamp TEXT)")
+    conn.execute("CREATE INDEX ix_scores_username ON scores (username)")
+    conn.executemany("INSERT INTO scores VALUES (?, ?, ?, ?)",
+                     ((f"user{i % 100}", 40 + i % 60, 90.0, '2025-01-01 00:00:00') for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def default_connection(path):
+    # What the desktop app used to do for every single query
+    return sqlite3.connect(path, timeout=5)
+
+
+def run(mode, path, readers, writers, seconds):
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def open_connection():
+        return database.connect(path) if mode == 'tuned' else default_connection(path)
+
+    def release(conn):
+        if mode != 'tuned':
+            conn.close()
+
+    def reader(n):
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            conn = open_connection()
+            try:
+                conn.execute("SELECT wpm, accuracy, timestamp FROM scores WHERE username=? "
+                             "ORDER BY timestamp DESC LIMIT 50", (f"user{n % 100}",)).fetchall()
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+            release(conn)
+        with lock:
+            counts['reads'] += done
+            counts['errors'] += errors
+
+    def writer(n):
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            conn = open_connection()
+            try:
+                conn.execute("INSERT INTO scores VALUES (?, ?, ?, ?)",
+                             (f"user{n % 100}", 55.0, 97.0, '2025-01-02 00:00:00'))
+                conn.commit()
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+            release(conn)
+        with lock:
+            counts['writes'] += done
+            counts['errors'] += errors
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'mode': mode,
+        'reads_per_s': round(counts['reads'] / seconds, 1),
+        'writes_per_s': round(counts['writes'] / seconds, 1),
+        'errors': counts['errors']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('default', 'tuned'):
+            path = os.path.join(tmp, f"{mode}.db")
+            seed(path, args.rows)
+            results.append(run(mode, path, args.readers, args.writers, args.seconds))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
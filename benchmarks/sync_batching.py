@@ -0,0 +1,139 @@
+"""Upload of queued offline results through /sync/scores.
+
+Queues --results local results in an in-memory outbox, serves the app on a
+local stand-in server backed by a fresh SQLite database and lets
+typing_core.sync push them. The server counts the requests it receives, so
+the report shows 10k results arriving in a handful of batches instead of one
+request each. Prints the request count, bytes sent and timing as JSON.
+
+    python benchmarks/sync_batching.py --results 10000
+    python benchmarks/sync_batching.py --failure-rate 0.3
+
+With --failure-rate the stand-in server answers that share of requests with
+a 503, half of them after the batch was already stored (a lost response), to
+show that retries neither lose nor duplicate results. The run fails unless
+every result ends up stored exactly once.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+WEB_DIR = os.path.join(ROOT, 'WRITESPEEDI WEB')
+USERNAME = 'sync-bench'
+PASSWORD = 'benchmark'
+
+
+class MemoryOutbox:
+    def __init__(self, count):
+        self.device = uuid.uuid4().hex
+        start = time.time() - 30 * 86400
+        self.results = [[i, start + i * 60, round(random.uniform(20, 120), 1),
+                         round(random.uniform(80, 100), 1), None] for i in range(1, count + 1)]
+        self.cursor = 0
+
+    def pending(self, after, limit):
+        return self.results[after:after + limit]
+
+    def synced(self, cursor):
+        self.cursor = cursor
+
+
+class StandIn:
+    """WSGI wrapper counting requests and failing some of them on purpose"""
+
+    def __init__(self, app, failure_rate):
+        self.app = app
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.requests += 1
+            fail = environ['PATH_INFO'] == '/sync/scores' and random.random() < self.failure_rate
+            self.failed += fail
+        if fail and random.random() < 0.5:
+            # Lost response: the batch is stored but the client never hears of it
+            for _ in self.app(environ, lambda status, headers, exc_info=None: None):
+                pass
+        if fail:
+            start_response('503 Service Unavailable', [('Content-Type', 'application/json')])
+            return [b'{"error": "Injected failure"}']
+        return self.app(environ, start_response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--results', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = json.dumps(f"sqlite:///{os.path.join(tmp, 'sync.db')}")
+        os.environ['FLASK_BCRYPT_ROUNDS'] = '4'
+        os.environ['FLASK_SYNC_MAX_BATCH'] = str(args.batch_size)
+        sys.path.insert(0, WEB_DIR)
+        sys.path.insert(0, ROOT)
+        import app as web
+        from typing_core.sync import SyncClient
+        from werkzeug.serving import make_server
+
+        with web.app.app_context():
+            web.db.create_all()
+            web.db.session.add(web.User(username=USERNAME, password=web.password_pool.hash(PASSWORD)))
+            web.db.session.commit()
+
+        stand_in = StandIn(web.app, args.failure_rate)
+        server = make_server('127.0.0.1', 0, stand_in, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        outbox = MemoryOutbox(args.results)
+        client = SyncClient(f"http://127.0.0.1:{server.server_port}", USERNAME, PASSWORD,
+                            batch_size=args.batch_size, backoff=0.05, attempts=10)
+        started = time.perf_counter()
+        reported = client.sync(outbox)
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+
+        with web.app.app_context():
+            stored = web.Score.query.count()
+            # Synced results are stored flagged and stay out of the stats
+            counted = web.Score.query.filter(web.Score.flagged == web.db.false()).count()
+            stats = web.db.session.get(web.UserStats, 1)
+            games = stats.total_games if stats else 0
+
+    report = {
+        'results': args.results,
+        'stored': stored,
+        'stored_reported': reported,
+        'counted': counted,
+        'user_stats_games': games,
+        'server_requests': stand_in.requests,
+        'client_requests': client.requests,
+        'injected_failures': stand_in.failed,
+        'bytes_sent': client.bytes_sent,
+        'bytes_per_result': round(client.bytes_sent / max(args.results, 1), 2),
+        'seconds': round(elapsed, 3),
+        'results_per_second': round(args.results / elapsed, 1)
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if stored != args.results or games != counted or outbox.cursor != args.results:
+        raise SystemExit('Results were lost or stored twice')
+
+
+if __name__ == '__main__':
+    main()
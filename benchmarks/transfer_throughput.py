@@ -0,0 +1,164 @@
+"""Throughput and memory of the streaming /admin/export and /admin/import.
+
+Seeds a fresh SQLite database with --users users and --scores scores, serves
+the app locally, exports the scores as NDJSON or CSV into a temporary file,
+deletes them and imports the file again, both streamed over HTTP. Prints
+rows per second, bytes and the server's resident memory per phase as JSON;
+run it with growing --scores to see that memory does not follow the size.
+
+    python benchmarks/transfer_throughput.py --scores 1000000
+    python benchmarks/transfer_throughput.py --format csv --chunk-size 20000
+
+Resident memory (anonymous pages, without the memory-mapped database file)
+is sampled from /proc and only reported on Linux. It includes SQLite's page
+cache, which fills up to its configured size per connection on large tables.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+WEB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'WRITESPEEDI WEB')
+PASSWORD = 'benchmark'
+
+
+class MemorySampler:
+    """Resident set size when entered and the highest seen while active, in MiB"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start = self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def rss():
+        # Anonymous memory only: pages of the memory-mapped database file
+        # count towards the full RSS but are not held by the process
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('RssAnon:'):
+                        return int(line.split()[1]) / 1024
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def __enter__(self):
+        self.start = self.peak = self.rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = self.rss()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+
+
+def seed(web, users, scores):
+    with web.app.app_context():
+        web.db.create_all()
+        hashed = web.password_pool.hash(PASSWORD)
+        web.db.session.execute(web.db.insert(web.User), [
+            {'username': f"seed{i}", 'password': hashed, 'is_admin': i == 0} for i in range(users)])
+        web.db.session.commit()
+        connection = web.db.engine.raw_connection()
+        start = time.time() - 365 * 86400
+        for offset in range(0, scores, 50000):
+            connection.cursor().executemany(
+                "INSERT INTO score (user_id, wpm, accuracy, timestamp) VALUES (?, ?, ?, datetime(?, 'unixepoch'))",
+                [(random.randint(1, users), random.uniform(20, 120), random.uniform(80, 100),
+                  start + random.randrange(365 * 86400)) for _ in range(min(50000, scores - offset))])
+            connection.commit()
+        connection.close()
+        web.rebuild_user_stats()
+
+
+def phase(seconds, rows, size, memory):
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 2),
+        'rows_per_second': round(rows / seconds),
+        'megabytes': round(size / 2 ** 20, 1),
+        'peak_rss_mb': round(memory.peak, 1) if memory.peak is not None else None,
+        'rss_growth_mb': round(memory.peak - memory.start, 1) if memory.peak is not None else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--scores', type=int, default=200000)
+    parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson')
+    parser.add_argument('--chunk-size', type=int, help='rows per fetch and per import transaction')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = json.dumps(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        os.environ['FLASK_BCRYPT_ROUNDS'] = '4'
+        if args.chunk_size:
+            os.environ['FLASK_TRANSFER_CHUNK_SIZE'] = str(args.chunk_size)
+        sys.path.insert(0, WEB_DIR)
+        import app as web
+        from werkzeug.serving import make_server
+
+        seed(web, args.users, args.scores)
+        server = make_server('127.0.0.1', 0, web.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+        session = requests.Session()
+        session.post(f"{base}/login", json={'username': 'seed0', 'password': PASSWORD}).raise_for_status()
+        dump = os.path.join(tmp, f"scores.{args.format}")
+
+        with MemorySampler() as memory:
+            started = time.perf_counter()
+            with session.get(f"{base}/admin/export", params={'format': args.format}, stream=True) as response:
+                response.raise_for_status()
+                with open(dump, 'wb') as f:
+                    for piece in response.iter_content(1 << 16):
+                        f.write(piece)
+            exported = phase(time.perf_counter() - started, args.scores, os.path.getsize(dump), memory)
+
+        with web.app.app_context():
+            web.db.session.execute(web.db.delete(web.Score))
+            web.db.session.commit()
+
+        with MemorySampler() as memory:
+            started = time.perf_counter()
+            with open(dump, 'rb') as f:
+                # A file object is sent as a stream, not read into memory first
+                response = session.post(f"{base}/admin/import", params={'format': args.format}, data=f)
+            response.raise_for_status()
+            summary = response.json()
+            imported = phase(time.perf_counter() - started, summary['imported'], os.path.getsize(dump), memory)
+        server.shutdown()
+
+    report = {
+        'config': {'users': args.users, 'scores': args.scores, 'format': args.format,
+                   'chunk_size': args.chunk_size or 5000},
+        'export': exported,
+        'import': {**imported, 'skipped': summary['skipped'], 'rejected': summary['rejected']}
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
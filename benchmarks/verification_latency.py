@@ -0,0 +1,103 @@
+"""Latency /save_score spends verifying a test (verification.py).
+
+Times what the server adds per submission: validating the posted keystroke
+list (keystrokes.parse_events, limited to the passage plus --allowance,
+KEYSTROKE_ALLOWANCE of the server), opening the signed test token, the rate checks over the
+keystroke timings, replaying them against the typed text and scoring the typed text against the passage. Runs
+--runs submissions per passage size, typed with --error-rate wrong
+characters, and prints p50/p99/max in microseconds as JSON, with whether p99
+stays under --budget-ms. The default sizes go up to a 400 word passage, the
+longest corpus length bucket.
+
+    python benchmarks/verification_latency.py
+    python benchmarks/verification_latency.py --sizes 400 1000 --runs 5000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'WRITESPEEDI WEB'))
+sys.path.insert(0, ROOT)
+import verification
+from typing_core import keystrokes
+
+WORDS = ('the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog', 'typing', 'speed',
+         'keyboard', 'practice', 'accuracy', 'minute', 'passage', 'letter', 'random', 'words')
+
+
+def passage(size):
+    text = ''
+    while len(text) < size:
+        text += random.choice(WORDS) + ' '
+    return text[:size]
+
+
+def submission(text, error_rate):
+    typed = ''.join('x' if random.random() < error_rate else char for char in text)
+    # As the JSON body delivers them
+    events = [[char, random.uniform(80, 250), char == expected] for char, expected in zip(typed, text)]
+    return typed, events
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def measure(tokens, size, runs, error_rate, budget_ms, allowance):
+    text = passage(size)
+    typed, events = submission(text, error_rate)
+    # Issued as long ago as typing the passage took
+    started = time.time() - sum(dt for _, dt, _ in events) / 1000
+    token = tokens.issue(0, 1, now=started)
+    latencies = []
+    for _ in range(runs):
+        begin = time.perf_counter()
+        parsed = keystrokes.parse_events(events, limit=len(text) + allowance)
+        _, _, seconds = tokens.open(token, 1)
+        result, flagged = verification.verify(typed, text, seconds, parsed)
+        latencies.append(time.perf_counter() - begin)
+    latencies.sort()
+    return {
+        'chars': size,
+        'keystrokes': len(events),
+        'wpm': result['wpm'],
+        'flagged': flagged,
+        'p50_us': round(percentile(latencies, 50) * 1e6, 1),
+        'p99_us': round(percentile(latencies, 99) * 1e6, 1),
+        'max_us': round(latencies[-1] * 1e6, 1),
+        'within_budget': percentile(latencies, 99) * 1000 < budget_ms
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 1000, 2500])
+    parser.add_argument('--runs', type=int, default=2000)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--budget-ms', type=float, default=1.0)
+    parser.add_argument('--allowance', type=int, default=500, help='KEYSTROKE_ALLOWANCE of the server')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    tokens = verification.TestTokens('benchmark-secret')
+    report = {
+        'config': {'runs': args.runs, 'error_rate': args.error_rate, 'budget_ms': args.budget_ms,
+                   'allowance': args.allowance, 'python': sys.version.split()[0]},
+        'passages': [measure(tokens, size, args.runs, args.error_rate, args.budget_ms, args.allowance)
+                     for size in args.sizes]
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
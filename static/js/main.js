@@ -15,25 +15,25 @@ document.addEventListener('DOMContentLoaded', function() {
     let endTime;
     let isTestRunning = false;
     let currentText = '';
-    let errorPositions = new Set(); // Track positions of errors
+    let passageId = null; // Sent along so the server can recompute the score
+    let testToken = null; // Signed by /get_text, lets the server time the test
+    let keystrokes = []; // [char, ms since previous keystroke, correct] per keystroke
+    let lastKeystrokeTime = null;
+    let recordedLength = 0; // Length of the input as of the last recorded keystroke
+    const KEYSTROKE_ALLOWANCE = 500; // Keystrokes beyond the passage the server takes, for corrections
 
     // Function to load user statistics
     async function loadUserStats() {
         try {
-            const response = await fetch('/user_history');
-            const data = await response.json();
+            const response = await fetch('/user_stats');
+            const stats = await response.json();
             
-            if (data.length > 0) {
-                // Calculate statistics
-                const bestWpm = Math.max(...data.map(score => score.wpm));
-                const avgWpm = data.reduce((sum, score) => sum + score.wpm, 0) / data.length;
-                const accuracy = Math.round(data.reduce((sum, score) => sum + score.accuracy, 0) / data.length);
-                
+            if (stats.totalGames > 0) {
                 // Update statistics display
-                bestWpmElement.textContent = bestWpm;
-                avgWpmElement.textContent = avgWpm.toFixed(1);
-                gamesPlayedElement.textContent = data.length;
-                accuracyStatElement.textContent = accuracy + '%';
+                bestWpmElement.textContent = stats.bestWPM;
+                avgWpmElement.textContent = stats.averageWPM.toFixed(1);
+                gamesPlayedElement.textContent = stats.totalGames;
+                accuracyStatElement.textContent = Math.round(stats.averageAccuracy) + '%';
             }
         } catch (error) {
             console.error('Error loading user statistics:', error);
@@ -46,6 +46,8 @@ document.addEventListener('DOMContentLoaded', function() {
             const response = await fetch('/get_text');
             const data = await response.json();
             currentText = data.text;
+            passageId = data.id;
+            testToken = response.headers.get('X-Test-Token');
             textToType.textContent = currentText;
         } catch (error) {
             console.error('Error fetching typing text:', error);
@@ -68,28 +70,53 @@ document.addEventListener('DOMContentLoaded', function() {
 
         startTime = Date.now();
         isTestRunning = true;
+        keystrokes = [];
+        recordedLength = 0;
+        lastKeystrokeTime = performance.now();
 
         startButton.textContent = 'End Test';
     });
 
-    userInput.addEventListener('input', function() {
+    // Record the timing of each keystroke for replays and analytics
+    function recordKeystrokes(event) {
+        const now = performance.now();
+        let dt = Math.round(now - lastKeystrokeTime);
+        lastKeystrokeTime = now;
+
+        // One '\b' per character gone, whether deleted one by one, by word
+        // or as a selection replaced by what was typed over it
+        const length = userInput.value.length;
+        const removed = recordedLength + (event.data ? event.data.length : 0) - length;
+        recordedLength = length;
+        for (let i = 0; i < removed; i++) {
+            if (keystrokes.length < currentText.length + KEYSTROKE_ALLOWANCE) {
+                keystrokes.push(['\b', dt, false]);
+            }
+            dt = 0;
+        }
+        if (!event.data || (event.inputType && event.inputType.startsWith('delete'))) {
+            return;
+        }
+        const chars = Array.from(event.data);
+        const start = userInput.selectionStart - event.data.length;
+        chars.forEach((char, i) => {
+            if (keystrokes.length < currentText.length + KEYSTROKE_ALLOWANCE) {
+                keystrokes.push([char, dt, currentText[start + i] === char]);
+            }
+            dt = 0;
+        });
+    }
+
+    userInput.addEventListener('input', function(event) {
         if (!isTestRunning) {
             return;
         }
 
+        recordKeystrokes(event);
         const typedText = userInput.value;
         
-        // Track errors
-        for (let i = 0; i < Math.min(typedText.length, currentText.length); i++) {
-            if (typedText[i] !== currentText[i]) {
-                errorPositions.add(i);
-            }
-        }
-
-        // Calculate accuracy based on error positions
-        const totalChars = currentText.length;
-        const errors = Array.from(errorPositions).length;
-        const accuracy = ((totalChars - errors) / totalChars) * 100;
+        // Same rules as typing_core/scoring.py: matching characters of the passage
+        const accuracy = calculateAccuracy(typedText, currentText);
         accuracyElement.textContent = Math.round(accuracy) + '%';
 
         // Calculate WPM based on time elapsed
@@ -131,10 +158,14 @@ document.addEventListener('DOMContentLoaded', function() {
         return correctChars;
     }
 
+    function calculateAccuracy(typedText, originalText) {
+        return originalText.length ? calculateCorrectChars(typedText, originalText) / originalText.length * 100 : 0;
+    }
+
     function calculateWordsTyped(text) {
         // Split text into words, ignoring punctuation
-        const words = text.trim().split(/\s+/);
-        return words.length;
+        const trimmed = text.trim();
+        return trimmed ? trimmed.split(/\s+/).length : 0;
     }
 
     function calculateWPM(wordsTyped, timeElapsed) {
@@ -153,10 +184,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const wordsTyped = calculateWordsTyped(typedText);
         const wpm = calculateWPM(wordsTyped, timeElapsed);
         
-        // Calculate final accuracy using error positions
-        const totalChars = currentText.length;
-        const errors = Array.from(errorPositions).length;
-        const accuracy = ((totalChars - errors) / totalChars) * 100;
+        const accuracy = calculateAccuracy(typedText, currentText);
 
         wpmElement.textContent = Math.round(wpm);
         accuracyElement.textContent = Math.round(accuracy) + '%';
@@ -169,12 +197,21 @@ document.addEventListener('DOMContentLoaded', function() {
                 },
                 body: JSON.stringify({
                     wpm: wpm,
-                    accuracy: Math.round(accuracy)
+                    accuracy: Math.round(accuracy),
+                    keystrokes: keystrokes,
+                    passage_id: passageId,
+                    token: testToken,
+                    typed: typedText
                 })
             });
 
             const result = await response.json();
-            console.log(result.message);
+            console.log(result.message || result.error);
+            if (response.ok) {
+                // The server scores the test itself, show what it stored
+                wpmElement.textContent = Math.round(result.wpm);
+                accuracyElement.textContent = Math.round(result.accuracy) + '%';
+            }
 
             // Reload statistics after saving score
             loadUserStats();
@@ -185,6 +222,5 @@ document.addEventListener('DOMContentLoaded', function() {
         userInput.disabled = true;
         isTestRunning = false;
         startButton.textContent = 'Start Test';
-        errorPositions.clear(); // Reset error positions for next session
     }
 });
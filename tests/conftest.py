@@ -0,0 +1,43 @@
+"""The web app on a throwaway database, for tests that go through app.py.
+
+app.py reads its configuration from FLASK_* variables when it is imported,
+so they point into a temporary directory before the first import.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+WEB_DIR = os.path.join(ROOT, 'WRITESPEEDI WEB')
+sys.path.insert(0, WEB_DIR)
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def web(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('web')
+    os.environ.update({
+        'FLASK_SQLALCHEMY_DATABASE_URI': json.dumps(f"sqlite:///{tmp / 'test.db'}"),
+        'FLASK_BCRYPT_ROUNDS': '4',
+        'FLASK_SCORE_SPOOL_PATH': json.dumps(str(tmp / 'spool.jsonl')),
+        'FLASK_RESPONSE_CACHE_PATH': json.dumps(str(tmp / 'response_cache.db')),
+        'FLASK_ARCHIVE_DIR': json.dumps(str(tmp / 'archives')),
+        'FLASK_PROFILE_DIR': json.dumps(str(tmp / 'profiles')),
+    })
+    import app as web
+    with web.app.app_context():
+        web.db.create_all()
+    return web
+
+
+@pytest.fixture
+def login(web):
+    """login(name) -> a test client signed in as a new user"""
+    def login(name):
+        client = web.app.test_client()
+        client.post('/register', json={'username': name, 'password': 'secret123'})
+        client.post('/login', json={'username': name, 'password': 'secret123'})
+        return client
+    return login
@@ -0,0 +1,31 @@
+"""Score archives (purge.py) must read back exactly what was written, flag included."""
+import zipfile
+
+import numpy as np
+
+from purge import ArchiveWriter, read_archive
+
+
+def test_archive_round_trip(tmp_path):
+    path = tmp_path / 'scores.npz'
+    writer = ArchiveWriter(str(path))
+    writer.write([(1, 10, 55.5, 97.0, 1700000000, False), (2, 11, 250.0, 40.0, 1700000100, True)])
+    writer.write([(3, 10, 60.0, 99.0, 1700000200, False)])
+    columns = read_archive(str(path))
+    assert writer.rows == 3
+    assert columns['id'].tolist() == [1, 2, 3]
+    assert columns['wpm'].tolist() == [55.5, 250.0, 60.0]
+    assert columns['flagged'].tolist() == [False, True, False]
+
+
+def test_archives_without_the_flag_read_as_unflagged(tmp_path):
+    path = tmp_path / 'old.npz'
+    old_columns = {'id': np.int64, 'user_id': np.int64, 'wpm': np.float64,
+                   'accuracy': np.float64, 'timestamp': np.int64}
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, dtype in old_columns.items():
+            with archive.open(f"{name}.00000.npy", 'w') as member:
+                np.save(member, np.array([1, 2], dtype=dtype))
+    columns = read_archive(str(path))
+    assert columns['id'].tolist() == [1, 2]
+    assert columns['flagged'].tolist() == [False, False]
@@ -0,0 +1,67 @@
+"""RankIndex must count every best score, including ones outside its range.
+
+Scores above max_wpm share the top bucket, zero, negative and NaN scores the
+bottom one; infinite and huge values must not overflow the bucketing.
+"""
+import math
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'WRITESPEEDI WEB'))
+from rank_index import RankIndex
+
+
+def expected_rank(bests, user_id, index):
+    bucket = index._bucket(bests[user_id])
+    return 1 + sum(1 for wpm in bests.values() if index._bucket(wpm) > bucket)
+
+
+@pytest.mark.parametrize('wpm', [math.inf, 1e308, 10 ** 400, 501, -math.inf, -5, 0, math.nan])
+def test_out_of_range_scores_are_clamped(wpm):
+    index = RankIndex(max_wpm=500)
+    index.build([(1, 100.0), (2, 200.0)])
+    index.update(3, wpm)
+    rank = index.rank(3)
+    assert rank['players'] == 3
+    if wpm > 500:
+        assert index._bucket(wpm) == index.size - 1
+        assert rank['rank'] == 1
+    elif not wpm > 0:
+        assert index._bucket(wpm) == 0
+        assert rank['rank'] == 3
+
+
+def test_build_takes_out_of_range_scores():
+    index = RankIndex(max_wpm=500)
+    index.build([(1, math.inf), (2, 1e308), (3, math.nan), (4, 50.0)])
+    assert index.rank(1)['rank'] == 1
+    assert index.rank(2)['rank'] == 1
+    assert index.rank(4)['rank'] == 3
+    assert index.rank(3)['rank'] == 4
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_updates_match_counting(seed):
+    rng = random.Random(seed)
+    index = RankIndex(max_wpm=300)
+    bests = {}
+    for _ in range(500):
+        user_id = rng.randrange(50)
+        wpm = rng.choice([rng.uniform(0, 350), rng.uniform(0, 120), math.inf, 0.0])
+        index.update(user_id, wpm)
+        bests[user_id] = max(bests.get(user_id, wpm), wpm)
+    for user_id in bests:
+        rank = index.rank(user_id)
+        assert rank['rank'] == expected_rank(bests, user_id, index)
+        assert rank['players'] == len(bests)
+
+
+def test_rank_of_unsaved_score_counts_the_player_once():
+    index = RankIndex()
+    index.build([(1, 80.0), (2, 60.0)])
+    assert index.rank(3) is None
+    assert index.rank(3, 70.0) == {'rank': 2, 'players': 3, 'percentile': 33.3}
+    assert index.rank(2, 90.0) == {'rank': 1, 'players': 2, 'percentile': 50.0}
@@ -0,0 +1,85 @@
+"""IncrementalScorer must always agree with a full recount (typing_core.scoring).
+
+Seeded random edit sequences (inserts, deletes and replacements anywhere in
+the text, including whitespace and characters past the end of the passage)
+are applied to the scorer and to a plain string, and after every edit the
+scorer's counters are compared with score() over the whole string.
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from typing_core import scoring
+
+ALPHABET = 'abcde \n\t'
+REFERENCE = 'the quick brown fox jumps over the lazy dog\nand  types\tagain '
+
+
+def random_text(rng, length):
+    return ''.join(rng.choice(ALPHABET) for _ in range(length))
+
+
+def check(scorer, text, reference):
+    assert ''.join(scorer.typed) == text
+    assert scorer.word_count == scoring.count_words(text)
+    assert scorer.correct_chars == scoring.count_correct(text, reference)
+    assert scorer.error_positions == {i for i, (a, b) in enumerate(zip(text, reference)) if a != b}
+    assert scorer.result(42.5) == scoring.score(text, reference, 42.5)
+    assert scorer.is_complete() == (text == reference)
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_random_edits_match_full_recount(seed):
+    rng = random.Random(seed)
+    reference = REFERENCE if seed % 2 else random_text(rng, rng.randint(0, 80))
+    scorer = scoring.IncrementalScorer(reference)
+    text = ''
+    for _ in range(300):
+        operation = rng.random()
+        if operation < 0.5:
+            # Typing at the end, the common case
+            chunk = reference[len(text):len(text) + 1] if rng.random() < 0.7 else random_text(rng, 1)
+            chunk = chunk or random_text(rng, 1)
+            scorer.insert(len(text), chunk)
+            text += chunk
+        elif operation < 0.7:
+            index = rng.randint(0, len(text))
+            chunk = random_text(rng, rng.randint(1, 5))
+            scorer.insert(index, chunk)
+            text = text[:index] + chunk + text[index:]
+        elif operation < 0.9 and text:
+            index = rng.randrange(len(text))
+            count = rng.randint(1, len(text) - index)
+            scorer.delete(index, count)
+            text = text[:index] + text[index + count:]
+        elif text:
+            # A replaced selection: delete then insert at the same place
+            index = rng.randrange(len(text))
+            count = rng.randint(1, len(text) - index)
+            chunk = random_text(rng, rng.randint(0, 5))
+            scorer.delete(index, count)
+            scorer.insert(index, chunk)
+            text = text[:index] + chunk + text[index + count:]
+        check(scorer, text, reference)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_reset_matches_full_recount(seed):
+    rng = random.Random(seed)
+    scorer = scoring.IncrementalScorer(REFERENCE)
+    for _ in range(20):
+        text = random_text(rng, rng.randint(0, 90))
+        scorer.reset(text)
+        check(scorer, text, REFERENCE)
+
+
+def test_typing_the_passage_completes_it():
+    scorer = scoring.IncrementalScorer(REFERENCE)
+    for index, char in enumerate(REFERENCE):
+        assert not scorer.is_complete()
+        scorer.insert(index, char)
+    check(scorer, REFERENCE, REFERENCE)
+    assert scorer.is_complete()
@@ -0,0 +1,75 @@
+"""/sync/scores must refuse malformed batches with a 400 and never rank synced results.
+
+Synced results were not timed by the server, so every one is stored flagged
+and stays out of UserStats and the rank index, whatever its recording says.
+"""
+import base64
+import time
+
+import pytest
+
+from typing_core import keystrokes, scoring
+
+
+def push(client, results, device='laptop'):
+    return client.post('/sync/scores', json={'device': device, 'results': results})
+
+
+def recording(text, dt=150):
+    return base64.b64encode(keystrokes.encode([(char, dt, True) for char in text])).decode()
+
+
+@pytest.mark.parametrize('row', [
+    [1, time.time(), 50, 90],
+    [1, time.time(), 50, 90, None, 'extra'],
+    ['one', time.time(), 50, 90, None],
+    [1e400, time.time(), 50, 90, None],
+    [float('nan'), time.time(), 50, 90, None],
+    [1, time.time(), 10 ** 400, 90, None],
+    [1, time.time(), -1, 90, None],
+    [1, time.time(), 50, 101, None],
+    [1, float('inf'), 50, 90, None],
+    [1, 0, 50, 90, None],
+    [1, time.time(), 'fast', 90, None],
+])
+def test_invalid_results_are_refused(web, login, row):
+    client = login('sync-invalid')
+    response = push(client, [row])
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+    assert push(client, []).get_json()['cursor'] == 0
+
+
+def test_local_id_overflowing_a_float_is_refused(web, login):
+    client = login('sync-overflow')
+    body = '{"device": "laptop", "results": [[1e400, %d, 50, 90, null]]}' % time.time()
+    response = client.post('/sync/scores', data=body, content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_out_of_range_local_ids_are_skipped(web, login):
+    client = login('sync-ids')
+    now = time.time()
+    answer = push(client, [[0, now, 50, 90, None], [-3, now, 50, 90, None],
+                           [2 ** 63, now, 50, 90, None], [7, now, 50, 90, None]]).get_json()
+    assert answer == {'stored': 1, 'skipped': 3, 'cursor': 7}
+
+
+def test_synced_results_are_flagged(web, login):
+    client = login('sync-flagged')
+    now = time.time()
+    text = 'the quick brown fox jumps over the lazy dog'
+    answer = push(client, [[1, now, 40, 95, recording(text)],
+                           [2, now, 60, 95, None],
+                           [3, now, 60, 95, 'not base64!']]).get_json()
+    assert answer['stored'] == 3
+    with web.app.app_context():
+        user = web.User.query.filter_by(username='sync-flagged').one()
+        scores = web.Score.query.filter_by(user_id=user.id).order_by(web.Score.id).all()
+        assert all(score.flagged for score in scores)
+        assert web.db.session.get(web.UserStats, user.id) is None
+        # The wpm of the first one comes from its recording, not the claimed 40
+        typed, seconds = scoring.replay(keystrokes.decode(scores[0].keystrokes))
+        assert typed == text
+        assert scores[0].wpm == scoring.result(scoring.count_words(typed), 0, 0, seconds)['wpm'] > 40
+        assert scores[2].keystrokes is None
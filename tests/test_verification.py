@@ -0,0 +1,127 @@
+"""Test tokens and the checks /save_score runs on a submission (verification.py).
+
+A submission is only as good as its keystrokes: they must replay to the
+typed text, or the text could be anything the timings never covered.
+"""
+import time
+
+import pytest
+
+import verification
+from verification import Rejected
+
+
+def typed_events(text, dt=150):
+    return [(char, dt, True) for char in text]
+
+
+def test_token_opens_for_its_player_only():
+    tokens = verification.TestTokens('secret', max_age=60)
+    token = tokens.issue(7, 1, now=100.0)
+    assert tokens.open(token, 1, now=130.0) == (7, 100.0, 30.0)
+    with pytest.raises(Rejected, match='another player'):
+        tokens.open(token, 2, now=130.0)
+    with pytest.raises(Rejected, match='expired'):
+        tokens.open(token, 1, now=161.0)
+    with pytest.raises(Rejected, match='Invalid'):
+        verification.TestTokens('other secret').open(token, 1, now=130.0)
+    with pytest.raises(Rejected, match='Missing'):
+        tokens.open(None, 1)
+
+
+def test_keystrokes_that_replay_to_the_typed_text_pass():
+    text = 'the quick brown fox jumps over the lazy dog'
+    result, flagged = verification.verify(text, text, 8.0, typed_events(text))
+    assert not flagged
+    assert result['accuracy'] == 100.0
+
+
+def test_corrections_replay_to_the_typed_text():
+    events = typed_events('the quikc') + [('\b', 150, False)] * 2 + typed_events('ck brown fox jumps over')
+    assert not verification.check_keystrokes('the quick brown fox jumps over', 8.0, events)
+
+
+def test_typed_text_the_keystrokes_do_not_spell_is_flagged():
+    text = 'the quick brown fox jumps over the lazy dog'
+    # Slow, human timings for some other text of the same length
+    events = typed_events('x' * len(text))
+    result, flagged = verification.verify(text, text, 8.0, events)
+    assert flagged
+
+
+def test_fewer_keystrokes_than_typed_characters_are_rejected():
+    text = 'the quick brown fox jumps over the lazy dog'
+    with pytest.raises(Rejected, match='Fewer keystrokes'):
+        verification.verify(text, text, 8.0, typed_events(text[:10]))
+
+
+def test_keystrokes_taking_longer_than_the_test_are_rejected():
+    with pytest.raises(Rejected, match='exceed'):
+        verification.check_keystrokes('the quick', 1.0, typed_events('the quick', dt=500))
+
+
+def test_pasted_text_is_flagged():
+    text = 'the quick brown fox jumps over the lazy dog'
+    events = [(char, 0, True) for char in text]
+    assert verification.check_keystrokes(text, 8.0, events)
+    assert verification.check_keystrokes(text, 8.0, None)
+
+
+def submit(client, token, typed, events):
+    return client.post('/save_score', json={'token': token, 'typed': typed,
+                                            'keystrokes': [list(event) for event in events]})
+
+
+def user_id(web, name):
+    with web.app.app_context():
+        return web.User.query.filter_by(username=name).one().id
+
+
+def test_token_is_good_for_one_submission(web, login):
+    client = login('verify-once')
+    token = web.test_tokens.issue(None, user_id(web, 'verify-once'), now=time.time() - 60)
+    typed = web.DEFAULT_TEXT[:100]
+    first = submit(client, token, typed, typed_events(typed))
+    assert first.status_code == 200
+    assert not first.get_json()['flagged']
+    second = submit(client, token, typed, typed_events(typed))
+    assert second.status_code == 422
+    assert second.get_json()['error'] == 'Test token was already used'
+
+
+def test_save_score_flags_typed_text_the_keystrokes_do_not_spell(web, login):
+    client = login('verify-mismatch')
+    token = web.test_tokens.issue(None, user_id(web, 'verify-mismatch'), now=time.time() - 60)
+    typed = web.DEFAULT_TEXT[:100]
+    response = submit(client, token, typed, typed_events('a' * 100))
+    assert response.status_code == 200
+    assert response.get_json()['flagged']
+
+
+def test_long_passages_are_held_to_their_own_length(web):
+    text = ' '.join(['keyboard'] * 200)
+    events = typed_events(text, dt=100)
+    result, flagged, blob = web.score_race_finish(text, text, 200.0, [list(event) for event in events])
+    assert not flagged
+    assert result['accuracy'] == 100.0
+    corrections = [['x', 100, False], ['\b', 100, False]] * (web.app.config['KEYSTROKE_ALLOWANCE'] // 2)
+    with pytest.raises(ValueError):
+        web.score_race_finish(text, text, 300.0, [list(event) for event in events] + corrections + [['x', 100, False]])
+
+
+def test_rejected_test_uses_up_its_token(web, login):
+    client = login('verify-rejected')
+    # Started a second ago, far too little time to type 100 characters
+    token = web.test_tokens.issue(None, user_id(web, 'verify-rejected'), now=time.time() - 1)
+    typed = web.DEFAULT_TEXT[:100]
+    assert submit(client, token, typed, typed_events(typed, dt=5)).status_code == 422
+    second = submit(client, token, typed, typed_events(typed, dt=5))
+    assert second.get_json()['error'] == 'Test token was already used'
+
+
+@pytest.mark.parametrize('body', ['null', '[]', '"score"', '{"token": ', ''])
+def test_save_score_refuses_bodies_that_are_not_an_object(web, login, body):
+    client = login('verify-body')
+    response = client.post('/save_score', data=body, content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid score'}
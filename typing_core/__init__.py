@@ -0,0 +1 @@
+"""GUI-free building blocks shared by the web server and the desktop apps"""
@@ -0,0 +1,136 @@
+"""Compact binary encoding of per-keystroke events.
+
+An event is (char, dt_ms, correct): the character that was typed ('\\b' for a
+deletion), the milliseconds since the previous keystroke and whether it
+matched the passage. Events are stored column-wise and zlib compressed:
+
+    version byte
+    varint  event count
+    varint  per event: (dt_ms // TIME_STEP_MS) << 1 | correct
+    utf-8   the typed characters, one per event
+
+Time is kept in 4 ms steps, so any gap under 256 ms costs a single byte
+before compression; typical typing ends up below 2 bytes per keystroke.
+"""
+import math
+import time
+import zlib
+
+VERSION = 1
+TIME_STEP_MS = 4
+# Longer pauses are clamped, a replay does not need to wait for minutes
+MAX_DT_MS = 60000
+# Upper bounds of the uncompressed data: version byte and count varint, then a
+# time varint of up to 3 bytes and a UTF-8 character of up to 4 per event
+MAX_HEADER_BYTES = 11
+MAX_EVENT_BYTES = 7
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode(events):
+    """Encode (char, dt_ms, correct) events into a compressed blob"""
+    header = bytearray([VERSION])
+    times = bytearray()
+    chars = []
+    for char, dt_ms, correct in events:
+        if len(char) != 1:
+            raise ValueError('Each keystroke must be a single character')
+        step = int(min(max(dt_ms, 0), MAX_DT_MS)) // TIME_STEP_MS
+        _write_varint(times, step << 1 | (1 if correct else 0))
+        chars.append(char)
+    _write_varint(header, len(chars))
+    return zlib.compress(bytes(header + times) + ''.join(chars).encode('utf-8'), 9)
+
+
+def decode(blob, max_events=None):
+    """Decode a blob produced by encode() back into (char, dt_ms, correct) events
+
+    With max_events, blobs holding more events are refused without inflating
+    more than such a recording can take up. Raises ValueError for anything
+    that is not a valid blob.
+    """
+    try:
+        if max_events is None:
+            data = zlib.decompress(blob)
+        else:
+            inflater = zlib.decompressobj()
+            data = inflater.decompress(blob, MAX_HEADER_BYTES + max_events * MAX_EVENT_BYTES)
+            if inflater.unconsumed_tail:
+                raise ValueError('Keystroke data holds too many events')
+            if not inflater.eof:
+                raise ValueError('Corrupt keystroke data: truncated')
+        if data[0] != VERSION:
+            raise ValueError(f'Unknown keystroke encoding version {data[0]}')
+        count, pos = _read_varint(data, 1)
+        if max_events is not None and count > max_events:
+            raise ValueError('Keystroke data holds too many events')
+        values = []
+        for _ in range(count):
+            value, pos = _read_varint(data, pos)
+            values.append(value)
+        chars = data[pos:].decode('utf-8')
+    except (zlib.error, IndexError, TypeError) as e:
+        raise ValueError(f'Corrupt keystroke data: {e}')
+    if len(chars) != count:
+        raise ValueError('Corrupt keystroke data')
+    return [(char, (value >> 1) * TIME_STEP_MS, bool(value & 1))
+            for char, value in zip(chars, values)]
+
+
+def parse_events(raw, limit=1000):
+    """Validate client supplied [char, dt_ms, correct] triples"""
+    if not isinstance(raw, list) or len(raw) > limit:
+        raise ValueError('Invalid keystroke list')
+    events = []
+    for item in raw:
+        char, dt_ms, correct = item
+        if not isinstance(char, str) or len(char) != 1:
+            raise ValueError('Invalid keystroke character')
+        try:
+            # Lone surrogates get through JSON but cannot be stored as UTF-8
+            char.encode('utf-8')
+        except UnicodeEncodeError:
+            raise ValueError('Invalid keystroke character')
+        dt_ms = float(dt_ms)
+        if not math.isfinite(dt_ms):
+            raise ValueError('Invalid keystroke time')
+        events.append((char, dt_ms, bool(correct)))
+    return events
+
+
+class KeystrokeRecorder:
+    """Collects keystroke events with their timing for one test"""
+
+    def __init__(self):
+        self.events = []
+        self._last = None
+
+    def reset(self):
+        self.events = []
+        self._last = time.perf_counter()
+
+    def record(self, char, correct):
+        now = time.perf_counter()
+        dt_ms = 0 if self._last is None else (now - self._last) * 1000
+        self._last = now
+        self.events.append((char, dt_ms, correct))
+
+    def encode(self):
+        return encode(self.events)
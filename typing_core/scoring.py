@@ -0,0 +1,138 @@
+"""Scoring rules shared by the desktop app, the console app and the server.
+
+One definition for every front-end:
+
+    words      whitespace separated words typed, len(typed.split())
+    correct    typed characters matching the passage at the same position
+    wpm        words per minute of elapsed time
+    accuracy   correct characters as a percentage of the passage length
+
+score() computes a result from scratch. IncrementalScorer keeps the same
+counters up to date while a test is typed, at O(1) per keystroke at the end
+of the text. replay() rebuilds the typed text and the typing time from
+recorded keystrokes (see typing_core.keystrokes), so the server can
+recompute a submitted score instead of trusting it.
+"""
+import operator
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def count_correct(typed, reference):
+    """Characters of typed that match reference at the same position"""
+    # Error-free text, the common case, is a single memory comparison
+    if reference.startswith(typed):
+        return len(typed)
+    return sum(map(operator.eq, typed, reference))
+
+
+def result(words, correct, reference_length, seconds):
+    """Build the wpm/accuracy/time result reported by every front-end"""
+    wpm = words / (seconds / 60) if seconds > 0 else 0.0
+    accuracy = correct / reference_length * 100 if reference_length else 0.0
+    return {
+        'wpm': round(wpm, 1),
+        'accuracy': round(accuracy, 1),
+        'time': round(seconds, 1)
+    }
+
+
+def score(typed, reference, seconds):
+    """Score a finished test from the full typed text"""
+    return result(count_words(typed), count_correct(typed, reference), len(reference), seconds)
+
+
+def replay(events):
+    """Rebuild (typed text, seconds) from (char, dt_ms, correct) keystroke events
+
+    A '\\b' deletes the character before it. Edits are assumed to happen at
+    the end of the text, which is where the recorders see almost all of them.
+    """
+    typed = []
+    total_ms = 0.0
+    for char, dt_ms, _ in events:
+        total_ms += dt_ms
+        if char == '\b':
+            if typed:
+                typed.pop()
+        else:
+            typed.append(char)
+    return ''.join(typed), total_ms / 1000
+
+
+def within(claimed, computed, relative=0.1, absolute=2.0):
+    """Whether a claimed value is no higher than the computed one, give or take the tolerance"""
+    return claimed <= computed * (1 + relative) + absolute
+
+
+class IncrementalScorer:
+    """Scoring state of a test in progress.
+
+    Instead of recounting the whole text on every keystroke, only the
+    inserted or deleted characters are accounted for. Edits at the end of
+    the text (the normal case while typing) cost O(1) per character, edits
+    in the middle recount the rest of the text from the edit onwards. The
+    counters always equal what score() computes from the full text.
+    """
+
+    def __init__(self, reference):
+        self.reference = reference
+        self.typed = []
+        self.correct_chars = 0
+        self.error_positions = set()
+        self.word_count = 0
+
+    def _append(self, char):
+        position = len(self.typed)
+        if position < len(self.reference):
+            if char == self.reference[position]:
+                self.correct_chars += 1
+            else:
+                self.error_positions.add(position)
+        if not char.isspace() and (position == 0 or self.typed[-1].isspace()):
+            self.word_count += 1
+        self.typed.append(char)
+
+    def _pop(self):
+        char = self.typed.pop()
+        position = len(self.typed)
+        if position < len(self.reference):
+            if char == self.reference[position]:
+                self.correct_chars -= 1
+            else:
+                self.error_positions.discard(position)
+        if not char.isspace() and (position == 0 or self.typed[-1].isspace()):
+            self.word_count -= 1
+
+    def _truncate(self, index):
+        # Remove everything from index on and return what was removed
+        tail = self.typed[index:]
+        while len(self.typed) > index:
+            self._pop()
+        return tail
+
+    def insert(self, index, text):
+        tail = self._truncate(index)
+        for char in text:
+            self._append(char)
+        for char in tail:
+            self._append(char)
+
+    def delete(self, index, count):
+        tail = self._truncate(index)
+        for char in tail[count:]:
+            self._append(char)
+
+    def reset(self, text=''):
+        """Start over from text, e.g. after an edit that was not tracked"""
+        self._truncate(0)
+        self.insert(0, text)
+
+    def is_complete(self):
+        """The passage was typed completely and without errors"""
+        return len(self.typed) == len(self.reference) and self.correct_chars == len(self.reference)
+
+    def result(self, seconds):
+        return result(self.word_count, self.correct_chars, len(self.reference), seconds)
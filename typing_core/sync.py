@@ -0,0 +1,195 @@
+"""Offline-first upload of local results to the web server.
+
+The apps always save a result locally first, and their result stores double
+as the outbox: an outbox hands out results in the order they were saved,
+each with a local id that only grows. SyncClient pushes everything the
+server has not stored yet to /sync/scores in gzip compressed batches:
+
+    POST /sync/scores
+    Content-Encoding: gzip
+    Idempotency-Key: <device>:<first id>-<last id>
+
+    {"device": "...", "results": [[id, unix_time, wpm, accuracy, keystrokes], ...]}
+
+keystrokes is a base64 typing_core.keystrokes blob or null. The server keeps
+a delta cursor per device, the highest local id it has stored, and answers
+every batch with {"stored", "skipped", "cursor"}; GET /sync/scores?device=...
+returns the cursor to resume from. Sending a batch again (after a lost
+response, say) therefore stores nothing twice: results at or below the cursor
+are skipped and a repeated Idempotency-Key gets the original answer back.
+
+Network errors, 5xx and 429 answers are retried with exponential backoff and
+jitter; when the server stays unreachable the results simply wait in the
+outbox for the next sync.
+
+An outbox provides:
+
+    device                  stable id of this result store, at most 64 characters
+    pending(after, limit)   up to limit results with an id above after, oldest first
+    synced(cursor)          everything up to cursor is on the server
+"""
+import base64
+import gzip
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+
+class SyncError(Exception):
+    pass
+
+
+def encode_keystrokes(blob):
+    """Encode a keystroke blob for a sync batch"""
+    return base64.b64encode(blob).decode('ascii') if blob else None
+
+
+def _json(raw):
+    try:
+        return json.loads(raw or b'null')
+    except ValueError:
+        return None
+
+
+class SyncClient:
+    def __init__(self, base_url, username, password, batch_size=2000, attempts=6,
+                 backoff=0.5, max_backoff=30.0, timeout=30, sleep=time.sleep):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.batch_size = batch_size
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.sleep = sleep
+        self.requests = 0
+        self.bytes_sent = 0
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self._logged_in = False
+
+    def _delay(self, attempt, retry_after):
+        # Full jitter keeps clients that failed together from retrying together
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        return delay
+
+    def _request(self, method, path, body=None, headers=None):
+        """Send one request, retrying transient failures, and return (status, JSON body)"""
+        for attempt in range(self.attempts):
+            request = urllib.request.Request(self.base_url + path, data=body, method=method,
+                                             headers=headers or {})
+            retry_after = None
+            self.requests += 1
+            self.bytes_sent += len(body or b'')
+            try:
+                with self._opener.open(request, timeout=self.timeout) as response:
+                    return response.status, _json(response.read())
+            except urllib.error.HTTPError as e:
+                if e.code not in RETRY_STATUSES:
+                    return e.code, _json(e.read())
+                retry_after = e.headers.get('Retry-After')
+                error = f"HTTP {e.code}"
+            except OSError as e:
+                # URLError, timeouts and dropped connections
+                error = str(e)
+            if attempt + 1 < self.attempts:
+                self.sleep(self._delay(attempt, retry_after))
+        raise SyncError(f"{method} {path} failed after {self.attempts} attempts: {error}")
+
+    def login(self):
+        status, body = self._request('POST', '/login',
+                                     json.dumps({'username': self.username,
+                                                 'password': self.password}).encode('utf-8'),
+                                     {'Content-Type': 'application/json'})
+        if status != 200:
+            raise SyncError((body or {}).get('error') or f"Login failed with HTTP {status}")
+        self._logged_in = True
+
+    def _call(self, method, path, body=None, headers=None):
+        if not self._logged_in:
+            self.login()
+        status, answer = self._request(method, path, body, headers)
+        if status == 401:
+            # The session expired, log in again once
+            self.login()
+            status, answer = self._request(method, path, body, headers)
+        if status != 200:
+            raise SyncError((answer or {}).get('error') or f"{method} {path} failed with HTTP {status}")
+        return answer
+
+    def cursor(self, device):
+        """Return (cursor, largest accepted batch) for device"""
+        answer = self._call('GET', '/sync/scores?' + urllib.parse.urlencode({'device': device}))
+        return answer['cursor'], answer['maxBatch']
+
+    def push(self, device, results):
+        """Send one batch and return the server's answer"""
+        payload = gzip.compress(json.dumps({'device': device, 'results': results},
+                                           separators=(',', ':')).encode('utf-8'), 6)
+        return self._call('POST', '/sync/scores', payload, {
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
+            # Derived from the batch, so a batch sent again after a crash reuses it
+            'Idempotency-Key': f"{device}:{results[0][0]}-{results[-1][0]}"
+        })
+
+    def sync(self, outbox):
+        """Push every result the server has not stored yet and return how many were stored"""
+        cursor, max_batch = self.cursor(outbox.device)
+        limit = max(1, min(self.batch_size, max_batch))
+        stored = 0
+        while True:
+            results = outbox.pending(cursor, limit)
+            if not results:
+                break
+            answer = self.push(outbox.device, results)
+            if answer['cursor'] < results[-1][0]:
+                raise SyncError('The server did not accept the batch')
+            stored += answer['stored']
+            cursor = answer['cursor']
+            outbox.synced(cursor)
+        return stored
+
+
+class BackgroundSync:
+    """Run client.sync(outbox) on a daemon thread whenever kick() is called
+
+    Kicks that arrive while a sync is running are folded into one more run.
+    """
+
+    def __init__(self, client, outbox):
+        self.client = client
+        self.outbox = outbox
+        self.last_error = None
+        self.stored = 0
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def kick(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='result-sync', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.stored += self.client.sync(self.outbox)
+                self.last_error = None
+            except Exception as e:
+                # Offline or rejected: the results stay queued for the next kick
+                self.last_error = e